@@ -0,0 +1,212 @@
+"""
+Admission control of concurrent requests to the trackit API
+
+Each request takes a slot of its process's budget for its class of route,
+e.g. normal or expensive, and one of its namespace's budget of that class
+for as long as it's handled. Budgets are counted per process, so a server
+running several worker processes admits that many times as many requests in
+all. A request finding a budget full waits for a slot until a deadline and
+is rejected if none frees up in time, naming the scope of the budget that
+was full, so that one namespace's bulk loads queue behind each other instead
+of starving every other namespace.
+"""
+
+import asyncio
+import collections
+import threading
+import time
+
+# scopes of budgets, a process's for all namespaces and one namespace's
+GLOBAL = "global"
+NAMESPACE = "namespace"
+
+
+class Rejected(Exception):
+    """
+    Raised when a request isn't admitted before its deadline
+    """
+
+    def __init__(self, scope, retry_after):
+        """
+        Initialize with the scope of the full budget, GLOBAL or NAMESPACE, and
+        the seconds after which to retry
+        """
+        super().__init__("{} request budget exhausted".format(scope))
+        self.scope = scope
+        self.retry_after = retry_after
+
+
+class _Admission(object):
+    """
+    Abstract base class of admission controls, which count the requests in
+    flight per class and per class and namespace
+    """
+
+    def __init__(self, limits, timeout=0.5, retry_after=1,
+                 clock=time.monotonic):
+        """
+        Initialize
+
+        limits maps each class of request to its (per process, per
+        namespace) limits on requests in flight, where 0 is no limit.
+        Requests wait up to timeout seconds for a slot and are told to retry
+        after retry_after seconds if they don't get one.
+        """
+        self.limits = limits
+        self.timeout = timeout
+        self.retry_after = retry_after
+        self.clock = clock
+        self.waiting = 0
+        self.counters = collections.Counter()
+        self._in_flight = collections.Counter()
+        self._namespaces = collections.Counter()
+
+    def _full(self, kind, namespace):
+        """
+        Return the scope of a full budget a request needs or None
+        """
+        total, per_namespace = self.limits[kind]
+        if total and self._in_flight[kind] >= total:
+            return GLOBAL
+        if (namespace is not None and per_namespace
+                and self._namespaces[kind, namespace] >= per_namespace):
+            return NAMESPACE
+        return None
+
+    def _take(self, kind, namespace):
+        """
+        Take a slot of the budgets of a request
+        """
+        self._in_flight[kind] += 1
+        if namespace is not None:
+            self._namespaces[kind, namespace] += 1
+        self.counters["admitted"] += 1
+
+    def _give_back(self, kind, namespace):
+        """
+        Give back a slot of the budgets of a request
+        """
+        self._in_flight[kind] -= 1
+        if namespace is not None:
+            self._namespaces[kind, namespace] -= 1
+            if not self._namespaces[kind, namespace]:
+                del self._namespaces[kind, namespace]
+
+    def _reject(self, scope):
+        """
+        Raise the rejection of a request for a full budget
+        """
+        self.counters["rejected_{}".format(scope)] += 1
+        raise Rejected(scope, self.retry_after)
+
+    def stats(self):
+        """
+        Return metrics describing the requests in flight and their limits
+        """
+        return {
+            "limits": dict(self.limits),
+            "in_flight": {kind: self._in_flight[kind]
+                          for kind in self.limits},
+            "namespaces": len(self._namespaces),
+            "waiting": self.waiting,
+            "counters": dict(self.counters),
+        }
+
+
+class Admission(_Admission):
+    """
+    Admission control of requests handled on concurrent threads
+    """
+
+    def __init__(self, limits, timeout=0.5, retry_after=1,
+                 clock=time.monotonic):
+        """
+        Initialize
+        """
+        super().__init__(limits, timeout, retry_after, clock)
+        self._cond = threading.Condition()
+
+    def acquire(self, kind, namespace=None):
+        """
+        Take a slot for a request of a class in a namespace, or in none,
+        waiting until the deadline if a budget is full
+
+        Raises Rejected if no slot frees up in time.
+        """
+        deadline = self.clock() + self.timeout
+        with self._cond:
+            scope = self._full(kind, namespace)
+            if scope is not None:
+                self.counters["queued"] += 1
+                self.waiting += 1
+                try:
+                    while scope is not None:
+                        remaining = deadline - self.clock()
+                        if remaining <= 0:
+                            self._reject(scope)
+                        self._cond.wait(remaining)
+                        scope = self._full(kind, namespace)
+                finally:
+                    self.waiting -= 1
+            self._take(kind, namespace)
+
+    def release(self, kind, namespace=None):
+        """
+        Give back the slot of a finished request
+        """
+        with self._cond:
+            self._give_back(kind, namespace)
+            self._cond.notify_all()
+
+
+class AsyncAdmission(_Admission):
+    """
+    Admission control of requests handled by tasks of one event loop
+    """
+
+    def __init__(self, limits, timeout=0.5, retry_after=1,
+                 clock=time.monotonic):
+        """
+        Initialize
+        """
+        super().__init__(limits, timeout, retry_after, clock)
+        # created on first use so that it belongs to the serving event loop
+        self._cond = None
+
+    async def acquire(self, kind, namespace=None):
+        """
+        Take a slot for a request of a class in a namespace, or in none,
+        waiting until the deadline if a budget is full
+
+        Raises Rejected if no slot frees up in time.
+        """
+        if self._cond is None:
+            self._cond = asyncio.Condition()
+        deadline = self.clock() + self.timeout
+        async with self._cond:
+            scope = self._full(kind, namespace)
+            if scope is not None:
+                self.counters["queued"] += 1
+                self.waiting += 1
+                try:
+                    while scope is not None:
+                        remaining = deadline - self.clock()
+                        if remaining <= 0:
+                            self._reject(scope)
+                        try:
+                            await asyncio.wait_for(self._cond.wait(),
+                                                   remaining)
+                        except asyncio.TimeoutError:
+                            pass
+                        scope = self._full(kind, namespace)
+                finally:
+                    self.waiting -= 1
+            self._take(kind, namespace)
+
+    async def release(self, kind, namespace=None):
+        """
+        Give back the slot of a finished request
+        """
+        async with self._cond:
+            self._give_back(kind, namespace)
+            self._cond.notify_all()
@@ -0,0 +1,819 @@
+"""
+Asyncio server for the trackit API
+
+Serves the same routes as api.api.API with aiohttp, sharing its request and
+response logic from api.handlers. Storage operations run on the rethinkdb
+driver's asyncio connection so that in-flight requests don't each hold a
+thread. Run with `python -m api.aio`.
+"""
+
+import asyncio
+import contextvars
+import functools
+import itertools
+import logging
+import time
+
+import rethinkdb as r
+from aiohttp import web
+from werkzeug.datastructures import MIMEAccept
+from werkzeug.exceptions import BadRequest, HTTPException, ServiceUnavailable
+from werkzeug.http import parse_accept_header
+
+from api import admission, columnar, db, encoding, handlers, metrics, settings
+from api.batching import AsyncWriteBatcher
+from api.handlers import INVALIDATE_HEADER, ROUTE_BUDGETS
+from api.pool import BACKOFF_SCHEDULE
+from api.storage import STREAM_BATCH_SIZE, AsyncRethinkDBStorage
+from api.views import AsyncSchemataView
+
+LOGGER = logging.getLogger(__name__)
+
+# names changed by the request being handled, like flask.g.invalidated
+INVALIDATED = contextvars.ContextVar("invalidated", default=None)
+
+
+class AsyncAPI(handlers.BaseAPI):
+    """
+    Wrapper for the aiohttp API application
+    """
+    admission_class = admission.AsyncAdmission
+    batcher_class = AsyncWriteBatcher
+    metered_storage_class = metrics.AsyncMeteredStorage
+
+    def __init__(self, db_connection, db_name, connect, **options):
+        """
+        Initialize
+
+        connect is a coroutine function opening an asyncio db connection to
+        the RethinkDB database db_name of db_connection. A single connection
+        is shared by all requests as the driver multiplexes queries over it.
+        options are those of api.handlers.BaseAPI, where a schemata view must
+        be an api.views.AsyncSchemataView, which is started with the
+        application.
+        """
+        self.connect = connect
+        self.conn = None
+        self._connect_lock = None
+        self._tasks = set()
+        super().__init__(
+            AsyncRethinkDBStorage(db_connection, db_name, run=self._run),
+            **options)
+        self.app = web.Application()
+        self._route("GET", '/schemata/', self.get_namespaces_schemata)
+        self._route("GET", '/schemata/{username}/', self.get_schemata)
+        self._route("PUT", '/schemata/{username}/{name}/', self.set_schema)
+        self._route("GET", '/data/{username}/{schema}/', self.get_data)
+        self._route("PUT", '/data/{username}/{schema}/', self.set_data)
+        self._route("PUT", '/data/{username}/{schema}/{key}/', self.set_datum)
+        self._route("GET", '/data/{username}/{schema}/{key}/', self.get_datum)
+        self._route("GET", '/aggregate/{username}/{schema}/',
+                    self.get_aggregate)
+        self._route("GET", '/export/{username}/{schema}/', self.get_export)
+        self._route("GET", '/archive/', self.get_archive)
+        self._route("PUT", '/archive/', self.restore_archive)
+        self._route("POST", '/purge/', self.purge)
+        self._route("POST", '/purge/{username}/', self.purge_namespace)
+        self._route("POST", '/purge/{username}/{schema}/', self.purge_schema)
+        self._route("GET", '/jobs/{job_id}/', self.get_job)
+        self._route("GET", '/health/pool/', self.get_pool_stats)
+        self._route("GET", '/health/live/', self.get_liveness)
+        self._route("GET", '/health/ready/', self.get_readiness)
+        self._route("GET", '/metrics', self.get_metrics)
+        if self.schemata_view is not None:
+            self.app.on_startup.append(self._start_view)
+
+    async def _start_view(self, app):
+        """
+        Start following the schemata view's changefeed on the serving loop
+        """
+        self.schemata_view.start()
+
+    async def _connection(self):
+        """
+        Return the shared db connection reconnecting with backoff if needed
+        """
+        if self._connect_lock is None:
+            self._connect_lock = asyncio.Lock()
+        async with self._connect_lock:
+            if self.conn is not None and self.conn.is_open():
+                return self.conn
+            for sleepsecs in BACKOFF_SCHEDULE:
+                try:
+                    self.conn = await self.connect()
+                    return self.conn
+                except Exception:  # pylint: disable=broad-except
+                    LOGGER.exception("Could not connect to db")
+                    await asyncio.sleep(sleepsecs)
+        raise ServiceUnavailable("no db connection available")
+
+    async def _run(self, query, **kwargs):
+        """
+        Run a query on the shared connection
+        """
+        conn = await self._connection()
+        with self.metrics.query_seconds.time():
+            return await query.run(conn, **kwargs)
+
+    def _route(self, method, path, handler):
+        """
+        Register a handler for a path with its result encoded for the client
+
+        Handlers return the object to send, optionally paired with a dict of
+        headers and a status code, or an aiohttp response which is sent as
+        is, and raise werkzeug HTTP exceptions which are sent as flask would.
+        Requests are only handled once admitted within the budget of the
+        route. The latency, status and response size of each request are
+        recorded in the metrics.
+        """
+        route = handler.__name__
+        budget = ROUTE_BUDGETS.get(route, "normal")
+
+        @functools.wraps(handler)
+        async def view(request):
+            """
+            Call the handler and encode its result
+            """
+            started = time.perf_counter()
+            in_flight = self.metrics.requests_in_flight.labels(route)
+            in_flight.inc()
+            status = 500
+            invalidated = set()
+            INVALIDATED.set(invalidated)
+            namespace = request.match_info.get("username")
+            admitted = False
+            try:
+                try:
+                    await self._admit(budget, namespace)
+                    admitted = budget is not None
+                    response = self._respond(
+                        request, route, await handler(request,
+                                                      **request.match_info))
+                except HTTPException as error:
+                    response = web.Response(
+                        body=error.get_body(),
+                        status=error.code,
+                        headers=dict(error.get_headers()))
+                status = response.status
+                self._add_invalidations(response, invalidated)
+                return response
+            finally:
+                if admitted:
+                    await self.admission.release(budget, namespace)
+                in_flight.dec()
+                self.metrics.request_seconds.labels(
+                    route, request.method,
+                    status).observe(time.perf_counter() - started)
+
+        self.app.router.add_route(method, path, view)
+
+    async def _admit(self, budget, namespace):
+        """
+        Wait for a slot of a budget for a request in a namespace, or in none,
+        unless the budget is None
+
+        Raises a 429 if the namespace's budget stays full and a 503 if the
+        process's does.
+        """
+        if budget is None:
+            return
+        try:
+            await self.admission.acquire(budget, namespace)
+        except admission.Rejected as error:
+            raise handlers.rejection(error)
+
+    @staticmethod
+    def _invalidate(names):
+        """
+        Record that the current request changed the named namespaces and
+        namespace/schema pairs, or everything for "*"
+        """
+        invalidated = INVALIDATED.get()
+        if invalidated is not None:
+            invalidated.update(names)
+
+    @staticmethod
+    def _add_invalidations(response, invalidated):
+        """
+        Tell caches in front of the API what a request changed
+        """
+        if invalidated and not response.prepared:
+            response.headers[INVALIDATE_HEADER] = (
+                handlers.invalidation_header(invalidated))
+
+    def _respond(self, request, route, result):
+        """
+        Return the response for the result of a route's handler
+        """
+        if isinstance(result, web.Response):
+            self.metrics.response_bytes.labels(route).observe(
+                result.content_length or 0)
+        if isinstance(result, web.StreamResponse):
+            return result
+        headers = {}
+        status = 200
+        if isinstance(result, tuple):
+            if len(result) == 3:
+                result, headers, status = result
+            else:
+                result, headers = result
+        mimetype, codec = encoding.negotiate(
+            parse_accept_header(request.headers.get("Accept"), MIMEAccept))
+        pretty = encoding.is_pretty(request.query.get("pretty"))
+        with self.metrics.encode_seconds.labels(codec.mimetype).time():
+            body = codec.dumps(result, pretty=pretty)
+        self.metrics.response_bytes.labels(route).observe(len(body))
+        return web.Response(
+            body=body,
+            status=status,
+            content_type=mimetype,
+            headers=headers)
+
+    @staticmethod
+    async def _decode_body(request):
+        """
+        Decode the body of a request according to its Content-Type
+        """
+        try:
+            return encoding.decode(request.content_type, await request.read())
+        except ValueError:
+            raise BadRequest("malformed request body")
+
+    @staticmethod
+    async def _stream(request, pieces, content_type, headers=None):
+        """
+        Stream an asynchronous iterable of strings or bytes in chunks
+        """
+        response = web.StreamResponse(headers=headers)
+        response.content_type = content_type
+        await response.prepare(request)
+        chunk = []
+        async for piece in pieces:
+            chunk.append(
+                piece.encode("utf-8") if isinstance(piece, str) else piece)
+            if len(chunk) >= STREAM_BATCH_SIZE:
+                await response.write(b"".join(chunk))
+                chunk = []
+        if chunk:
+            await response.write(b"".join(chunk))
+        await response.write_eof()
+        return response
+
+    async def _upsert(self, table, rows, durability="hard"):
+        """
+        Upsert schemata or data rows stamped with the time they're written
+        """
+        return await self.storage.upsert(table, handlers.stamp(rows),
+                                         durability)
+
+    async def _upsert_data(self, rows, durability="hard"):
+        """
+        Upsert data rows and return the error writing each row or None
+        """
+        errors = [None] * len(rows)
+        if (await self._upsert("data", rows, durability))["errors"]:
+            # attribute the failures by retrying the batch row by row
+            errors = [
+                handlers.first_error(await self._upsert(
+                    "data", [row], durability)) for row in rows
+            ]
+        await self._bump_versions(self._written("data", rows))
+        return errors
+
+    async def _write_batches(self, batches):
+        """
+        Upsert (table, rows) batches of schemata or data rows
+        """
+        for table, rows in batches:
+            await self._upsert(table, rows)
+            await self._bump_versions(self._written(table, rows))
+
+    async def _bump_versions(self, names):
+        """
+        Record that the named namespaces and namespace/schema pairs changed
+        """
+        if names:
+            await self.storage.upsert("versions",
+                                      handlers.versions_rows(names))
+            self._invalidate(names)
+
+    async def _conditional(self, request, names, produce):
+        """
+        Return the result of awaiting produce tagged with the current versions
+        of the namespaces and namespace/schema pairs it depends on, or a 304
+        if the client already has those versions
+        """
+        entries = [await self.storage.get("versions", name) for name in names]
+        if None in entries:
+            return await produce()
+        headers, fresh = handlers.conditional_headers(
+            entries, request.query_string, request.headers.get("Accept"),
+            request.headers.get("If-None-Match"))
+        if fresh:
+            return web.Response(status=304, headers=headers)
+        return handlers.with_headers(await produce(), headers)
+
+    async def get_schemata(self, request, username):
+        """
+        Get all schemata in a namespace
+        """
+        if self._view_current(username):
+            return self.schemata_view.namespace(username)
+
+        async def produce():
+            """
+            Read the schemata of the namespace
+            """
+            return handlers.namespace_schemata(
+                username, await self.storage.get_all("schemata", "username",
+                                                     username))
+
+        return await self._conditional(request, [username], produce)
+
+    async def get_namespaces_schemata(self, request):
+        """
+        Get all schemata in each namespace given by the namespace argument
+        """
+        namespaces = request.query.getall("namespace", [])
+        if not namespaces:
+            raise BadRequest("no namespace given")
+        schemata = self._view_schemata(namespaces)
+        remaining = [
+            namespace for namespace in namespaces if namespace not in schemata
+        ]
+        if remaining:
+            schemata.update(
+                handlers.group_schemata(
+                    remaining, await self.storage.get_all(
+                        "schemata", "username", *remaining)))
+        return schemata
+
+    async def set_schema(self, request, username, name):
+        """
+        Set a schema given its name and namespace
+        """
+        body = await self._decode_body(request)
+        await self._write_batches(
+            [("schemata", [handlers.schema_row(username, name, body)])])
+        return {name: body}
+
+    async def _validator(self, username, schema):
+        """
+        Return the compiled validator for a schema, compiling and caching it
+        on first use
+
+        Cached validators are used only while their schema is at the revision
+        they were compiled at, like in api.api.API._validator.
+        """
+        name = "{}/{}".format(username, schema)
+        revision = self._validator_revision(username, schema)
+        validator = self.validators.get(name, revision)
+        if validator is None:
+            validator = handlers.compile_validator(
+                name, await self._schema_body(username, schema))
+            self.validators.set(name, revision, validator)
+        return validator
+
+    async def _schema_body(self, username, schema):
+        """
+        Return the body of a schema or raise a 404 if it doesn't exist
+        """
+        if self._view_current(username):
+            body = self.schemata_view.get(username, schema)
+        else:
+            entry = await self.storage.get("schemata", "{}/{}".format(
+                username, schema))
+            body = entry and entry["body"]
+        return handlers.schema_body("{}/{}".format(username, schema), body)
+
+    async def get_aggregate(self, request, username, schema):
+        """
+        Aggregate a field of the data of a schema
+
+        Supports the same arguments as api.api.API.get_aggregate.
+        """
+        aggregate, field, grouping = handlers.aggregation(
+            await self._schema_body(username, schema), request.query)
+
+        async def produce():
+            """
+            Run the aggregation
+            """
+            return handlers.aggregation_result(
+                await self.storage.aggregate(
+                    username,
+                    schema,
+                    aggregate,
+                    field=field,
+                    grouping=grouping,
+                    start=request.query.get("start"),
+                    end=request.query.get("end")), grouping)
+
+        # the result depends on the schema, versioned with its namespace, as
+        # well as on the data
+        return await self._conditional(
+            request, ["{}/{}".format(username, schema), username], produce)
+
+    async def get_export(self, request, username, schema):
+        """
+        Export the data of a schema for analytics
+
+        Supports the same format argument as api.api.API.get_export.
+        """
+        fmt = handlers.export_format(request.query)
+        cols = handlers.export_columns(await self._schema_body(
+            username, schema))
+        mimetype, header, batch, end = columnar.FORMATS[fmt]
+        data = await self.storage.get_all(
+            "data", "username_schema", [username, schema], stream=True)
+
+        async def pieces():
+            """
+            Yield the header, batches and end of the export
+            """
+            yield header(cols)
+            rows = []
+            async for entry in data:
+                rows.append(handlers.export_row(username, schema, entry))
+                if len(rows) >= STREAM_BATCH_SIZE:
+                    yield batch(cols, rows)
+                    rows = []
+            if rows:
+                yield batch(cols, rows)
+            if end:
+                yield end
+
+        return await self._stream(request, pieces(), mimetype)
+
+    async def get_data(self, request, username, schema):
+        """
+        Get all data for a schema given its name and a namespace
+
+        Supports the same start, end, limit and continuation arguments as
+        api.api.API.get_data.
+        """
+        return await self._conditional(
+            request, ["{}/{}".format(username, schema)],
+            lambda: self._get_data(request, username, schema))
+
+    async def _get_data(self, request, username, schema):
+        """
+        Get all or a range of data for a schema
+        """
+        if not any(arg in request.query for arg in handlers.PAGE_ARGS):
+            return handlers.data_result(
+                username, schema, await self.storage.get_all(
+                    "data", "username_schema", [username, schema]))
+        start, end, after, limit = handlers.page_args(request.query)
+        entries = await self.storage.scan_schema(
+            username,
+            schema,
+            start=start,
+            end=end,
+            after=after,
+            limit=limit + 1 if limit is not None else None)
+        return handlers.page_result(username, schema, entries, limit)
+
+    async def set_datum(self, request, username, schema, key):
+        """
+        Set a datum given its key, schema name, and namespace
+
+        Supports the same durability argument and write batching as
+        api.api.API.set_datum.
+        """
+        body = await self._decode_body(request)
+        handlers.check_datum(await self._validator(username, schema), body)
+        durability = self._durability(request.query)
+        row = handlers.datum_row(username, schema, key, body)
+        if self.datum_batchers is None:
+            error = (await self._upsert_data([row], durability))[0]
+        else:
+            error = await self.datum_batchers[durability].submit(row)
+        return self._datum_written(row, error)
+
+    async def set_data(self, request, username, schema):
+        """
+        Set many data for a schema given a map of key to datum or a stream of
+        line-delimited {"key": ..., "datum": ...} records
+        """
+        batch_size = self._batch_size(request.query)
+        durability = self._durability(request.query)
+        validate = await self._validator(username, schema)
+        results = {}
+
+        async def write(items):
+            """
+            Validate and upsert a batch of (key, datum) pairs and add their
+            outcome to the results
+            """
+            batch_results, rows = handlers.datum_rows(username, schema, items,
+                                                      validate)
+            results.update(batch_results)
+            if rows:
+                results.update(
+                    handlers.write_results(
+                        username, schema, rows, await self._upsert_data(
+                            rows, durability)))
+
+        if request.content_type == "application/x-ndjson":
+            batch = []
+            lineno = 0
+            async for line in request.content:
+                lineno += 1
+                item = handlers.datum_item(line, lineno)
+                if item is not None:
+                    batch.append(item)
+                if len(batch) >= batch_size:
+                    await write(batch)
+                    batch = []
+            await write(batch)
+            return results
+        items = handlers.data_items(await self._decode_body(request))
+        while True:
+            batch = list(itertools.islice(items, batch_size))
+            if not batch:
+                return results
+            await write(batch)
+
+    async def get_datum(self, request, username, schema, key):
+        """
+        Get a datum given its key, schema name, and namespace
+        """
+        fullkey = "{}/{}/{}".format(username, schema, key)
+        datum = self.datum_cache.get(fullkey)
+        if datum is None:
+            datum = self._datum_read(
+                fullkey, await self.storage.get("data", fullkey))
+        return datum
+
+    async def get_archive(self, request):
+        """
+        Get an archive of all schemata and data for all namespaces
+
+        Supports the same stream, format and since arguments as
+        api.api.API.get_archive.
+        """
+        since = handlers.parse_since(request.query)
+        if since is not None or request.query.get("format") == "ndjson":
+            headers = self._watermark()
+            pieces = (self._stream_archive_delta(since) if since is not None
+                      else self._stream_archive_ndjson())
+            return await self._stream(request, pieces, "application/x-ndjson",
+                                      headers)
+        if request.query.get("stream"):
+            return await self._stream(request, self._stream_archive_json(),
+                                      "application/json")
+        return handlers.nested_archive(
+            await self.storage.scan("schemata"), await
+            self.storage.scan("data"))
+
+    async def _iter_archive(self):
+        """
+        Iterate over (schemata row, data cursor) for all schemata ordered by
+        name such that schemata of a namespace are adjacent
+        """
+        async for entry in await self.storage.scan(
+                "schemata", ordered=True, stream=True):
+            namespace, schema_name = entry["name"].split("/")
+            yield entry, await self.storage.get_all(
+                "data", "username_schema", [namespace, schema_name],
+                stream=True)
+
+    async def _stream_archive_json(self):
+        """
+        Yield the pieces of an archive in the nested JSON format
+        """
+        archive = handlers.ArchiveJSON()
+        yield archive.start()
+        async for entry, data in self._iter_archive():
+            yield archive.schema(entry)
+            async for datum in data:
+                yield archive.datum(datum)
+            yield archive.end_schema()
+        yield archive.end()
+
+    async def _stream_archive_ndjson(self):
+        """
+        Yield the lines of an archive with one schema or datum record per line
+        """
+        async for entry, data in self._iter_archive():
+            yield handlers.ndjson_line(handlers.schema_record(entry))
+            async for datum in data:
+                yield handlers.ndjson_line(handlers.datum_record(datum))
+
+    async def _stream_archive_delta(self, since):
+        """
+        Yield the lines of an archive of the schemata and data written since a
+        watermark, after a purge record for everything, namespace or schema
+        purged since in the order they were purged
+        """
+        for record in handlers.purge_records(
+                await self.storage.scan("tombstones"), since):
+            yield handlers.ndjson_line(record)
+        async for entry in await self.storage.scan_modified(
+                "schemata", since, stream=True):
+            yield handlers.ndjson_line(handlers.schema_record(entry))
+        async for entry in await self.storage.scan_modified(
+                "data", since, stream=True):
+            yield handlers.ndjson_line(handlers.datum_record(entry))
+
+    async def restore_archive(self, request):
+        """
+        Restore an archive
+
+        Supports the same bodies as api.api.API.restore_archive.
+        """
+        if request.content_type == "application/x-ndjson":
+            return await self._restore_archive_ndjson(request)
+        archive = await self._decode_body(request)
+        await self._write_batches(
+            handlers.archive_batches(archive, self.restore_batch_size))
+        return archive
+
+    async def _restore_archive_ndjson(self, request):
+        """
+        Restore an archive streamed as one record per line in bounded batches
+        """
+        restore = handlers.Restore(self._batch_size(request.query))
+        lineno = 0
+        async for line in request.content:
+            lineno += 1
+            item = handlers.archive_item(line, lineno)
+            if item is None:
+                continue
+            table, row = item
+            if table is None:
+                await self._write_batches(restore.flush())
+                await self._apply_purge(request, *row)
+                restore.counts["purges"] += 1
+            else:
+                await self._write_batches(restore.add(table, row))
+        await self._write_batches(restore.flush())
+        return restore.summary()
+
+    async def _apply_purge(self, request, username, schema):
+        """
+        Purge a schema, a namespace if schema is None or everything if
+        username is None
+        """
+        if username is None:
+            await self.purge(request)
+        else:
+            await self._purge_rows(username, schema)
+
+    async def get_metrics(self, request):
+        """
+        Get the metrics of this process in the Prometheus text format
+        """
+        return web.Response(
+            body=self.metrics.render(),
+            headers={"Content-Type": metrics.CONTENT_TYPE})
+
+    async def get_pool_stats(self, request):
+        """
+        Get metrics of the db connection
+        """
+        return {
+            "size": 1,
+            "open": int(self.conn is not None and self.conn.is_open()),
+        }
+
+    @staticmethod
+    async def get_liveness(request):
+        """
+        Report that the event loop is serving requests
+        """
+        return {"live": True}
+
+    async def get_readiness(self, request):
+        """
+        Report whether the storage can be queried and has all its tables,
+        with a 503 if not so that load balancers hold traffic back
+        """
+        try:
+            ready = await self.storage.ready()
+        except Exception:  # pylint: disable=broad-except
+            ready = False
+        return {"ready": ready}, {}, 200 if ready else 503
+
+    async def purge(self, request):
+        """
+        Destroy all schemata and data
+        """
+        await self.storage.delete_all("data")
+        await self.storage.delete_all("schemata")
+        self._purged()
+        await self.storage.upsert("tombstones", [handlers.tombstone("*")])
+        await self.storage.update_all("versions", handlers.new_version())
+        return {}
+
+    async def purge_namespace(self, request, username):
+        """
+        Start purging the schemata and data of a namespace in the background
+        and return the job reporting its progress
+        """
+        return await self._start_purge(handlers.purge_job(username))
+
+    async def purge_schema(self, request, username, schema):
+        """
+        Start purging a schema and its data in the background and return the
+        job reporting its progress
+        """
+        return await self._start_purge(handlers.purge_job(username, schema))
+
+    async def get_job(self, request, job_id):
+        """
+        Get the progress of a background job
+        """
+        return self._job(await self.storage.get("jobs", job_id), job_id)
+
+    async def _start_purge(self, job):
+        """
+        Run a purge job as a background task
+
+        Jobs are kept in the jobs table so that any process can report their
+        progress, and those that expired are deleted when a job starts.
+        """
+        for job_id in handlers.expired_jobs(await self.storage.scan("jobs"),
+                                            job):
+            await self.storage.delete_batch("jobs", "id", job_id, 1)
+        await self.storage.upsert("jobs", [job])
+        task = asyncio.ensure_future(self._run_job(self._purge_job, job))
+        self._tasks.add(task)
+        task.add_done_callback(self._tasks.discard)
+        return handlers.job_started(job)
+
+    async def _run_job(self, work, job):
+        """
+        Await work(job), marking the job failed if it raises
+        """
+        try:
+            await work(job)
+        except Exception as exc:  # pylint: disable=broad-except
+            LOGGER.exception("job %s failed", job["id"])
+            handlers.job_failed(job, exc)
+            await self.storage.upsert("jobs", [job])
+
+    async def _purge_job(self, job):
+        """
+        Purge the namespace or schema of a background job, recording its
+        progress in the jobs table
+        """
+        await self._purge_rows(job["namespace"], job["schema"], job)
+        job["status"] = "done"
+        await self.storage.upsert("jobs", [job])
+
+    async def _purge_rows(self, username, schema, job=None):
+        """
+        Delete the rows of a namespace or schema in batches and leave a
+        tombstone for delta archives once they're all gone
+
+        The rows deleted are counted in the job purging them, if any, after
+        each batch.
+        """
+        if schema is None:
+            names = {
+                entry["name"]
+                for entry in await self.storage.get_all(
+                    "schemata", "username", username)
+            }
+        else:
+            names = {"{}/{}".format(username, schema)}
+        for table, index, value in handlers.purge_steps(username, schema):
+            while True:
+                keys = await self.storage.delete_batch(
+                    table, index, value, self.purge_batch_size)
+                if job is not None:
+                    job["deleted"][table] += len(keys)
+                    await self.storage.upsert("jobs", [job])
+                self._deleted(table, username, keys)
+                await self._bump_versions(names | {username})
+                if len(keys) < self.purge_batch_size:
+                    break
+                await asyncio.sleep(self.purge_interval)
+        await self.storage.upsert("tombstones", [
+            handlers.tombstone(handlers.scope_name(username, schema))
+        ])
+
+
+def main():
+    """
+    Set up the db and serve the API on an asyncio event loop
+    """
+    if settings.MIGRATE:
+        db.migrate()
+    r.set_loop_type("asyncio")
+    schemata_view = None
+    if settings.SCHEMATA_VIEW:
+        schemata_view = AsyncSchemataView(db.open_async_schemata_feed)
+    api = AsyncAPI(
+        r,
+        settings.DB_NAME,
+        functools.partial(r.connect, settings.DB_HOST, settings.DB_PORT),
+        schemata_view=schemata_view,
+        **settings.api_options())
+    web.run_app(api.app, port=settings.PORT)
+
+
+if __name__ == "__main__":
+    main()
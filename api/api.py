@@ -2,93 +2,475 @@
 Flask API for trackit service
 """
 
-import collections
-import json
+import functools
+import itertools
+import threading
+import time
 
-from flask import Flask, request
+from flask import (Flask, Response, g, has_request_context, request,
+                   stream_with_context)
+from werkzeug.exceptions import (BadRequest, HTTPException,
+                                 ServiceUnavailable)
 
+from api import admission, columnar, encoding, handlers, metrics
+from api.batching import WriteBatcher
+from api.handlers import INVALIDATE_HEADER, ROUTE_BUDGETS
+from api.pool import PoolTimeout
+from api.storage import STREAM_BATCH_SIZE, RethinkDBStorage
 
-class API(object):
+
+def _chunked(pieces):
+    """
+    Join an iterable of strings into chunks of up to STREAM_BATCH_SIZE pieces
+    each
+    """
+    pieces = iter(pieces)
+    while True:
+        chunk = "".join(itertools.islice(pieces, STREAM_BATCH_SIZE))
+        if not chunk:
+            return
+        yield chunk
+
+
+def _iter_ndjson_data(stream):
+    """
+    Iterate over (key, datum) pairs of a stream of line-delimited data
+    """
+    for lineno, line in enumerate(stream, 1):
+        item = handlers.datum_item(line, lineno)
+        if item is not None:
+            yield item
+
+
+class API(handlers.BaseAPI):
     """
     Wrapper for the flask API object
     """
+    admission_class = admission.Admission
+    batcher_class = WriteBatcher
+    metered_storage_class = metrics.MeteredStorage
 
-    def __init__(self, db_connection, db_name):
+    def __init__(self,
+                 db_connection,
+                 db_name,
+                 pool=None,
+                 storage=None,
+                 **options):
         """
         Initialize
+
+        Rows are kept in storage, by default the RethinkDB database db_name
+        of db_connection. RethinkDB queries run on a connection checked out of
+        pool for the duration of each request or, without a pool, on the repl
+        connection. options are those of api.handlers.BaseAPI.
         """
-        self.r = db_connection
-        self.db = self.r.db(db_name)
+        self.pool = pool
+        if storage is None:
+            storage = RethinkDBStorage(db_connection, db_name, run=self._run)
+        super().__init__(storage, **options)
         self.app = Flask(__name__)
-        self.app.route('/schemata/<username>/')(self.get_schemata)
-        self.app.route(
-            '/schemata/<username>/<name>/', methods=["PUT"])(self.set_schema)
-        self.app.route('/data/<username>/<schema>/')(self.get_data)
-        self.app.route(
+        self._route('/schemata/', self.get_namespaces_schemata)
+        self._route('/schemata/<username>/', self.get_schemata)
+        self._route(
+            '/schemata/<username>/<name>/', self.set_schema, methods=["PUT"])
+        self._route('/data/<username>/<schema>/', self.get_data)
+        self._route(
+            '/data/<username>/<schema>/', self.set_data, methods=["PUT"])
+        self._route(
             '/data/<username>/<schema>/<key>/',
-            methods=["PUT"])(self.set_datum)
-        self.app.route('/data/<username>/<schema>/<key>/')(self.get_datum)
-        self.app.route('/archive/', methods=["GET"])(self.get_archive)
-        self.app.route('/archive/', methods=["PUT"])(self.restore_archive)
-        self.app.route('/purge/', methods=["POST"])(self.purge)
+            self.set_datum,
+            methods=["PUT"])
+        self._route('/data/<username>/<schema>/<key>/', self.get_datum)
+        self._route('/aggregate/<username>/<schema>/', self.get_aggregate)
+        self._route('/export/<username>/<schema>/', self.get_export)
+        self._route('/archive/', self.get_archive, methods=["GET"])
+        self._route('/archive/', self.restore_archive, methods=["PUT"])
+        self._route('/purge/', self.purge, methods=["POST"])
+        self._route(
+            '/purge/<username>/', self.purge_namespace, methods=["POST"])
+        self._route(
+            '/purge/<username>/<schema>/', self.purge_schema, methods=["POST"])
+        self._route('/jobs/<job_id>/', self.get_job)
+        self._route('/health/pool/', self.get_pool_stats)
+        self._route('/health/live/', self.get_liveness)
+        self._route('/health/ready/', self.get_readiness)
+        self._route('/metrics', self.get_metrics)
+        self.app.after_request(self._add_invalidations)
+        self.app.teardown_request(self._release_connection)
+        if self.pool is not None:
+            self.metrics.track(metrics.pool_metrics(self.pool))
+
+    def _run(self, query, **kwargs):
+        """
+        Run a query on the connection of the current request
+        """
+        if self.pool is None:
+            with self.metrics.query_seconds.time():
+                return query.run(**kwargs)
+        if "db_connection" not in g:
+            try:
+                g.db_connection = self.pool.checkout()
+            except PoolTimeout:
+                raise ServiceUnavailable("no db connection available")
+        with self.metrics.query_seconds.time():
+            return query.run(g.db_connection, **kwargs)
+
+    def _release_connection(self, exc):
+        """
+        Return the connection of the current request to the pool
+        """
+        conn = g.pop("db_connection", None)
+        if conn is not None:
+            self.pool.checkin(conn, suspect=exc is not None)
+
+    @staticmethod
+    def _invalidate(names):
+        """
+        Record that the current request changed the named namespaces and
+        namespace/schema pairs, or everything for "*"
+        """
+        if has_request_context():
+            g.setdefault("invalidated", set()).update(names)
+
+    @staticmethod
+    def _add_invalidations(response):
+        """
+        Tell caches in front of the API what the request changed
+        """
+        if g.get("invalidated"):
+            response.headers[INVALIDATE_HEADER] = (
+                handlers.invalidation_header(g.invalidated))
+        return response
+
+    def _route(self, rule, handler, methods=("GET", )):
+        """
+        Register a handler for a rule with its result encoded for the client
+
+        Handlers return the object to send, optionally paired with a dict of
+        headers and a status code, or a flask Response which is sent as is.
+        Requests are only handled once admitted within the budget of the
+        route, which they hold until their response is sent. The latency,
+        status and response size of each request are recorded in the
+        metrics.
+        """
+        route = handler.__name__
+        budget = ROUTE_BUDGETS.get(route, "normal")
+
+        @functools.wraps(handler)
+        def view(**kwargs):
+            """
+            Call the handler and encode its result
+            """
+            started = time.perf_counter()
+            in_flight = self.metrics.requests_in_flight.labels(route)
+            in_flight.inc()
+            status = 500
+            release = None
+            try:
+                release = self._admit(budget, kwargs.get("username"))
+                response = self._respond(route, handler(**kwargs))
+                status = response.status_code
+                if release is not None and response.is_streamed:
+                    # streamed bodies are read after the view returns
+                    response.call_on_close(release)
+                    release = None
+                return response
+            except HTTPException as error:
+                status = error.code
+                raise
+            finally:
+                if release is not None:
+                    release()
+                in_flight.dec()
+                self.metrics.request_seconds.labels(
+                    route, request.method,
+                    status).observe(time.perf_counter() - started)
+
+        self.app.add_url_rule(rule, view_func=view, methods=list(methods))
+
+    def _admit(self, budget, namespace):
+        """
+        Wait for a slot of a budget for a request in a namespace, or in none,
+        and return the function giving it back, or None if the budget is None
+
+        Raises a 429 if the namespace's budget stays full and a 503 if the
+        process's does.
+        """
+        if budget is None:
+            return None
+        try:
+            self.admission.acquire(budget, namespace)
+        except admission.Rejected as error:
+            raise handlers.rejection(error)
+        return functools.partial(self.admission.release, budget, namespace)
+
+    def _respond(self, route, result):
+        """
+        Return the response for the result of a route's handler
+        """
+        if isinstance(result, Response):
+            if not result.is_streamed:
+                self.metrics.response_bytes.labels(route).observe(
+                    result.calculate_content_length() or 0)
+            return result
+        headers = {}
+        status = 200
+        if isinstance(result, tuple):
+            if len(result) == 3:
+                result, headers, status = result
+            else:
+                result, headers = result
+        mimetype, codec = encoding.negotiate(request.accept_mimetypes)
+        pretty = encoding.is_pretty(request.args.get("pretty"))
+        with self.metrics.encode_seconds.labels(codec.mimetype).time():
+            body = codec.dumps(result, pretty=pretty)
+        self.metrics.response_bytes.labels(route).observe(len(body))
+        return Response(
+            body, status=status, mimetype=mimetype, headers=headers)
+
+    def _upsert(self, table, rows, durability="hard"):
+        """
+        Upsert schemata or data rows stamped with the time they're written
+        """
+        return self.storage.upsert(table, handlers.stamp(rows), durability)
+
+    def _upsert_data(self, rows, durability="hard"):
+        """
+        Upsert data rows and return the error writing each row or None
+        """
+        errors = [None] * len(rows)
+        if self._upsert("data", rows, durability)["errors"]:
+            # attribute the failures by retrying the batch row by row
+            errors = [
+                handlers.first_error(self._upsert("data", [row], durability))
+                for row in rows
+            ]
+        self._bump_versions(self._written("data", rows))
+        return errors
+
+    def _write_batches(self, batches):
+        """
+        Upsert (table, rows) batches of schemata or data rows
+        """
+        for table, rows in batches:
+            self._upsert(table, rows)
+            self._bump_versions(self._written(table, rows))
+
+    def _bump_versions(self, names):
+        """
+        Record that the named namespaces and namespace/schema pairs changed
+        """
+        if names:
+            self.storage.upsert("versions", handlers.versions_rows(names))
+            self._invalidate(names)
+
+    def _conditional(self, names, produce):
+        """
+        Return the result of produce tagged with the current versions of the
+        namespaces and namespace/schema pairs it depends on, or a 304 if the
+        client already has those versions
+        """
+        entries = [self.storage.get("versions", name) for name in names]
+        if None in entries:
+            return produce()
+        headers, fresh = handlers.conditional_headers(
+            entries, request.query_string.decode("utf-8"),
+            request.headers.get("Accept"),
+            request.headers.get("If-None-Match"))
+        if fresh:
+            return Response(status=304, headers=headers)
+        return handlers.with_headers(produce(), headers)
 
     def get_schemata(self, username):
         """
         Get all schemata in a namespace
         """
-        return json.dumps(
-            {
-                entry["name"][len(username) + 1:]: entry["body"]
-                for entry in self.db.table("schemata").filter(self.r.row[
-                    "username"] == username).run()
-            },
-            indent=4)
+        if self._view_current(username):
+            return self.schemata_view.namespace(username)
+        return self._conditional(
+            [username], lambda: handlers.namespace_schemata(
+                username,
+                self.storage.get_all("schemata", "username", username)))
+
+    def get_namespaces_schemata(self):
+        """
+        Get all schemata in each namespace given by the namespace argument
+        """
+        namespaces = request.args.getlist("namespace")
+        if not namespaces:
+            raise BadRequest("no namespace given")
+        schemata = self._view_schemata(namespaces)
+        remaining = [
+            namespace for namespace in namespaces if namespace not in schemata
+        ]
+        if remaining:
+            schemata.update(
+                handlers.group_schemata(
+                    remaining,
+                    self.storage.get_all("schemata", "username", *remaining)))
+        return schemata
 
     def set_schema(self, username, name):
         """
-        Get a schema given its name and namespace
+        Set a schema given its name and namespace
+        """
+        body = encoding.decode_body(request)
+        self._write_batches(
+            [("schemata", [handlers.schema_row(username, name, body)])])
+        return {name: body}
+
+    def _validator(self, username, schema):
+        """
+        Return the compiled validator for a schema, compiling and caching it
+        on first use
+
+        Cached validators are used only while their schema is at the revision
+        in the schemata view they were compiled at, so changes by other
+        processes are picked up as soon as the view sees them. Without a
+        current view they're used until they expire. Either way, writes by
+        this process drop them at once.
+        """
+        name = "{}/{}".format(username, schema)
+        revision = self._validator_revision(username, schema)
+        validator = self.validators.get(name, revision)
+        if validator is None:
+            validator = handlers.compile_validator(
+                name, self._schema_body(username, schema))
+            self.validators.set(name, revision, validator)
+        return validator
+
+    def _schema_body(self, username, schema):
+        """
+        Return the body of a schema or abort with a 404 if it doesn't exist
         """
-        body = request.get_json()
-        # TODO validate body
-        key = "{}/{}".format(username, name)
-        schema = {
-            "name": key,
-            "body": body,
-            "username": username,
-        }
-        self.db.table("schemata").insert([schema], conflict='update').run()
-        return json.dumps({name: body}, indent=4)
+        if self._view_current(username):
+            body = self.schemata_view.get(username, schema)
+        else:
+            entry = self.storage.get("schemata", "{}/{}".format(
+                username, schema))
+            body = entry and entry["body"]
+        return handlers.schema_body("{}/{}".format(username, schema), body)
 
     def get_data(self, username, schema):
         """
         Get all data for a schema given its name and a namespace
+
+        Data may be restricted to keys in [start, end) and paged with limit in
+        which case pages are ordered by key and a continuation token for the
+        next page is returned in the X-Continuation-Token header.
+        """
+        return self._conditional(["{}/{}".format(username, schema)],
+                                 lambda: self._get_data(username, schema))
+
+    def get_aggregate(self, username, schema):
+        """
+        Aggregate a field of the data of a schema
+
+        The aggregate, field, grouping by date period and range of keys are
+        given by the aggregate, field, group, start and end arguments.
+        """
+        aggregate, field, grouping = handlers.aggregation(
+            self._schema_body(username, schema), request.args)
+        # the result depends on the schema, versioned with its namespace, as
+        # well as on the data
+        return self._conditional(
+            ["{}/{}".format(username, schema), username],
+            lambda: handlers.aggregation_result(self.storage.aggregate(
+                username,
+                schema,
+                aggregate,
+                field=field,
+                grouping=grouping,
+                start=request.args.get("start"),
+                end=request.args.get("end")), grouping))
+
+    def get_export(self, username, schema):
         """
-        query = self.db.table("data").filter(
-            (self.r.row["username"] == username) & \
-            (self.r.row["schema"] == schema))
+        Export the data of a schema for analytics
 
-        return json.dumps(
-            {
-                entry["key"][len(username) + len(schema) + 2:]: entry["datum"]
-                for entry in query.run()
-            },
-            indent=4)
+        The data are streamed in batches as CSV with ?format=csv, the default,
+        or in the typed binary format of api.columnar with ?format=columns.
+        Schemata whose columns can't be exported are rejected with a 400
+        before anything is sent, while numbers that don't fit the binary
+        format are exported as missing.
+        """
+        fmt = handlers.export_format(request.args)
+        cols = handlers.export_columns(self._schema_body(username, schema))
+        rows = (handlers.export_row(username, schema, entry)
+                for entry in self.storage.get_all(
+                    "data", "username_schema", [username, schema],
+                    stream=True))
+        return Response(
+            stream_with_context(
+                columnar.export(fmt, cols, rows, STREAM_BATCH_SIZE)),
+            mimetype=columnar.FORMATS[fmt][0])
+
+    def _get_data(self, username, schema):
+        """
+        Get all or a range of data for a schema
+        """
+        if not any(arg in request.args for arg in handlers.PAGE_ARGS):
+            return handlers.data_result(
+                username, schema,
+                self.storage.get_all("data", "username_schema",
+                                     [username, schema]))
+        start, end, after, limit = handlers.page_args(request.args)
+        entries = self.storage.scan_schema(
+            username,
+            schema,
+            start=start,
+            end=end,
+            after=after,
+            limit=limit + 1 if limit is not None else None)
+        return handlers.page_result(username, schema, entries, limit)
 
     def set_datum(self, username, schema, key):
         """
         Set a datum given its key, schema name, and namespace
+
+        The datum is written with the durability given by the durability
+        argument, hard or soft, and may be written in a batch with those of
+        concurrent requests.
         """
-        # TODO validate against schema
-        body = request.get_json()
-        fullkey = "{}/{}/{}".format(username, schema, key)
-        entry = {
-            "key": fullkey,
-            "username": username,
-            "schema": schema,
-            "datum": body
-        }
-        self.db.table("data").insert([entry], conflict='update').run()
-        return json.dumps({key: body}, indent=4)
+        body = encoding.decode_body(request)
+        handlers.check_datum(self._validator(username, schema), body)
+        durability = self._durability(request.args)
+        row = handlers.datum_row(username, schema, key, body)
+        if self.datum_batchers is None:
+            error = self._upsert_data([row], durability)[0]
+        else:
+            error = self.datum_batchers[durability].submit(row)
+        return self._datum_written(row, error)
+
+    def set_data(self, username, schema):
+        """
+        Set many data for a schema given a map of key to datum
+
+        An application/x-ndjson body with one {"key": ..., "datum": ...} object
+        per line is read incrementally. Data are written in bounded batches,
+        with the durability given by the durability argument, and the outcome
+        is reported per key.
+        """
+        batch_size = self._batch_size(request.args)
+        durability = self._durability(request.args)
+        validate = self._validator(username, schema)
+        if request.mimetype == "application/x-ndjson":
+            items = _iter_ndjson_data(request.stream)
+        else:
+            items = handlers.data_items(encoding.decode_body(request))
+        results = {}
+        while True:
+            batch = list(itertools.islice(items, batch_size))
+            if not batch:
+                return results
+            batch_results, rows = handlers.datum_rows(username, schema, batch,
+                                                      validate)
+            results.update(batch_results)
+            if rows:
+                results.update(
+                    handlers.write_results(
+                        username, schema, rows,
+                        self._upsert_data(rows, durability)))
 
     def get_datum(self, username, schema, key):
         """
@@ -96,57 +478,268 @@ class API(object):
         """
         # TODO validate against schema
         fullkey = "{}/{}/{}".format(username, schema, key)
-        entry, = self.db.table("data").filter(
-            self.r.row["key"] == fullkey).run()
-        return json.dumps(entry["datum"], indent=4)
+        datum = self.datum_cache.get(fullkey)
+        if datum is None:
+            datum = self._datum_read(fullkey, self.storage.get("data",
+                                                               fullkey))
+        return datum
 
     def get_archive(self):
         """
         Get an archive of all schemata and data for all namespaces
+
+        With ?stream=1 the nested JSON archive is streamed as it is read and
+        with ?format=ndjson it is streamed as one record per line. With
+        ?since=<watermark> only the schemata and data written since are
+        streamed as one record per line, preceded by purge records for what
+        was purged since. Line-delimited archives carry the
+        watermark to request the next delta from in the X-Watermark header.
+        """
+        since = handlers.parse_since(request.args)
+        if since is not None or request.args.get("format") == "ndjson":
+            headers = self._watermark()
+            pieces = (self._stream_archive_delta(since) if since is not None
+                      else self._stream_archive_ndjson())
+            return Response(
+                stream_with_context(_chunked(pieces)),
+                mimetype="application/x-ndjson",
+                headers=headers)
+        if request.args.get("stream"):
+            return Response(
+                stream_with_context(_chunked(self._stream_archive_json())),
+                mimetype="application/json")
+        return handlers.nested_archive(
+            self.storage.scan("schemata"), self.storage.scan("data"))
+
+    def _iter_archive(self):
         """
-        all_schemata = collections.defaultdict(dict)
-        for entry in self.db.table("schemata").run():
+        Iterate over (schemata row, data cursor) for all schemata ordered by
+        name such that schemata of a namespace are adjacent
+        """
+        for entry in self.storage.scan("schemata", ordered=True, stream=True):
             namespace, schema_name = entry["name"].split("/")
-            all_schemata[namespace][schema_name] = {
-                "schema": entry["body"],
-                "data": {}
-            }
-        for entry in self.db.table("data").run():
-            datum_key = entry["key"].split("/")[-1]
-            all_schemata[entry["username"]][entry["schema"]]["data"][
-                datum_key] = entry["datum"]
-        return json.dumps(dict(all_schemata), indent=4)
+            yield entry, self.storage.get_all(
+                "data", "username_schema", [namespace, schema_name],
+                stream=True)
+
+    def _stream_archive_json(self):
+        """
+        Yield the pieces of an archive in the nested JSON format
+        """
+        archive = handlers.ArchiveJSON()
+        yield archive.start()
+        for entry, data in self._iter_archive():
+            yield archive.schema(entry)
+            for datum in data:
+                yield archive.datum(datum)
+            yield archive.end_schema()
+        yield archive.end()
+
+    def _stream_archive_ndjson(self):
+        """
+        Yield the lines of an archive with one schema or datum record per line
+        """
+        for entry, data in self._iter_archive():
+            yield handlers.ndjson_line(handlers.schema_record(entry))
+            for datum in data:
+                yield handlers.ndjson_line(handlers.datum_record(datum))
+
+    def _stream_archive_delta(self, since):
+        """
+        Yield the lines of an archive of the schemata and data written since a
+        watermark, after a purge record for everything, namespace or schema
+        purged since in the order they were purged
+        """
+        for record in handlers.purge_records(
+                self.storage.scan("tombstones"), since):
+            yield handlers.ndjson_line(record)
+        for entry in self.storage.scan_modified(
+                "schemata", since, stream=True):
+            yield handlers.ndjson_line(handlers.schema_record(entry))
+        for entry in self.storage.scan_modified("data", since, stream=True):
+            yield handlers.ndjson_line(handlers.datum_record(entry))
 
     def restore_archive(self):
         """
         Restore an archive
+
+        An application/x-ndjson body in the format streamed by get_archive,
+        including delta archives, is parsed incrementally and a summary is
+        returned instead of the archive.
+        """
+        if request.mimetype == "application/x-ndjson":
+            return self._restore_archive_ndjson()
+        archive = encoding.decode_body(request)
+        self._write_batches(
+            handlers.archive_batches(archive, self.restore_batch_size))
+        return archive
+
+    def _restore_archive_ndjson(self):
+        """
+        Restore an archive streamed as one record per line in bounded batches
+        """
+        restore = handlers.Restore(self._batch_size(request.args))
+        for lineno, line in enumerate(request.stream, 1):
+            item = handlers.archive_item(line, lineno)
+            if item is None:
+                continue
+            table, row = item
+            if table is None:
+                self._write_batches(restore.flush())
+                self._apply_purge(*row)
+                restore.counts["purges"] += 1
+            else:
+                self._write_batches(restore.add(table, row))
+        self._write_batches(restore.flush())
+        return restore.summary()
+
+    def _apply_purge(self, username, schema):
+        """
+        Purge a schema, a namespace if schema is None or everything if
+        username is None
+        """
+        if username is None:
+            self.purge()
+        else:
+            self._purge_rows(username, schema)
+
+    def get_pool_stats(self):
+        """
+        Get metrics of the db connection pool
         """
-        archive = request.get_json()
-        schemata = [{
-            "name": "{}/{}".format(namespace, schema_name),
-            "body": schema_spec["schema"],
-            "username": namespace
-        }
-                    for namespace, space_items in archive.items()
-                    for schema_name, schema_spec in space_items.items()]
-        self.db.table("schemata").insert(schemata, conflict='update').run()
-
-        data = [{
-            "key": "{}/{}/{}".format(namespace, schema_name, datum_name),
-            "datum": datum,
-            "username": namespace,
-            "schema": schema_name,
-        }
-                for namespace, space_items in archive.items()
-                for schema_name, schema_spec in space_items.items()
-                for datum_name, datum in schema_spec["data"].items()]
-        self.db.table("data").insert(data, conflict='update').run()
-        return json.dumps(archive, indent=4)
+        if self.pool is None:
+            return {}
+        return self.pool.stats()
+
+    @staticmethod
+    def get_liveness():
+        """
+        Report that the process is serving requests
+        """
+        return {"live": True}
+
+    def get_readiness(self):
+        """
+        Report whether the storage can be queried and has all its tables,
+        with a 503 if not so that load balancers hold traffic back
+        """
+        try:
+            ready = self.storage.ready()
+        except Exception as error:  # pylint: disable=broad-except
+            self._release_connection(error)
+            ready = False
+        return {"ready": ready}, {}, 200 if ready else 503
+
+    def get_metrics(self):
+        """
+        Get the metrics of this process in the Prometheus text format
+        """
+        return Response(
+            self.metrics.render(), content_type=metrics.CONTENT_TYPE)
 
     def purge(self):
         """
         Destroy all schemata and data
         """
-        self.db.table("data").delete().run()
-        self.db.table("schemata").delete().run()
-        return json.dumps({})
+        self.storage.delete_all("data")
+        self.storage.delete_all("schemata")
+        self._purged()
+        self.storage.upsert("tombstones", [handlers.tombstone("*")])
+        # existing versions are replaced rather than deleted so that clients
+        # holding an old entity tag can't mistake it for a current one
+        self.storage.update_all("versions", handlers.new_version())
+        return {}
+
+    def purge_namespace(self, username):
+        """
+        Start purging the schemata and data of a namespace in the background
+        and return the job reporting its progress
+        """
+        return self._start_purge(handlers.purge_job(username))
+
+    def purge_schema(self, username, schema):
+        """
+        Start purging a schema and its data in the background and return the
+        job reporting its progress
+        """
+        return self._start_purge(handlers.purge_job(username, schema))
+
+    def get_job(self, job_id):
+        """
+        Get the progress of a background job
+        """
+        return self._job(self.storage.get("jobs", job_id), job_id)
+
+    def _start_purge(self, job):
+        """
+        Run a purge job on a background thread
+
+        Jobs are kept in the jobs table so that any worker can report their
+        progress, and those that expired are deleted when a job starts.
+        """
+        for job_id in handlers.expired_jobs(self.storage.scan("jobs"), job):
+            self.storage.delete_batch("jobs", "id", job_id, 1)
+        self.storage.upsert("jobs", [job])
+        threading.Thread(
+            target=self._run_job, args=(self._purge_job, job),
+            daemon=True).start()
+        return handlers.job_started(job)
+
+    def _run_job(self, work, job):
+        """
+        Call work(job) in an application context of its own, marking the job
+        failed if work raises
+        """
+        with self.app.app_context():
+            error = None
+            try:
+                work(job)
+            except Exception as exc:  # pylint: disable=broad-except
+                error = exc
+                handlers.job_failed(job, exc)
+                self.storage.upsert("jobs", [job])
+            finally:
+                self._release_connection(error)
+
+    def _purge_job(self, job):
+        """
+        Purge the namespace or schema of a background job, recording its
+        progress in the jobs table
+        """
+        self._purge_rows(job["namespace"], job["schema"], job)
+        job["status"] = "done"
+        self.storage.upsert("jobs", [job])
+
+    def _purge_rows(self, username, schema, job=None):
+        """
+        Delete the rows of a namespace or schema in batches and leave a
+        tombstone for delta archives once they're all gone
+
+        The rows deleted are counted in the job purging them, if any, after
+        each batch. The connection is handed back to the pool between batches
+        so that a purge doesn't hold one while it waits.
+        """
+        if schema is None:
+            names = {
+                entry["name"]
+                for entry in self.storage.get_all("schemata", "username",
+                                                  username)
+            }
+        else:
+            names = {"{}/{}".format(username, schema)}
+        for table, index, value in handlers.purge_steps(username, schema):
+            while True:
+                keys = self.storage.delete_batch(table, index, value,
+                                                 self.purge_batch_size)
+                if job is not None:
+                    job["deleted"][table] += len(keys)
+                    self.storage.upsert("jobs", [job])
+                self._deleted(table, username, keys)
+                self._bump_versions(names | {username})
+                self._release_connection(None)
+                if len(keys) < self.purge_batch_size:
+                    break
+                time.sleep(self.purge_interval)
+        self.storage.upsert("tombstones", [
+            handlers.tombstone(handlers.scope_name(username, schema))
+        ])
@@ -0,0 +1,138 @@
+"""
+Write-behind micro-batching of single-row writes for the trackit API
+
+Rows submitted by concurrent writers are coalesced into a batch until it
+holds max_rows rows or max_delay seconds have passed since its first row. The
+writer that opened a batch writes it on behalf of everyone, so batches are
+written from the threads or tasks of requests themselves, e.g. on their db
+connections, and every writer gets back the outcome of its own row.
+"""
+
+import asyncio
+import threading
+
+
+class _Batch(object):
+    """
+    Rows coalesced into one write and the outcome of writing them
+    """
+
+    def __init__(self, full, done):
+        """
+        Initialize with events set once the batch is full and once written
+        """
+        self.rows = []
+        self.results = None
+        self.error = None
+        self.full = full
+        self.done = done
+
+    def outcome(self, index):
+        """
+        Return the outcome of writing a row of the batch or raise the error
+        writing the batch failed with
+        """
+        if self.error is not None:
+            raise self.error
+        return self.results[index]
+
+
+class _Batcher(object):
+    """
+    Abstract base class for batchers of rows written by write(rows), which
+    returns the outcome of writing each row in order
+    """
+
+    def __init__(self, write, max_rows=100, max_delay=0.005):
+        """
+        Initialize
+        """
+        self.write = write
+        self.max_rows = max_rows
+        self.max_delay = max_delay
+        self._batch = None
+
+    def _add(self, row, event):
+        """
+        Add a row to the open batch, opening one if there is none, and return
+        the batch, the index of the row and whether it opened the batch
+        """
+        batch = self._batch
+        leader = batch is None
+        if leader:
+            batch = self._batch = _Batch(event(), event())
+        batch.rows.append(row)
+        if len(batch.rows) >= self.max_rows:
+            self._batch = None
+            batch.full.set()
+        return batch, len(batch.rows) - 1, leader
+
+    def _close(self, batch):
+        """
+        Stop adding rows to a batch that is about to be written
+        """
+        if self._batch is batch:
+            self._batch = None
+
+
+class WriteBatcher(_Batcher):
+    """
+    Coalesces rows submitted from concurrent threads into batched writes
+    """
+
+    def __init__(self, write, max_rows=100, max_delay=0.005):
+        """
+        Initialize
+        """
+        super().__init__(write, max_rows, max_delay)
+        self._lock = threading.Lock()
+
+    def submit(self, row):
+        """
+        Write a row as part of a batch and return its outcome, or raise the
+        error writing its batch failed with
+        """
+        with self._lock:
+            batch, index, leader = self._add(row, threading.Event)
+        if not leader:
+            batch.done.wait()
+            return batch.outcome(index)
+        batch.full.wait(self.max_delay)
+        with self._lock:
+            self._close(batch)
+        try:
+            batch.results = self.write(batch.rows)
+        except Exception as error:  # pylint: disable=broad-except
+            batch.error = error
+        finally:
+            batch.done.set()
+        return batch.outcome(index)
+
+
+class AsyncWriteBatcher(_Batcher):
+    """
+    Coalesces rows submitted from concurrent tasks of one event loop into
+    batched writes by the coroutine function write
+    """
+
+    async def submit(self, row):
+        """
+        Write a row as part of a batch and return its outcome, or raise the
+        error writing its batch failed with
+        """
+        batch, index, leader = self._add(row, asyncio.Event)
+        if not leader:
+            await batch.done.wait()
+            return batch.outcome(index)
+        try:
+            await asyncio.wait_for(batch.full.wait(), self.max_delay)
+        except asyncio.TimeoutError:
+            pass
+        self._close(batch)
+        try:
+            batch.results = await self.write(batch.rows)
+        except Exception as error:  # pylint: disable=broad-except
+            batch.error = error
+        finally:
+            batch.done.set()
+        return batch.outcome(index)
@@ -0,0 +1,127 @@
+"""
+In-process caches for the trackit API
+"""
+
+import collections
+import threading
+import time
+
+
+class LRUCache(object):
+    """
+    A thread-safe, size-bounded LRU cache whose entries expire after a TTL
+    """
+
+    def __init__(self, maxsize=1024, ttl=60, clock=time.monotonic):
+        """
+        Initialize
+        """
+        self.maxsize = maxsize
+        self.ttl = ttl
+        self.clock = clock
+        self.hits = 0
+        self.misses = 0
+        self._entries = collections.OrderedDict()
+        self._lock = threading.Lock()
+
+    def get(self, key, default=None):
+        """
+        Return the cached value for a key or default if missing or expired
+        """
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is None or entry[1] <= self.clock():
+                if entry is not None:
+                    del self._entries[key]
+                self.misses += 1
+                return default
+            self._entries.move_to_end(key)
+            self.hits += 1
+            return entry[0]
+
+    def set(self, key, value):
+        """
+        Store a value for a key evicting the least recently used entry if full
+        """
+        if self.maxsize <= 0:
+            return
+        with self._lock:
+            self._entries[key] = (value, self.clock() + self.ttl)
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.maxsize:
+                self._entries.popitem(last=False)
+
+    def invalidate(self, key):
+        """
+        Drop the entry for a key if present
+        """
+        with self._lock:
+            self._entries.pop(key, None)
+
+    def clear(self):
+        """
+        Drop all entries
+        """
+        with self._lock:
+            self._entries.clear()
+
+    def __len__(self):
+        return len(self._entries)
+
+
+class VersionedCache(object):
+    """
+    A cache whose entries are tagged with the version of what they were
+    computed from and are only returned while that version is current, kept
+    in an LRUCache
+    """
+
+    def __init__(self, maxsize=1024, ttl=60, clock=time.monotonic):
+        """
+        Initialize
+        """
+        self.hits = 0
+        self.misses = 0
+        self._cache = LRUCache(maxsize, ttl, clock)
+        # held while checking versions so that an entry found stale can't be
+        # replaced by a current one before it's dropped
+        self._lock = threading.Lock()
+
+    def get(self, key, version, default=None):
+        """
+        Return the value cached for a key at a version or default if missing,
+        expired or of another version, which is then dropped
+        """
+        with self._lock:
+            entry = self._cache.get(key)
+            if entry is None or entry[0] != version:
+                if entry is not None:
+                    self._cache.invalidate(key)
+                self.misses += 1
+                return default
+            self.hits += 1
+            return entry[1]
+
+    def set(self, key, version, value):
+        """
+        Store the value for a key computed at a version
+        """
+        with self._lock:
+            self._cache.set(key, (version, value))
+
+    def invalidate(self, key):
+        """
+        Drop the entry for a key if present
+        """
+        with self._lock:
+            self._cache.invalidate(key)
+
+    def clear(self):
+        """
+        Drop all entries
+        """
+        with self._lock:
+            self._cache.clear()
+
+    def __len__(self):
+        return len(self._cache)
@@ -0,0 +1,239 @@
+"""
+Columnar encodings of the data of a schema for analytics
+
+Data are encoded in batches of rows, each of which becomes one piece of a
+streamed response, so that a schema's data never has to be held in memory at
+once. The first column, named "key", holds the datum keys and is followed by
+a column for each field of the schema in name order, typed from the schema,
+so schemata with a field named "key" can't be exported. Values that don't
+have their column's type, or in the binary format don't fit it, are missing.
+
+The binary format (application/x-trackit-columns) is
+
+    magic       b"TRACKITC"
+    header      uint32 length, then JSON {"columns": [{"name", "type"}, ...]}
+    batches     uint32 row count n, then for each column in order:
+                  n uint8 validity flags, 0 where a datum lacks the field
+                  the values, zeroed where missing:
+                    bool    n uint8
+                    int     n int64
+                    number  n float64
+                    string  n + 1 uint32 offsets into the bytes that follow,
+                            which are the UTF-8 encoded values
+    end         uint32 0
+
+where all integers are little-endian, so each column of a batch can be loaded
+with e.g. numpy.frombuffer instead of being parsed.
+"""
+
+import csv
+import io
+import itertools
+import json
+import struct
+import sys
+
+from api.validation import TYPE_CHECKS
+
+CSV_MIMETYPE = "text/csv"
+BINARY_MIMETYPE = "application/x-trackit-columns"
+MAGIC = b"TRACKITC"
+END = struct.pack("<I", 0)
+
+# name of the column of datum keys, reserved among field names
+KEY_COLUMN = "key"
+
+# struct format codes of fixed width column types
+FIXED_FORMATS = {"bool": "B", "int": "q", "number": "d"}
+# inclusive bounds of the values of numeric column types
+RANGES = {
+    "int": (-2**63, 2**63 - 1),
+    "number": (-sys.float_info.max, sys.float_info.max),
+}
+
+
+def columns(body):
+    """
+    Return the (name, type) of each column of the data of a schema body
+
+    Raises ValueError if a field is named like the key column or doesn't have
+    one of the types of api.validation, e.g. in schemata restored from an
+    archive without validation.
+    """
+    if not isinstance(body, dict):
+        raise ValueError("schema must map field names to specs")
+    if KEY_COLUMN in body:
+        raise ValueError("field {} clashes with the key column".format(
+            KEY_COLUMN))
+    cols = [(KEY_COLUMN, "string")]
+    for field in sorted(body):
+        spec = body[field]
+        kind = spec.get("type") if isinstance(spec, dict) else None
+        if not isinstance(kind, str) or kind not in TYPE_CHECKS:
+            raise ValueError("field {} has unknown type {}".format(
+                field, kind))
+        cols.append((field, kind))
+    return cols
+
+
+def _fits(kind, value):
+    """
+    Return true iff a valid value of a column fits its binary type
+    """
+    if kind not in RANGES:
+        return True
+    low, high = RANGES[kind]
+    return low <= value <= high
+
+
+def _column(rows, index, name, kind):
+    """
+    Return the validity flags and values of the column at an index of
+    (key, datum) rows
+    """
+    if index == 0:
+        return [1] * len(rows), [key for key, _ in rows]
+    check = TYPE_CHECKS[kind]
+    flags, values = [], []
+    for _, datum in rows:
+        value = datum.get(name)
+        valid = value is not None and check(value)
+        flags.append(int(valid))
+        values.append(value if valid else None)
+    return flags, values
+
+
+def csv_header(cols):
+    """
+    Return the header line of a CSV export
+    """
+    return csv_rows([[name for name, _ in cols]])
+
+
+def csv_rows(rows):
+    """
+    Return rows of cells as CSV lines
+    """
+    out = io.StringIO()
+    csv.writer(out, lineterminator="\n").writerows(rows)
+    return out.getvalue()
+
+
+def csv_batch(cols, rows):
+    """
+    Return a batch of (key, datum) rows as CSV lines
+    """
+    cells = [[] for _ in rows]
+    for index, (name, kind) in enumerate(cols):
+        _, values = _column(rows, index, name, kind)
+        for row, value in zip(cells, values):
+            if value is None:
+                row.append("")
+            elif kind == "bool":
+                row.append("true" if value else "false")
+            else:
+                row.append(value)
+    return csv_rows(cells)
+
+
+def binary_header(cols):
+    """
+    Return the magic and header of a binary export
+    """
+    header = json.dumps({
+        "columns": [{
+            "name": name,
+            "type": kind
+        } for name, kind in cols]
+    }).encode("utf-8")
+    return MAGIC + struct.pack("<I", len(header)) + header
+
+
+def binary_batch(cols, rows):
+    """
+    Return a batch of (key, datum) rows in the binary format
+    """
+    count = len(rows)
+    pieces = [struct.pack("<I", count)]
+    for index, (name, kind) in enumerate(cols):
+        flags, values = _column(rows, index, name, kind)
+        for i, value in enumerate(values):
+            if value is not None and not _fits(kind, value):
+                flags[i], values[i] = 0, None
+        pieces.append(bytes(flags))
+        if kind in FIXED_FORMATS:
+            pieces.append(
+                struct.pack("<{}{}".format(count, FIXED_FORMATS[kind]),
+                            *[value or 0 for value in values]))
+        else:
+            encoded = [(value or "").encode("utf-8") for value in values]
+            offsets = [0]
+            for value in encoded:
+                offsets.append(offsets[-1] + len(value))
+            pieces.append(struct.pack("<{}I".format(count + 1), *offsets))
+            pieces.extend(encoded)
+    return b"".join(pieces)
+
+
+def read_binary(data):
+    """
+    Decode a binary export into a map of column name to list of values, with
+    None for missing values
+    """
+    if not data.startswith(MAGIC):
+        raise ValueError("not a columnar export")
+    offset = len(MAGIC)
+    length, = struct.unpack_from("<I", data, offset)
+    offset += 4
+    cols = json.loads(data[offset:offset + length].decode("utf-8"))["columns"]
+    offset += length
+    result = {col["name"]: [] for col in cols}
+    while True:
+        count, = struct.unpack_from("<I", data, offset)
+        offset += 4
+        if not count:
+            return result
+        for col in cols:
+            flags = data[offset:offset + count]
+            offset += count
+            if col["type"] in FIXED_FORMATS:
+                fmt = "<{}{}".format(count, FIXED_FORMATS[col["type"]])
+                values = list(struct.unpack_from(fmt, data, offset))
+                offset += struct.calcsize(fmt)
+                if col["type"] == "bool":
+                    values = [bool(value) for value in values]
+            else:
+                offsets = struct.unpack_from("<{}I".format(count + 1), data,
+                                             offset)
+                offset += 4 * (count + 1)
+                values = [
+                    data[offset + start:offset + end].decode("utf-8")
+                    for start, end in zip(offsets, offsets[1:])
+                ]
+                offset += offsets[-1]
+            result[col["name"]].extend(
+                value if flag else None for flag, value in zip(flags, values))
+
+
+# mimetype, header, batch encoder and end of each export format
+FORMATS = {
+    "csv": (CSV_MIMETYPE, csv_header, csv_batch, ""),
+    "columns": (BINARY_MIMETYPE, binary_header, binary_batch, END),
+}
+
+
+def export(fmt, cols, rows, size):
+    """
+    Yield the pieces of an export of (key, datum) rows encoded in batches of
+    up to size rows
+    """
+    _, header, batch, end = FORMATS[fmt]
+    yield header(cols)
+    rows = iter(rows)
+    while True:
+        chunk = list(itertools.islice(rows, size))
+        if not chunk:
+            break
+        yield batch(cols, chunk)
+    if end:
+        yield end
@@ -0,0 +1,131 @@
+"""
+RethinkDB connection and schema setup for the trackit API
+
+The schema is set up by migrate(), which is idempotent and is run once per
+deployment, e.g. by the gunicorn master before it forks workers or with
+`python -m api.db`, rather than by each process serving the API.
+"""
+
+import logging
+
+import rethinkdb as r
+
+from api.pool import retry
+from api.settings import DB_HOST, DB_NAME, DB_PORT
+from api.storage import INDEXES, PRIMARY_KEYS
+
+LOGGER = logging.getLogger(__name__)
+
+
+def connect():
+    """
+    Open a new rethinkdb connection
+    """
+    return r.connect(DB_HOST, DB_PORT)
+
+
+def is_alive(conn):
+    """
+    Return true iff a rethinkdb connection is open and answering queries
+    """
+    return conn.is_open() and r.expr(1).run(conn) == 1
+
+
+def schemata_feed():
+    """
+    Return the query of a changefeed of the schemata table including its
+    initial contents
+    """
+    return r.db(DB_NAME).table("schemata").changes(
+        include_initial=True, include_states=True)
+
+
+def open_schemata_feed():
+    """
+    Open a changefeed of the schemata table on a connection of its own
+    """
+    return schemata_feed().run(connect())
+
+
+async def open_async_schemata_feed():
+    """
+    Open a changefeed of the schemata table on an asyncio connection of its
+    own, once the driver's loop type is asyncio
+    """
+    return await schemata_feed().run(await connect())
+
+
+def migrate():
+    """
+    Bring the rethinkdb schema up to date once the db accepts connections
+    """
+    conn = retry(connect)
+    try:
+        init_db(conn)
+    finally:
+        conn.close()
+
+
+def init_db(conn):
+    """
+    Create the database, tables and indexes that don't exist yet and wait
+    for new indexes to be built
+
+    What exists is read in three queries whatever the number of tables, so
+    that running this against an up to date db is quick.
+    """
+    if not r.db_list().contains(DB_NAME).run(conn):
+        _create(r.db_create(DB_NAME), conn)
+    database = r.db(DB_NAME)
+    tables = database.table_list().run(conn)
+    for table in sorted(set(PRIMARY_KEYS) - set(tables)):
+        _create(
+            database.table_create(table, primary_key=PRIMARY_KEYS[table]),
+            conn)
+    indexed = {table: indexes for table, indexes in INDEXES.items() if indexes}
+    existing = r.expr({
+        table: database.table(table).index_list()
+        for table in indexed
+    }).run(conn)
+    for table, indexes in sorted(indexed.items()):
+        missing = sorted(set(indexes) - set(existing[table]))
+        for name in missing:
+            LOGGER.info("creating index %s of %s", name, table)
+            _create(
+                database.table(table).index_create(
+                    name, _index_expression(indexes[name])), conn)
+        if missing:
+            database.table(table).index_wait(*missing).run(conn)
+
+
+def _index_expression(fields):
+    """
+    Return the expression of an index of row fields
+    """
+    if len(fields) == 1:
+        return r.row[fields[0]]
+    return [r.row[field] for field in fields]
+
+
+def _create(query, conn):
+    """
+    Run a query creating a database, table or index, ignoring that another
+    process migrating at the same time created it first
+    """
+    try:
+        query.run(conn)
+    except r.ReqlOpFailedError as error:
+        if "already exists" not in str(error):
+            raise
+
+
+def main():
+    """
+    Migrate the db configured by the settings
+    """
+    logging.basicConfig(level=logging.INFO)
+    migrate()
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,122 @@
+"""
+Request and response body encodings for the trackit API
+"""
+
+import json
+
+from werkzeug.exceptions import BadRequest
+
+try:
+    import msgpack
+except ImportError:
+    msgpack = None
+
+try:
+    import orjson
+except ImportError:
+    orjson = None
+
+JSON_MIMETYPE = "application/json"
+# the registered MessagePack mimetype followed by aliases clients still send
+MSGPACK_MIMETYPES = ("application/msgpack", "application/vnd.msgpack",
+                     "application/x-msgpack")
+
+
+class JSONCodec(object):
+    """
+    Compact JSON using the fastest encoder installed
+    """
+    mimetype = JSON_MIMETYPE
+
+    @staticmethod
+    def dumps(obj, pretty=False):
+        """
+        Encode an object as JSON bytes
+        """
+        if pretty:
+            return json.dumps(obj, indent=4).encode("utf-8")
+        if orjson is not None:
+            return orjson.dumps(obj)
+        return json.dumps(obj, separators=(",", ":")).encode("utf-8")
+
+    @staticmethod
+    def loads(data):
+        """
+        Decode JSON bytes into an object
+        """
+        if orjson is not None:
+            return orjson.loads(data)
+        return json.loads(data.decode("utf-8"))
+
+
+class MsgpackCodec(object):
+    """
+    MessagePack binary encoding
+    """
+    mimetype = MSGPACK_MIMETYPES[0]
+
+    @staticmethod
+    def dumps(obj, pretty=False):  # pylint: disable=unused-argument
+        """
+        Encode an object as MessagePack bytes
+        """
+        return msgpack.packb(obj, use_bin_type=True)
+
+    @staticmethod
+    def loads(data):
+        """
+        Decode MessagePack bytes into an object
+        """
+        return msgpack.unpackb(data, raw=False)
+
+
+# argument values switching an option on
+TRUE_VALUES = ("1", "true", "yes", "on")
+
+CODECS = {JSON_MIMETYPE: JSONCodec}
+if msgpack is not None:
+    CODECS.update((mimetype, MsgpackCodec) for mimetype in MSGPACK_MIMETYPES)
+
+
+def dumps_json(obj):
+    """
+    Encode an object as a compact JSON string
+    """
+    return JSONCodec.dumps(obj).decode("utf-8")
+
+
+def is_pretty(value):
+    """
+    Return true iff the value of a pretty argument asks for indented output
+    """
+    return (value or "").strip().lower() in TRUE_VALUES
+
+
+def negotiate(accept_mimetypes):
+    """
+    Return the mimetype best matching the parsed Accept header of a request
+    and its codec, so that responses are labelled with the alias asked for
+    """
+    mimetype = accept_mimetypes.best_match(list(CODECS), default=JSON_MIMETYPE)
+    return mimetype, CODECS[mimetype]
+
+
+def decode(mimetype, data):
+    """
+    Decode a request body according to its mimetype
+
+    Raises ValueError if the body is malformed.
+    """
+    return CODECS.get(mimetype, JSONCodec).loads(data)
+
+
+def decode_body(request):
+    """
+    Decode the body of a flask request according to its Content-Type
+
+    Raises a 400 if the body is malformed.
+    """
+    try:
+        return decode(request.mimetype, request.get_data())
+    except ValueError:
+        raise BadRequest("malformed request body")
@@ -0,0 +1,64 @@
+"""
+Gunicorn settings serving the trackit API from preforked workers
+
+Run with `gunicorn -c api/gunicorn_config.py "api.wsgi:create_app()"`. The
+master migrates the db once and forks WEB_CONCURRENCY workers, one per core
+by default, which each build the app and open db connections after the fork.
+Each worker serves requests on as many threads as it has pooled connections.
+"""
+
+# gunicorn reads its settings from lowercase module globals
+# pylint: disable=invalid-name
+
+import glob
+import multiprocessing
+import os
+import tempfile
+
+from api import db, settings
+
+bind = "0.0.0.0:{}".format(settings.PORT)
+workers = settings.WEB_CONCURRENCY or multiprocessing.cpu_count()
+worker_class = "gthread"
+threads = settings.THREADS
+# build the app in each worker rather than in the master before forking
+preload_app = False
+# longer than the proxy keeps idle upstream connections open
+keepalive = 75
+# workers finish in-flight requests within this on restarts
+graceful_timeout = 10
+
+
+def on_starting(server):
+    """
+    Migrate the db once before any worker starts, have the workers share
+    their metrics and turn off the caches of data by default if several
+    workers will run
+
+    Workers inherit the environment and settings of the master over the fork.
+    They record their metrics in files in PROMETHEUS_MULTIPROC_DIR, which must
+    be set before they first import prometheus_client, for any of them to
+    report those of all. They can't see each other's writes in their caches
+    of data.
+    """
+    if "PROMETHEUS_MULTIPROC_DIR" not in os.environ:
+        os.environ["PROMETHEUS_MULTIPROC_DIR"] = tempfile.mkdtemp(
+            prefix="trackit-metrics-")
+    # metrics left behind by a previous master
+    for path in glob.glob(
+            os.path.join(os.environ["PROMETHEUS_MULTIPROC_DIR"], "*.db")):
+        os.remove(path)
+    if server.cfg.workers > 1 and "DATUM_CACHE_SIZE" not in os.environ:
+        settings.DATUM_CACHE_SIZE = 0
+    if settings.MIGRATE and not settings.SQLITE_PATH:
+        db.migrate()
+
+
+def child_exit(server, worker):  # pylint: disable=unused-argument
+    """
+    Stop reporting the requests in flight of a worker that exited
+    """
+    # prometheus_client is imported only once the workers have forked
+    # pylint: disable=import-outside-toplevel
+    from prometheus_client import multiprocess
+    multiprocess.mark_process_dead(worker.pid)
@@ -0,0 +1,1088 @@
+"""
+Request and response logic shared by the servers of the trackit API
+
+api.api.API serves the API with flask on threads and api.aio.AsyncAPI with
+aiohttp on an asyncio event loop. Both derive from BaseAPI, which holds their
+caches and settings, and build their responses with the functions of this
+module, which parse arguments, validate bodies and turn requests into rows
+and rows into responses without doing any I/O. The servers themselves only
+read requests, run storage operations and background jobs, and send
+responses. Invalid requests raise werkzeug HTTP exceptions, which flask sends
+as is and api.aio sends as the same responses.
+"""
+
+import base64
+import collections
+import functools
+import json
+import time
+import uuid
+import zlib
+from urllib.parse import quote
+
+from werkzeug.exceptions import (BadRequest, InternalServerError, NotFound,
+                                 ServiceUnavailable, TooManyRequests)
+from werkzeug.http import http_date, parse_etags
+
+from api import admission, columnar, encoding, metrics, validation
+from api.cache import LRUCache, VersionedCache
+from api.storage import AGGREGATES, DURABILITIES, GROUPINGS
+
+# types of the fields each aggregate applies to, or None for any field
+AGGREGATE_TYPES = {
+    "count": None,
+    "sum": ("int", "number"),
+    "min": ("int", "number", "string"),
+    "max": ("int", "number", "string"),
+    "ratio": ("bool", ),
+}
+
+# admission budget taken by requests of each route, "normal" if not listed,
+# or None for probes and scrapes which must get through under load
+ROUTE_BUDGETS = {
+    "set_data": "expensive",
+    "get_aggregate": "expensive",
+    "get_export": "expensive",
+    "get_archive": "expensive",
+    "restore_archive": "expensive",
+    "purge": "expensive",
+    "get_job": None,
+    "get_pool_stats": None,
+    "get_liveness": None,
+    "get_readiness": None,
+    "get_metrics": None,
+}
+
+# response header naming what a request changed for caches in front of the API
+INVALIDATE_HEADER = "X-Trackit-Invalidate"
+# names beyond which the header invalidates everything to keep it short
+MAX_INVALIDATIONS = 32
+
+# seconds background jobs are kept in the jobs table after they're started
+JOB_TTL = 60 * 60
+
+# query arguments restricting data to a page
+PAGE_ARGS = ("start", "end", "limit", "continuation")
+
+
+def rejection(error):
+    """
+    Return the HTTP error for a request admission control rejected, a 429 if
+    its namespace's budget was full and a 503 if the process's was
+    """
+    if error.scope == admission.NAMESPACE:
+        return TooManyRequests(str(error), retry_after=error.retry_after)
+    return ServiceUnavailable(str(error), retry_after=error.retry_after)
+
+
+def int_arg(args, name, default=None):
+    """
+    Return an integer query argument or default if missing
+
+    Raises a 400 if it isn't an integer.
+    """
+    value = args.get(name)
+    if value is None:
+        return default
+    try:
+        return int(value)
+    except ValueError:
+        raise BadRequest("{} must be an integer".format(name))
+
+
+def encode_token(key):
+    """
+    Encode the last datum key of a page as an opaque continuation token
+    """
+    return base64.urlsafe_b64encode(json.dumps(
+        {"after": key}).encode("utf-8")).decode("ascii")
+
+
+def decode_token(token):
+    """
+    Decode a continuation token into the datum key it resumes after
+
+    Raises ValueError if the token is invalid.
+    """
+    try:
+        return json.loads(
+            base64.urlsafe_b64decode(token.encode("ascii")).decode("utf-8"))[
+                "after"]
+    except (KeyError, TypeError):
+        raise ValueError("invalid continuation token")
+
+
+def page_args(args):
+    """
+    Return the start, end, datum key to resume after and limit of a page of
+    data given the query arguments
+
+    Raises a 400 if the limit or continuation token is invalid.
+    """
+    limit = int_arg(args, "limit")
+    if limit is not None and limit < 1:
+        raise BadRequest("limit must be positive")
+    after = None
+    if args.get("continuation") is not None:
+        try:
+            after = decode_token(args["continuation"])
+        except ValueError as error:
+            raise BadRequest(str(error))
+    return args.get("start"), args.get("end"), after, limit
+
+
+def data_result(username, schema, entries):
+    """
+    Return data rows of a schema as a map of datum key to datum
+    """
+    prefix = len(username) + len(schema) + 2
+    return {entry["key"][prefix:]: entry["datum"] for entry in entries}
+
+
+def page_result(username, schema, entries, limit):
+    """
+    Return a page of data rows of a schema as a map of datum key to datum
+    and the headers of the response, with the continuation token of the next
+    page if there are more than limit rows
+    """
+    headers = {}
+    if limit is not None and len(entries) > limit:
+        entries = entries[:limit]
+        headers["X-Continuation-Token"] = encode_token(
+            entries[-1]["key"][len(username) + len(schema) + 2:])
+    return data_result(username, schema, entries), headers
+
+
+def etag(version, variant):
+    """
+    Return the entity tag of a representation of a versioned resource
+
+    variant distinguishes representations of one version, e.g. pages or
+    encodings, and is typically the query string and Accept header.
+    """
+    return "{}-{:08x}".format(version, zlib.crc32(variant.encode("utf-8")))
+
+
+def conditional_headers(entries, query_string, accept, if_none_match):
+    """
+    Return the validators of a response for the current versions of the
+    namespaces and namespace/schema pairs it depends on given their versions
+    rows and the query string, Accept and If-None-Match headers of the
+    request, and whether the client already has those versions
+    """
+    tag = etag(".".join(entry["version"] for entry in entries),
+               "{}|{}".format(query_string, accept or ""))
+    headers = {
+        "ETag": '"{}"'.format(tag),
+        "Last-Modified": http_date(
+            max(entry["modified"] for entry in entries)),
+    }
+    return headers, parse_etags(if_none_match).contains_weak(tag)
+
+
+def with_headers(result, headers):
+    """
+    Return the result of a handler, optionally paired with headers, paired
+    with those headers added to the given ones
+    """
+    if isinstance(result, tuple):
+        result, extra_headers = result
+        headers = dict(headers, **extra_headers)
+    return result, headers
+
+
+def new_version():
+    """
+    Return the fields of a versions row recording a new version
+    """
+    return {"version": uuid.uuid4().hex, "modified": time.time()}
+
+
+def versions_rows(names):
+    """
+    Return the versions rows recording a new version of the named namespaces
+    and namespace/schema pairs
+    """
+    version = new_version()
+    return [dict(version, name=name) for name in names]
+
+
+def namespace_schemata(username, entries):
+    """
+    Return the schemata rows of a namespace as a map of name to body
+    """
+    return {entry["name"][len(username) + 1:]: entry["body"]
+            for entry in entries}
+
+
+def group_schemata(namespaces, entries):
+    """
+    Return schemata rows as a map of namespace to schema name to body with
+    an entry for each of the given namespaces
+    """
+    schemata = {namespace: {} for namespace in namespaces}
+    for entry in entries:
+        schemata[entry["username"]][entry["name"][len(entry["username"]) +
+                                                  1:]] = entry["body"]
+    return schemata
+
+
+def schema_row(username, name, body):
+    """
+    Return the row stored in the schemata table for a schema
+
+    Raises a 400 if the body isn't a valid schema.
+    """
+    try:
+        validation.compile_schema(body)
+    except validation.ValidationError as error:
+        raise BadRequest(str(error))
+    return {
+        "name": "{}/{}".format(username, name),
+        "body": body,
+        "username": username,
+    }
+
+
+def schema_body(name, body):
+    """
+    Return the body of a schema read as None if it doesn't exist
+
+    Raises a 404 if it doesn't exist.
+    """
+    if body is None:
+        raise NotFound("no schema {}".format(name))
+    return body
+
+
+def compile_validator(name, body):
+    """
+    Compile the validator of a schema given its body
+
+    Raises a 400 if it's invalid.
+    """
+    try:
+        return validation.compile_schema(body)
+    except validation.ValidationError as error:
+        raise BadRequest("schema {} is invalid: {}".format(name, error))
+
+
+def check_datum(validate, datum):
+    """
+    Validate a datum against its schema
+
+    Raises a 400 if it's invalid.
+    """
+    try:
+        validate(datum)
+    except validation.ValidationError as error:
+        raise BadRequest(str(error))
+
+
+def aggregation(body, args):
+    """
+    Return the aggregate, field and grouping of an aggregation of the data of
+    a schema given its body and the query arguments
+
+    Raises a 400 if the aggregation is invalid for the schema.
+    """
+    aggregate = args.get("aggregate", "count")
+    field = args.get("field")
+    grouping = args.get("group")
+    if aggregate not in AGGREGATES:
+        raise BadRequest("aggregate must be one of {}".format(
+            ", ".join(AGGREGATES)))
+    if grouping is not None and grouping not in GROUPINGS:
+        raise BadRequest("group must be one of {}".format(
+            ", ".join(GROUPINGS)))
+    if field is None:
+        if AGGREGATE_TYPES[aggregate] is not None:
+            raise BadRequest("{} requires a field".format(aggregate))
+    elif field not in body:
+        raise BadRequest("schema has no field {}".format(field))
+    elif (AGGREGATE_TYPES[aggregate] is not None
+          and body[field].get("type") not in AGGREGATE_TYPES[aggregate]):
+        raise BadRequest("{} requires a field of type {}".format(
+            aggregate, " or ".join(AGGREGATE_TYPES[aggregate])))
+    return aggregate, field, grouping
+
+
+def aggregation_result(groups, grouping):
+    """
+    Return the response for the aggregate values of each group
+    """
+    if grouping is None:
+        return {"value": groups.get(None)}
+    return {"groups": {period: groups[period] for period in sorted(groups)}}
+
+
+def export_format(args):
+    """
+    Return the format of an export given by the query arguments
+
+    Raises a 400 if it's unknown.
+    """
+    fmt = args.get("format", "csv")
+    if fmt not in columnar.FORMATS:
+        raise BadRequest("unknown export format {}".format(fmt))
+    return fmt
+
+
+def export_columns(body):
+    """
+    Return the columns of the export of a schema given its body
+
+    Raises a 400 if the schema can't be exported.
+    """
+    try:
+        return columnar.columns(body)
+    except ValueError as error:
+        raise BadRequest(str(error))
+
+
+def export_row(username, schema, entry):
+    """
+    Return the (datum key, datum) exported for a data row of a schema
+    """
+    return entry["key"][len(username) + len(schema) + 2:], entry["datum"]
+
+
+def datum_row(username, schema, key, datum):
+    """
+    Return the row stored in the data table for a datum
+    """
+    return {
+        "key": "{}/{}/{}".format(username, schema, key),
+        "username": username,
+        "schema": schema,
+        "datum": datum
+    }
+
+
+def data_items(body):
+    """
+    Return an iterator over the (key, datum) pairs of a body mapping keys to
+    data
+
+    Raises a 400 if the body isn't a map.
+    """
+    if not isinstance(body, dict):
+        raise BadRequest("body must map keys to data")
+    return iter(body.items())
+
+
+def datum_rows(username, schema, items, validate):
+    """
+    Validate a batch of (key, datum) pairs and return the outcome per key of
+    the invalid ones and the rows to write for the others
+    """
+    results = {}
+    rows = []
+    for key, datum in items:
+        if not isinstance(key, str) or not key or "/" in key:
+            results[str(key)] = {"error": "invalid key"}
+            continue
+        try:
+            validate(datum)
+        except validation.ValidationError as error:
+            results[key] = {"error": str(error)}
+            continue
+        rows.append(datum_row(username, schema, key, datum))
+    return results, rows
+
+
+def write_results(username, schema, rows, errors):
+    """
+    Return the outcome per key of writing data rows of a schema given the
+    error writing each row or None
+    """
+    prefix = len(username) + len(schema) + 2
+    return {
+        row["key"][prefix:]:
+        {"error": error} if error is not None else {"status": "ok"}
+        for row, error in zip(rows, errors)
+    }
+
+
+def first_error(written):
+    """
+    Return the error of an upsert of a single row or None
+    """
+    return written["first_error"] if written["errors"] else None
+
+
+def _ndjson_record(line, lineno, kind):
+    """
+    Decode a line of a line-delimited body into a record or None if it's
+    blank
+
+    Raises a 400 naming the kind of record expected if it's malformed.
+    """
+    if not line.strip():
+        return None
+    try:
+        record = encoding.JSONCodec.loads(line)
+    except ValueError:
+        record = None
+    if not isinstance(record, dict):
+        raise BadRequest("malformed {} record on line {}".format(
+            kind, lineno))
+    return record
+
+
+def datum_item(line, lineno):
+    """
+    Return the (key, datum) of a line of line-delimited data or None if it's
+    blank
+
+    Raises a 400 if the line is malformed.
+    """
+    record = _ndjson_record(line, lineno, "datum")
+    if record is None:
+        return None
+    try:
+        return record["key"], record["datum"]
+    except KeyError:
+        raise BadRequest("malformed datum record on line {}".format(lineno))
+
+
+def archive_item(line, lineno):
+    """
+    Return the table and row of a line of a line-delimited archive, None and
+    the (namespace, schema) purged by a purge record, or None if the line is
+    blank
+
+    Raises a 400 if the line is malformed.
+    """
+    record = _ndjson_record(line, lineno, "archive")
+    if record is None:
+        return None
+    try:
+        if record["type"] == "purge":
+            return None, purge_scope(record)
+        return archive_row(record)
+    except (ValueError, KeyError, TypeError):
+        raise BadRequest("malformed archive record on line {}".format(lineno))
+
+
+def archive_row(record):
+    """
+    Return the table and row for a record of a line-delimited archive
+    """
+    if record["type"] == "schema":
+        return "schemata", {
+            "name": "{}/{}".format(record["namespace"], record["name"]),
+            "body": record["schema"],
+            "username": record["namespace"],
+        }
+    if record["type"] == "datum":
+        return "data", datum_row(record["namespace"], record["schema"],
+                                 record["key"], record["datum"])
+    raise ValueError("unknown record type {}".format(record["type"]))
+
+
+def archive_batches(archive, size):
+    """
+    Return the (table, rows) of batches of up to size schemata rows and then
+    data rows of an archive in the nested JSON format
+    """
+    schemata = [{
+        "name": "{}/{}".format(namespace, schema_name),
+        "body": schema_spec["schema"],
+        "username": namespace
+    }
+                for namespace, space_items in archive.items()
+                for schema_name, schema_spec in space_items.items()]
+    data = [
+        datum_row(namespace, schema_name, datum_name, datum)
+        for namespace, space_items in archive.items()
+        for schema_name, schema_spec in space_items.items()
+        for datum_name, datum in schema_spec["data"].items()
+    ]
+    return batches("schemata", schemata, size) + batches("data", data, size)
+
+
+def batches(table, rows, size):
+    """
+    Return the (table, rows) of batches of up to size rows of a table
+    """
+    return [(table, rows[i:i + size]) for i in range(0, len(rows), size)]
+
+
+def nested_archive(schemata, data):
+    """
+    Return the archive in the nested JSON format of schemata and data rows
+    """
+    archive = collections.defaultdict(dict)
+    for entry in schemata:
+        namespace, schema_name = entry["name"].split("/")
+        archive[namespace][schema_name] = {"schema": entry["body"], "data": {}}
+    for entry in data:
+        archive[entry["username"]][entry["schema"]]["data"][entry[
+            "key"].split("/")[-1]] = entry["datum"]
+    return dict(archive)
+
+
+class Restore(object):
+    """
+    A restore of a line-delimited archive, whose rows are written in bounded
+    batches per table as they are read
+    """
+
+    def __init__(self, batch_size):
+        """
+        Initialize
+        """
+        self.batch_size = batch_size
+        self.started = time.monotonic()
+        self.counts = {"schemata": 0, "data": 0, "purges": 0}
+        self.batches = 0
+        self._pending = {"schemata": [], "data": []}
+
+    def add(self, table, row):
+        """
+        Add a row of a table and return the (table, rows) of the batches to
+        write now
+        """
+        self._pending[table].append(row)
+        if len(self._pending[table]) < self.batch_size:
+            return []
+        return self._take(table)
+
+    def flush(self):
+        """
+        Return the (table, rows) of batches of all rows still pending, which
+        are written before purges and once the archive is read
+        """
+        return [
+            batch for table in self._pending for batch in self._take(table)
+        ]
+
+    def _take(self, table):
+        """
+        Return the batches of the rows pending for a table counting them as
+        written
+        """
+        rows, self._pending[table] = self._pending[table], []
+        self.counts[table] += len(rows)
+        taken = batches(table, rows, self.batch_size)
+        self.batches += len(taken)
+        return taken
+
+    def summary(self):
+        """
+        Return the response summarizing the restore
+        """
+        return {
+            "schemata": self.counts["schemata"],
+            "data": self.counts["data"],
+            "purges": self.counts["purges"],
+            "batches": self.batches,
+            "seconds": round(time.monotonic() - self.started, 3),
+        }
+
+
+class ArchiveJSON(object):
+    """
+    The pieces of an archive in the nested JSON format given its schemata
+    rows, ordered such that those of a namespace are adjacent, each followed
+    by its data rows
+    """
+
+    def __init__(self):
+        """
+        Initialize
+        """
+        self.namespace = None
+        self.separator = ""
+
+    @staticmethod
+    def start():
+        """
+        Return the piece opening the archive
+        """
+        return "{"
+
+    def schema(self, entry):
+        """
+        Return the piece opening a schema and its data
+        """
+        namespace, schema_name = entry["name"].split("/")
+        if namespace == self.namespace:
+            opening = ", "
+        else:
+            opening = "{}{}: {{".format(
+                "}, " if self.namespace is not None else "",
+                encoding.dumps_json(namespace))
+        self.namespace = namespace
+        self.separator = ""
+        return '{}{}: {{"schema": {}, "data": {{'.format(
+            opening, encoding.dumps_json(schema_name),
+            encoding.dumps_json(entry["body"]))
+
+    def datum(self, entry):
+        """
+        Return the piece of a data row of the current schema
+        """
+        piece = '{}{}: {}'.format(
+            self.separator, encoding.dumps_json(entry["key"].split("/")[-1]),
+            encoding.dumps_json(entry["datum"]))
+        self.separator = ", "
+        return piece
+
+    @staticmethod
+    def end_schema():
+        """
+        Return the piece closing the current schema
+        """
+        return "}}"
+
+    def end(self):
+        """
+        Return the piece closing the archive
+        """
+        return "}}" if self.namespace is not None else "}"
+
+
+def stamp(rows):
+    """
+    Record the time rows are written in their modified field
+    """
+    modified = time.time()
+    for row in rows:
+        row["modified"] = modified
+    return rows
+
+
+def parse_since(args):
+    """
+    Parse the watermark of a delta archive given by the since argument or
+    return None if there is none
+
+    Raises a 400 if the watermark is invalid.
+    """
+    value = args.get("since")
+    if value is None:
+        return None
+    try:
+        since = float(value)
+    except ValueError as error:
+        raise BadRequest(str(error))
+    if since != since or since < 0:
+        raise BadRequest("invalid watermark {}".format(value))
+    return since
+
+
+def ndjson_line(record):
+    """
+    Return the line of a record of a line-delimited archive
+    """
+    return encoding.dumps_json(record) + "\n"
+
+
+def schema_record(entry):
+    """
+    Return the record of a line-delimited archive for a schemata row
+    """
+    namespace, schema_name = entry["name"].split("/")
+    return {
+        "type": "schema",
+        "namespace": namespace,
+        "name": schema_name,
+        "schema": entry["body"],
+    }
+
+
+def datum_record(entry):
+    """
+    Return the record of a line-delimited archive for a data row
+    """
+    return {
+        "type": "datum",
+        "namespace": entry["username"],
+        "schema": entry["schema"],
+        "key": entry["key"].split("/")[-1],
+        "datum": entry["datum"],
+    }
+
+
+def tombstone(name):
+    """
+    Return the tombstone left by purging the named namespace or schema, or
+    everything for "*", now
+    """
+    return {"name": name, "modified": time.time()}
+
+
+def purge_records(tombstones, since):
+    """
+    Return the records of a delta archive for the tombstones left since a
+    watermark in the order they were left
+    """
+    return [
+        purge_record(entry)
+        for entry in sorted((entry for entry in tombstones
+                             if entry["modified"] >= since),
+                            key=lambda entry: entry["modified"])
+    ]
+
+
+def purge_record(entry):
+    """
+    Return the record of a line-delimited archive for a tombstone, which is
+    named after the purged namespace or schema or "*" for everything
+    """
+    record = {"type": "purge"}
+    if entry["name"] != "*":
+        namespace, _, schema = entry["name"].partition("/")
+        record["namespace"] = namespace
+        if schema:
+            record["schema"] = schema
+    return record
+
+
+def purge_scope(record):
+    """
+    Return the (namespace, schema) purged by a record of a line-delimited
+    archive, where a schema of None purges the whole namespace and a
+    namespace of None everything
+
+    Raises ValueError if the record is invalid.
+    """
+    namespace, schema = record.get("namespace"), record.get("schema")
+    if (not isinstance(namespace, (str, type(None)))
+            or not isinstance(schema, (str, type(None)))
+            or (namespace is None and schema is not None)):
+        raise ValueError("invalid purge record")
+    return namespace, schema
+
+
+def purge_job(username, schema=None):
+    """
+    Return the initial state of a job purging a namespace or a schema
+    """
+    return {
+        "id": uuid.uuid4().hex,
+        "namespace": username,
+        "schema": schema,
+        "started": time.time(),
+        "status": "running",
+        "deleted": {
+            "schemata": 0,
+            "data": 0
+        },
+    }
+
+
+def scope_name(username, schema=None):
+    """
+    Return the name of a namespace, or namespace/schema pair if schema isn't
+    None
+    """
+    return "/".join(filter(None, (username, schema)))
+
+
+def job_scope(job):
+    """
+    Return the name of the namespace or namespace/schema pair of a purge job
+    """
+    return scope_name(job["namespace"], job["schema"])
+
+
+def expired_jobs(jobs, job):
+    """
+    Return the ids of the jobs that expired by the time a job started
+    """
+    return [old["id"] for old in jobs
+            if old["started"] < job["started"] - JOB_TTL]
+
+
+def job_started(job):
+    """
+    Return the response to starting a background job
+    """
+    return job, {"Location": "/jobs/{}/".format(job["id"])}, 202
+
+
+def job_failed(job, error):
+    """
+    Mark a job failed with the error it raised
+    """
+    job["error"] = str(error)
+    job["status"] = "failed"
+
+
+def purge_steps(username, schema=None):
+    """
+    Return the (table, index, value) selecting the rows of each table to
+    delete when purging a namespace or a schema, data first
+    """
+    if schema is None:
+        return [("data", "username", username),
+                ("schemata", "username", username)]
+    return [("data", "username_schema", [username, schema]),
+            ("schemata", "name", "{}/{}".format(username, schema))]
+
+
+def invalidation_header(names):
+    """
+    Return the value of the header listing the namespaces and
+    namespace/schema pairs a request changed, URL-quoted and space separated,
+    or "*" if it changed everything or too much to list
+    """
+    if "*" in names or len(names) > MAX_INVALIDATIONS:
+        return "*"
+    return " ".join(sorted(quote(name) for name in names))
+
+
+class BaseAPI(object):
+    """
+    Abstract base class of the servers of the trackit API, which hold the
+    caches of one process and keep them current as requests write
+
+    Subclasses set the classes of their admission control, write batchers and
+    metered storage, which wait and run storage operations on threads or on
+    an event loop, and implement _upsert_data and _invalidate.
+    """
+    admission_class = None
+    batcher_class = None
+    metered_storage_class = None
+
+    def __init__(self,
+                 storage,
+                 datum_cache_size=1024,
+                 datum_cache_ttl=60,
+                 delta_overlap=60,
+                 durability="hard",
+                 write_batch_size=0,
+                 write_batch_delay=0.005,
+                 purge_batch_size=500,
+                 purge_interval=0.05,
+                 max_requests=0,
+                 namespace_requests=0,
+                 max_expensive_requests=0,
+                 namespace_expensive_requests=0,
+                 admission_timeout=0.5,
+                 retry_after=1,
+                 restore_batch_size=1000,
+                 validator_cache_size=1024,
+                 validator_cache_ttl=60,
+                 schemata_view=None,
+                 view_grace_period=2):
+        """
+        Initialize
+
+        Rows are kept in storage, whose operations are recorded in the
+        metrics.
+
+        Schemata are read from schemata_view when one is given and ready,
+        except for namespaces this process wrote to within the last
+        view_grace_period seconds, which are read from storage so that
+        clients see their own writes before the view's changefeed delivers
+        them.
+
+        Delta archives return a watermark delta_overlap seconds behind the
+        clock so that writes in flight while they are read and clock skew
+        between processes are caught by the next delta.
+
+        Writes have the given durability unless clients ask for another. If
+        write_batch_size is positive, concurrent datum writes are coalesced
+        into batches of up to that many rows, written once full or after
+        write_batch_delay seconds.
+
+        Namespaces and schemata are purged in the background in batches of
+        purge_batch_size rows with purge_interval seconds between batches.
+
+        At most max_requests requests, and namespace_requests per namespace,
+        are handled at once, and max_expensive_requests and
+        namespace_expensive_requests of those to expensive routes, where 0 is
+        no limit. Others wait up to admission_timeout seconds and are then
+        rejected, with a 429 if their namespace's budget is full and a 503
+        otherwise, and told to retry after retry_after seconds.
+        """
+        self.metrics = metrics.Metrics()
+        self.admission = self.admission_class(
+            {
+                "normal": (max_requests, namespace_requests),
+                "expensive": (max_expensive_requests,
+                              namespace_expensive_requests),
+            }, admission_timeout, retry_after)
+        self.storage = self.metered_storage_class(storage, self.metrics)
+        self.schemata_view = schemata_view
+        # namespaces recently written through this process keyed by name, or
+        # "*" after a purge
+        self.recent_schema_writes = LRUCache(1024, view_grace_period)
+        # read-through cache of datum bodies keyed by username/schema/key
+        self.datum_cache = LRUCache(datum_cache_size, datum_cache_ttl)
+        self.restore_batch_size = restore_batch_size
+        self.delta_overlap = delta_overlap
+        self.durability = durability
+        # batchers of datum writes by durability if write batching is enabled
+        self.datum_batchers = None
+        if write_batch_size > 0:
+            self.datum_batchers = {
+                level: self.batcher_class(
+                    functools.partial(self._upsert_data, durability=level),
+                    write_batch_size, write_batch_delay)
+                for level in DURABILITIES
+            }
+        self.purge_batch_size = purge_batch_size
+        self.purge_interval = purge_interval
+        # compiled schema validators keyed by username/schema and tagged with
+        # the revision of their schema in the view, if it's current
+        self.validators = VersionedCache(validator_cache_size,
+                                         validator_cache_ttl)
+        self.metrics.track(
+            metrics.cache_metrics({
+                "datum": self.datum_cache,
+                "validator": self.validators
+            }))
+        self.metrics.track(metrics.admission_metrics(self.admission))
+
+    def _upsert_data(self, rows, durability="hard"):
+        """
+        Upsert data rows and return the error writing each row or None
+        """
+        raise NotImplementedError()
+
+    @staticmethod
+    def _invalidate(names):
+        """
+        Record that the current request changed the named namespaces and
+        namespace/schema pairs, or everything for "*"
+        """
+        raise NotImplementedError()
+
+    def _view_current(self, username):
+        """
+        Return true iff the schemata of a namespace can be read from the view
+        """
+        return (self.schemata_view is not None and self.schemata_view.ready
+                and self.recent_schema_writes.get(username) is None
+                and self.recent_schema_writes.get("*") is None)
+
+    def _validator_revision(self, username, schema):
+        """
+        Return the revision of a schema to tag its validator with, or None if
+        there's no current view to follow its changes by other processes
+        """
+        if self.schemata_view is None or not self.schemata_view.ready:
+            return None
+        return self.schemata_view.revision(username, schema)
+
+    def _view_schemata(self, namespaces):
+        """
+        Return the schemata of those namespaces that can be read from the view
+        as a map of namespace to schema name to body
+        """
+        return {
+            namespace: self.schemata_view.namespace(namespace)
+            for namespace in namespaces if self._view_current(namespace)
+        }
+
+    def _durability(self, args):
+        """
+        Return the write durability requested by the client or the default
+
+        Raises a 400 if it's unknown.
+        """
+        durability = args.get("durability", self.durability)
+        if durability not in DURABILITIES:
+            raise BadRequest("durability must be one of {}".format(
+                ", ".join(DURABILITIES)))
+        return durability
+
+    def _batch_size(self, args):
+        """
+        Return the insert batch size requested by the client or the default
+
+        Raises a 400 if it isn't positive.
+        """
+        batch_size = int_arg(args, "batch_size", self.restore_batch_size)
+        if batch_size < 1:
+            raise BadRequest("batch_size must be positive")
+        return batch_size
+
+    def _written(self, table, rows):
+        """
+        Drop what's cached of schemata or data rows just written and return
+        the names of the namespaces or namespace/schema pairs they changed
+        """
+        if table == "data":
+            for row in rows:
+                self.datum_cache.invalidate(row["key"])
+            return {"{}/{}".format(row["username"], row["schema"])
+                    for row in rows}
+        for row in rows:
+            self.validators.invalidate(row["name"])
+            self.recent_schema_writes.set(row["username"], True)
+        return {row["username"] for row in rows}
+
+    def _datum_written(self, row, error):
+        """
+        Return the response to writing a datum alone or in a batch given the
+        error writing it or None
+
+        Raises a 500 if it failed.
+        """
+        if error is not None:
+            raise InternalServerError(
+                "failed to write datum: {}".format(error))
+        if self.datum_batchers is None:
+            self.datum_cache.set(row["key"], row["datum"])
+        else:
+            # the versions were bumped by the request that wrote the batch
+            self._invalidate(["{}/{}".format(row["username"], row["schema"])])
+        return {row["key"].split("/")[-1]: row["datum"]}
+
+    def _datum_read(self, fullkey, entry):
+        """
+        Cache and return the datum of a data row read on a cache miss
+
+        Raises a 404 if there is none.
+        """
+        if entry is None:
+            raise NotFound()
+        self.datum_cache.set(fullkey, entry["datum"])
+        return entry["datum"]
+
+    def _deleted(self, table, username, keys):
+        """
+        Drop what's cached of rows of a namespace just deleted from the
+        schemata or data table given their primary keys
+        """
+        cache = self.datum_cache if table == "data" else self.validators
+        for key in keys:
+            cache.invalidate(key)
+        if table == "schemata":
+            self.recent_schema_writes.set(username, True)
+
+    def _purged(self):
+        """
+        Drop everything cached once all schemata and data are deleted
+        """
+        self.datum_cache.clear()
+        self.validators.clear()
+        self.recent_schema_writes.set("*", True)
+        self._invalidate(["*"])
+
+    def _job(self, job, job_id):
+        """
+        Return the response to a poll of a job given its row of the jobs table
+
+        Raises a 404 if it doesn't exist or expired.
+        """
+        if job is None or job["started"] < time.time() - JOB_TTL:
+            raise NotFound("no job {}".format(job_id))
+        if job["status"] == "done":
+            # the job ran outside any request so tell caches once it's done
+            self._invalidate([job_scope(job)])
+        return job
+
+    def _watermark(self):
+        """
+        Return the header of the watermark of a line-delimited archive read
+        from now on
+        """
+        watermark = max(0, time.time() - self.delta_overlap)
+        return {"X-Watermark": "{:.6f}".format(watermark)}
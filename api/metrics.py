@@ -0,0 +1,469 @@
+"""
+Prometheus metrics of the trackit API
+"""
+
+import os
+import time
+
+import prometheus_client
+from prometheus_client import multiprocess
+from prometheus_client.core import CounterMetricFamily, GaugeMetricFamily
+
+from api.storage import AsyncStorage, Storage
+
+# latency buckets in seconds, from cached reads to whole archives
+LATENCY_BUCKETS = (0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25,
+                   0.5, 1, 2.5, 5, 10, 30)
+# response size buckets in bytes
+SIZE_BUCKETS = (100, 1000, 10000, 100000, 1000000, 10000000)
+
+CONTENT_TYPE = prometheus_client.CONTENT_TYPE_LATEST
+
+
+class Metrics(object):
+    """
+    The metrics of one API instance, kept in their own registry
+
+    When PROMETHEUS_MULTIPROC_DIR is set, as it is for the workers of
+    api.gunicorn_config, the request and storage metrics are recorded in files
+    in that directory and every worker renders those of all of them. Metrics
+    exported by collectors are still those of the rendering process.
+    """
+
+    def __init__(self):
+        """
+        Initialize
+        """
+        self.registry = prometheus_client.CollectorRegistry()
+        self._collectors = []
+        self.request_seconds = prometheus_client.Histogram(
+            "trackit_request_seconds",
+            "Time to handle a request, excluding streamed bodies",
+            ["route", "method", "status"],
+            buckets=LATENCY_BUCKETS,
+            registry=self.registry)
+        self.requests_in_flight = prometheus_client.Gauge(
+            "trackit_requests_in_flight",
+            "Requests being handled", ["route"],
+            registry=self.registry,
+            multiprocess_mode="livesum")
+        self.response_bytes = prometheus_client.Histogram(
+            "trackit_response_bytes",
+            "Size of encoded response bodies", ["route"],
+            buckets=SIZE_BUCKETS,
+            registry=self.registry)
+        self.encode_seconds = prometheus_client.Histogram(
+            "trackit_encode_seconds",
+            "Time to encode a response body", ["codec"],
+            buckets=LATENCY_BUCKETS,
+            registry=self.registry)
+        self.storage_seconds = prometheus_client.Histogram(
+            "trackit_storage_seconds",
+            "Time spent in storage operations, including reading their rows",
+            ["operation", "table"],
+            buckets=LATENCY_BUCKETS,
+            registry=self.registry)
+        self.storage_rows = prometheus_client.Counter(
+            "trackit_storage_rows",
+            "Rows returned or written by storage operations",
+            ["operation", "table"],
+            registry=self.registry)
+        self.query_seconds = prometheus_client.Histogram(
+            "trackit_db_query_seconds",
+            "Time to run a RethinkDB query until its first batch of results",
+            buckets=LATENCY_BUCKETS,
+            registry=self.registry)
+
+    def observe_storage(self, operation, table, seconds, rows):
+        """
+        Record a storage operation on a table taking seconds and returning or
+        writing a number of rows
+        """
+        self.storage_seconds.labels(operation, table).observe(seconds)
+        if rows:
+            self.storage_rows.labels(operation, table).inc(rows)
+
+    def track(self, collect):
+        """
+        Export metrics yielded by collect() whenever metrics are rendered
+        """
+        collector = _Collector(collect)
+        self._collectors.append(collector)
+        self.registry.register(collector)
+
+    def render(self):
+        """
+        Return all metrics in the Prometheus text format
+        """
+        if "PROMETHEUS_MULTIPROC_DIR" not in os.environ:
+            return prometheus_client.generate_latest(self.registry)
+        registry = prometheus_client.CollectorRegistry()
+        multiprocess.MultiProcessCollector(registry)
+        for collector in self._collectors:
+            registry.register(collector)
+        return prometheus_client.generate_latest(registry)
+
+
+class _Collector(object):
+    """
+    A collector exporting metric families computed at collection time
+    """
+
+    def __init__(self, collect):
+        """
+        Initialize
+        """
+        self.collect = collect
+
+
+def pool_metrics(pool):
+    """
+    Return a collect function exporting the stats of a connection pool
+    """
+
+    def collect():
+        """
+        Yield the gauges and counters of the pool
+        """
+        stats = pool.stats()
+        gauge = GaugeMetricFamily(
+            "trackit_db_pool_connections",
+            "Connections of the db pool by state",
+            labels=["state"])
+        for state in ("size", "open", "idle", "in_use"):
+            gauge.add_metric([state], stats.get(state, 0))
+        yield gauge
+        counter = CounterMetricFamily(
+            "trackit_db_pool_events",
+            "Events of the db pool",
+            labels=["event"])
+        for event, count in stats.items():
+            if event not in ("size", "open", "idle", "in_use"):
+                counter.add_metric([event], count)
+        yield counter
+
+    return collect
+
+
+def cache_metrics(caches):
+    """
+    Return a collect function exporting the hits and misses of named caches
+    """
+
+    def collect():
+        """
+        Yield the lookup counters of the caches
+        """
+        counter = CounterMetricFamily(
+            "trackit_cache_lookups",
+            "Cache lookups by result",
+            labels=["cache", "result"])
+        for name, cache in caches.items():
+            counter.add_metric([name, "hit"], cache.hits)
+            counter.add_metric([name, "miss"], cache.misses)
+        yield counter
+
+    return collect
+
+
+class MeteredStorage(Storage):
+    """
+    Storage recording the latency and row counts of another storage's
+    operations
+    """
+
+    def __init__(self, storage, metrics):
+        """
+        Initialize
+        """
+        self.storage = storage
+        self.metrics = metrics
+
+    def _metered_rows(self, operation, table, rows, seconds):
+        """
+        Iterate over rows recording the time spent reading them once they
+        are exhausted
+        """
+        count = 0
+        rows = iter(rows)
+        while True:
+            started = time.perf_counter()
+            try:
+                row = next(rows)
+            except StopIteration:
+                self.metrics.observe_storage(
+                    operation, table, seconds + time.perf_counter() - started,
+                    count)
+                return
+            seconds += time.perf_counter() - started
+            count += 1
+            yield row
+
+    def get(self, table, key):
+        started = time.perf_counter()
+        row = self.storage.get(table, key)
+        self.metrics.observe_storage("get", table,
+                                     time.perf_counter() - started,
+                                     int(row is not None))
+        return row
+
+    def get_all(self, table, index, *values, stream=False):
+        started = time.perf_counter()
+        rows = self.storage.get_all(table, index, *values, stream=stream)
+        return self._metered_rows("get_all", table, rows,
+                                  time.perf_counter() - started)
+
+    def scan(self, table, ordered=False, stream=False):
+        started = time.perf_counter()
+        rows = self.storage.scan(table, ordered=ordered, stream=stream)
+        return self._metered_rows("scan", table, rows,
+                                  time.perf_counter() - started)
+
+    def scan_schema(self,
+                    username,
+                    schema,
+                    start=None,
+                    end=None,
+                    after=None,
+                    limit=None):
+        started = time.perf_counter()
+        rows = self.storage.scan_schema(
+            username, schema, start=start, end=end, after=after, limit=limit)
+        self.metrics.observe_storage("scan_schema", "data",
+                                     time.perf_counter() - started, len(rows))
+        return rows
+
+    def aggregate(self,
+                  username,
+                  schema,
+                  aggregate,
+                  field=None,
+                  grouping=None,
+                  start=None,
+                  end=None):
+        started = time.perf_counter()
+        groups = self.storage.aggregate(
+            username,
+            schema,
+            aggregate,
+            field=field,
+            grouping=grouping,
+            start=start,
+            end=end)
+        self.metrics.observe_storage("aggregate", "data",
+                                     time.perf_counter() - started,
+                                     len(groups))
+        return groups
+
+    def scan_modified(self, table, since, stream=False):
+        started = time.perf_counter()
+        rows = self.storage.scan_modified(table, since, stream=stream)
+        return self._metered_rows("scan_modified", table, rows,
+                                  time.perf_counter() - started)
+
+    def upsert(self, table, rows, durability="hard"):
+        started = time.perf_counter()
+        written = self.storage.upsert(table, rows, durability)
+        self.metrics.observe_storage("upsert", table,
+                                     time.perf_counter() - started,
+                                     len(rows) - written["errors"])
+        return written
+
+    def update_all(self, table, fields):
+        started = time.perf_counter()
+        self.storage.update_all(table, fields)
+        self.metrics.observe_storage("update_all", table,
+                                     time.perf_counter() - started, 0)
+
+    def delete_batch(self, table, index, value, limit):
+        started = time.perf_counter()
+        keys = self.storage.delete_batch(table, index, value, limit)
+        self.metrics.observe_storage("delete_batch", table,
+                                     time.perf_counter() - started, len(keys))
+        return keys
+
+    def delete_all(self, table):
+        started = time.perf_counter()
+        self.storage.delete_all(table)
+        self.metrics.observe_storage("delete_all", table,
+                                     time.perf_counter() - started, 0)
+
+    def ready(self):
+        return self.storage.ready()
+
+
+class AsyncMeteredStorage(AsyncStorage):
+    """
+    AsyncStorage recording the latency and row counts of another async
+    storage's operations
+    """
+
+    def __init__(self, storage, metrics):
+        """
+        Initialize
+        """
+        self.storage = storage
+        self.metrics = metrics
+
+    def _metered(self, operation, table, rows, started):
+        """
+        Return rows read by an operation started at a time, recording it once
+        they are all read
+        """
+        seconds = time.perf_counter() - started
+        if isinstance(rows, list):
+            self.metrics.observe_storage(operation, table, seconds, len(rows))
+            return rows
+        return self._metered_stream(operation, table, rows, seconds)
+
+    async def _metered_stream(self, operation, table, rows, seconds):
+        """
+        Asynchronously iterate over streamed rows recording the time spent
+        reading them once they are exhausted
+        """
+        count = 0
+        rows = rows.__aiter__()
+        while True:
+            started = time.perf_counter()
+            try:
+                row = await rows.__anext__()
+            except StopAsyncIteration:
+                self.metrics.observe_storage(
+                    operation, table, seconds + time.perf_counter() - started,
+                    count)
+                return
+            seconds += time.perf_counter() - started
+            count += 1
+            yield row
+
+    async def get(self, table, key):
+        started = time.perf_counter()
+        row = await self.storage.get(table, key)
+        self.metrics.observe_storage("get", table,
+                                     time.perf_counter() - started,
+                                     int(row is not None))
+        return row
+
+    async def get_all(self, table, index, *values, stream=False):
+        started = time.perf_counter()
+        rows = await self.storage.get_all(table, index, *values, stream=stream)
+        return self._metered("get_all", table, rows, started)
+
+    async def scan(self, table, ordered=False, stream=False):
+        started = time.perf_counter()
+        rows = await self.storage.scan(table, ordered=ordered, stream=stream)
+        return self._metered("scan", table, rows, started)
+
+    async def scan_schema(self,
+                          username,
+                          schema,
+                          start=None,
+                          end=None,
+                          after=None,
+                          limit=None):
+        started = time.perf_counter()
+        rows = await self.storage.scan_schema(
+            username, schema, start=start, end=end, after=after, limit=limit)
+        return self._metered("scan_schema", "data", rows, started)
+
+    async def aggregate(self,
+                        username,
+                        schema,
+                        aggregate,
+                        field=None,
+                        grouping=None,
+                        start=None,
+                        end=None):
+        started = time.perf_counter()
+        groups = await self.storage.aggregate(
+            username,
+            schema,
+            aggregate,
+            field=field,
+            grouping=grouping,
+            start=start,
+            end=end)
+        self.metrics.observe_storage("aggregate", "data",
+                                     time.perf_counter() - started,
+                                     len(groups))
+        return groups
+
+    async def scan_modified(self, table, since, stream=False):
+        started = time.perf_counter()
+        rows = await self.storage.scan_modified(table, since, stream=stream)
+        return self._metered("scan_modified", table, rows, started)
+
+    async def upsert(self, table, rows, durability="hard"):
+        started = time.perf_counter()
+        written = await self.storage.upsert(table, rows, durability)
+        self.metrics.observe_storage("upsert", table,
+                                     time.perf_counter() - started,
+                                     len(rows) - written["errors"])
+        return written
+
+    async def update_all(self, table, fields):
+        started = time.perf_counter()
+        await self.storage.update_all(table, fields)
+        self.metrics.observe_storage("update_all", table,
+                                     time.perf_counter() - started, 0)
+
+    async def delete_batch(self, table, index, value, limit):
+        started = time.perf_counter()
+        keys = await self.storage.delete_batch(table, index, value, limit)
+        self.metrics.observe_storage("delete_batch", table,
+                                     time.perf_counter() - started, len(keys))
+        return keys
+
+    async def delete_all(self, table):
+        started = time.perf_counter()
+        await self.storage.delete_all(table)
+        self.metrics.observe_storage("delete_all", table,
+                                     time.perf_counter() - started, 0)
+
+    async def ready(self):
+        return await self.storage.ready()
+
+
+def admission_metrics(admission):
+    """
+    Return a collect function exporting the requests in flight, waiting and
+    rejected by an admission control and its limits
+    """
+
+    def collect():
+        """
+        Yield the gauges and counters of the admission control
+        """
+        stats = admission.stats()
+        in_flight = GaugeMetricFamily(
+            "trackit_admission_in_flight",
+            "Admitted requests in flight by budget",
+            labels=["budget"])
+        limit = GaugeMetricFamily(
+            "trackit_admission_limit",
+            "Limits on requests in flight by budget and scope, 0 if none",
+            labels=["budget", "scope"])
+        for kind, (total, per_namespace) in sorted(stats["limits"].items()):
+            in_flight.add_metric([kind], stats["in_flight"][kind])
+            limit.add_metric([kind, "global"], total)
+            limit.add_metric([kind, "namespace"], per_namespace)
+        yield in_flight
+        yield limit
+        yield GaugeMetricFamily(
+            "trackit_admission_waiting",
+            "Requests waiting for a slot",
+            value=stats["waiting"])
+        yield GaugeMetricFamily(
+            "trackit_admission_namespaces",
+            "Namespaces with requests in flight",
+            value=stats["namespaces"])
+        counter = CounterMetricFamily(
+            "trackit_admission_events",
+            "Requests admitted, queued and rejected by the scope of the full "
+            "budget",
+            labels=["event"])
+        for event, count in sorted(stats["counters"].items()):
+            counter.add_metric([event], count)
+        yield counter
+
+    return collect
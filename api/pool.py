@@ -0,0 +1,190 @@
+"""
+Thread-safe database connection pool for the trackit API
+"""
+
+import collections
+import contextlib
+import logging
+import threading
+import time
+
+LOGGER = logging.getLogger(__name__)
+
+# seconds to sleep between successive connection attempts
+BACKOFF_SCHEDULE = (1, 2, 4, 10)
+
+
+class PoolTimeout(Exception):
+    """
+    Raised when no connection becomes available in time
+    """
+    pass
+
+
+def retry(func, schedule=BACKOFF_SCHEDULE, sleep=time.sleep):
+    """
+    Call func until it succeeds sleeping for each interval of the schedule
+    between attempts
+    """
+    for sleepsecs in schedule:
+        try:
+            return func()
+        except Exception:  # pylint: disable=broad-except
+            LOGGER.exception("Could not connect to db")
+            sleep(sleepsecs)
+    raise Exception("Retry cap reached for connecting to db")
+
+
+def _close(conn):
+    """
+    Close a connection ignoring errors from connections that are already dead
+    """
+    try:
+        conn.close()
+    except Exception:  # pylint: disable=broad-except
+        pass
+
+
+class ConnectionPool(object):
+    """
+    A bounded pool of database connections shared between request threads
+
+    Connections are opened lazily up to size. Idle connections that haven't
+    been used for check_interval seconds, or that were in use when a request
+    failed, are checked for liveness before reuse and replaced if dead.
+    """
+
+    def __init__(self,
+                 connect,
+                 is_alive,
+                 size=8,
+                 timeout=10,
+                 check_interval=30,
+                 schedule=BACKOFF_SCHEDULE,
+                 sleep=time.sleep,
+                 clock=time.monotonic):
+        """
+        Initialize
+        """
+        self.connect = connect
+        self.is_alive = is_alive
+        self.size = size
+        self.timeout = timeout
+        self.check_interval = check_interval
+        self.schedule = schedule
+        self.sleep = sleep
+        self.clock = clock
+        self._idle = collections.deque()
+        self._open = 0
+        self._cond = threading.Condition()
+        self.counters = collections.Counter()
+
+    def checkout(self):
+        """
+        Return a live connection blocking until one is available
+        """
+        deadline = self.clock() + self.timeout
+        with self._cond:
+            self.counters["checkouts"] += 1
+            while not self._idle and self._open >= self.size:
+                remaining = deadline - self.clock()
+                if remaining <= 0:
+                    self.counters["timeouts"] += 1
+                    raise PoolTimeout("no db connection available")
+                self.counters["waits"] += 1
+                self._cond.wait(remaining)
+            if self._idle:
+                conn, last_used = self._idle.pop()
+            else:
+                conn, last_used = None, None
+                self._open += 1
+        if conn is not None:
+            if (self.clock() - last_used < self.check_interval or
+                    self._alive(conn)):
+                return conn
+            self._count("reconnects")
+            _close(conn)
+        try:
+            return self._connect()
+        except Exception:
+            with self._cond:
+                self._open -= 1
+                self._cond.notify()
+            raise
+
+    def checkin(self, conn, suspect=False):
+        """
+        Return a connection to the pool
+
+        A suspect connection (e.g. one in use when a query failed) is checked
+        for liveness and closed if it is dead.
+        """
+        if suspect and not self._alive(conn):
+            self._discard(conn)
+            return
+        with self._cond:
+            self._idle.append((conn, self.clock()))
+            self._cond.notify()
+
+    @contextlib.contextmanager
+    def connection(self):
+        """
+        Context manager checking out a connection for the enclosed block
+        """
+        conn = self.checkout()
+        try:
+            yield conn
+        except Exception:
+            self.checkin(conn, suspect=True)
+            raise
+        self.checkin(conn)
+
+    def stats(self):
+        """
+        Return metrics describing the pool
+        """
+        with self._cond:
+            stats = {
+                "size": self.size,
+                "open": self._open,
+                "idle": len(self._idle),
+                "in_use": self._open - len(self._idle),
+            }
+            stats.update(self.counters)
+        return stats
+
+    def _alive(self, conn):
+        """
+        Return true iff a connection passes its liveness check
+        """
+        try:
+            alive = self.is_alive(conn)
+        except Exception:  # pylint: disable=broad-except
+            alive = False
+        if not alive:
+            self._count("failed_checks")
+        return alive
+
+    def _connect(self):
+        """
+        Open a new connection retrying with backoff
+        """
+        conn = retry(self.connect, self.schedule, self.sleep)
+        self._count("connects")
+        return conn
+
+    def _count(self, name):
+        """
+        Increment a named counter
+        """
+        with self._cond:
+            self.counters[name] += 1
+
+    def _discard(self, conn):
+        """
+        Close a dead connection and free its slot
+        """
+        _close(conn)
+        with self._cond:
+            self._open -= 1
+            self._cond.notify()
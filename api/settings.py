@@ -0,0 +1,89 @@
+"""
+Settings for the trackit API read from the environment
+"""
+
+import os
+
+DB_HOST = os.environ.get("DB_HOST", 'db')
+DB_PORT = int(os.environ.get("DB_PORT", 28015))
+DB_NAME = os.environ.get("DB_NAME", "trackit")
+RESTORE_BATCH_SIZE = int(os.environ.get("RESTORE_BATCH_SIZE", 1000))
+VALIDATOR_CACHE_SIZE = int(os.environ.get("VALIDATOR_CACHE_SIZE", 1024))
+VALIDATOR_CACHE_TTL = float(os.environ.get("VALIDATOR_CACHE_TTL", 60))
+DB_POOL_SIZE = int(os.environ.get("DB_POOL_SIZE", 8))
+# threads serving requests in each worker, one per pooled db connection
+THREADS = DB_POOL_SIZE
+DB_POOL_TIMEOUT = float(os.environ.get("DB_POOL_TIMEOUT", 10))
+DB_POOL_CHECK_INTERVAL = float(os.environ.get("DB_POOL_CHECK_INTERVAL", 30))
+PORT = int(os.environ.get("PORT", 5000))
+# worker processes gunicorn forks to serve the API, or 0 for one per core
+WEB_CONCURRENCY = int(os.environ.get("WEB_CONCURRENCY", 0))
+# entries of each process's cache of data and the seconds they're kept. A
+# cached datum isn't invalidated by writes through other processes, which
+# checking would cost as much as the read it saves, so api.gunicorn_config
+# turns the cache off by default when it forks several workers
+DATUM_CACHE_SIZE = int(os.environ.get("DATUM_CACHE_SIZE", 1024))
+DATUM_CACHE_TTL = float(os.environ.get("DATUM_CACHE_TTL", 60))
+# whether servers bring the db schema up to date when they start, which can
+# be left to a separate `python -m api.db` step instead
+MIGRATE = os.environ.get("MIGRATE", "1") not in ("", "0")
+# seconds by which delta archive watermarks trail the clock to cover writes
+# in flight and clock skew between API processes
+DELTA_OVERLAP = float(os.environ.get("DELTA_OVERLAP", 60))
+# rows deleted per batch when purging a namespace or schema and seconds to
+# wait between batches
+PURGE_BATCH_SIZE = int(os.environ.get("PURGE_BATCH_SIZE", 500))
+PURGE_INTERVAL = float(os.environ.get("PURGE_INTERVAL", 0.05))
+# default durability of writes, hard or soft
+WRITE_DURABILITY = os.environ.get("WRITE_DURABILITY", "hard")
+# rows per batch of coalesced datum writes, or 0 to write each on its own,
+# and seconds to wait for a batch to fill
+WRITE_BATCH_SIZE = int(os.environ.get("WRITE_BATCH_SIZE", 0))
+WRITE_BATCH_DELAY = float(os.environ.get("WRITE_BATCH_DELAY", 0.005))
+# requests in flight per worker, in all and per namespace, for normal and
+# for expensive routes, where 0 is no limit, seconds a request waits for a
+# slot before it's rejected and seconds after which rejected ones may retry.
+# A worker never has more requests in flight than threads, so by default its
+# threads are split between the two classes and a namespace may take half of
+# each, so that every budget fills before the threads run out
+MAX_EXPENSIVE_REQUESTS = int(
+    os.environ.get("MAX_EXPENSIVE_REQUESTS", max(1, THREADS // 4)))
+MAX_REQUESTS = int(
+    os.environ.get("MAX_REQUESTS", max(1,
+                                       THREADS - MAX_EXPENSIVE_REQUESTS)))
+NAMESPACE_REQUESTS = int(
+    os.environ.get("NAMESPACE_REQUESTS", max(1, MAX_REQUESTS // 2)))
+NAMESPACE_EXPENSIVE_REQUESTS = int(
+    os.environ.get("NAMESPACE_EXPENSIVE_REQUESTS",
+                   max(1, MAX_EXPENSIVE_REQUESTS // 2)))
+ADMISSION_TIMEOUT = float(os.environ.get("ADMISSION_TIMEOUT", 0.5))
+RETRY_AFTER = int(os.environ.get("RETRY_AFTER", 1))
+SCHEMATA_VIEW = os.environ.get("SCHEMATA_VIEW", "") not in ("", "0")
+# path of an embedded SQLite database, or ":memory:", to use instead of
+# RethinkDB
+SQLITE_PATH = os.environ.get("SQLITE_PATH", "")
+
+
+def api_options():
+    """
+    Return the keyword arguments configuring an API from the environment
+    """
+    return {
+        "datum_cache_size": DATUM_CACHE_SIZE,
+        "datum_cache_ttl": DATUM_CACHE_TTL,
+        "delta_overlap": DELTA_OVERLAP,
+        "durability": WRITE_DURABILITY,
+        "write_batch_size": WRITE_BATCH_SIZE,
+        "write_batch_delay": WRITE_BATCH_DELAY,
+        "purge_batch_size": PURGE_BATCH_SIZE,
+        "purge_interval": PURGE_INTERVAL,
+        "max_requests": MAX_REQUESTS,
+        "namespace_requests": NAMESPACE_REQUESTS,
+        "max_expensive_requests": MAX_EXPENSIVE_REQUESTS,
+        "namespace_expensive_requests": NAMESPACE_EXPENSIVE_REQUESTS,
+        "admission_timeout": ADMISSION_TIMEOUT,
+        "retry_after": RETRY_AFTER,
+        "restore_batch_size": RESTORE_BATCH_SIZE,
+        "validator_cache_size": VALIDATOR_CACHE_SIZE,
+        "validator_cache_ttl": VALIDATOR_CACHE_TTL,
+    }
@@ -0,0 +1,882 @@
+"""
+Storage backends for the trackit API
+
+The API keeps its rows in five tables:
+
+* schemata, keyed by name ("namespace/schema") and indexed by username
+* data, keyed by key ("namespace/schema/datum key") and indexed by username
+  and by username and schema
+* versions, keyed by name (a namespace or "namespace/schema")
+* tombstones, keyed by name ("*" for a purge), recording deletions
+* jobs, keyed by id, recording the progress of background jobs
+
+and reaches them only through the operations of Storage, which are
+implemented on RethinkDB and on an embedded SQLite database. The asyncio
+server runs the same operations as coroutines through AsyncStorage, which is
+implemented on RethinkDB.
+
+Rows of schemata and data carry the time they were last written in their
+modified field, by which they are also indexed.
+"""
+
+import sqlite3
+import threading
+
+from api import encoding
+
+PRIMARY_KEYS = {
+    "schemata": "name",
+    "data": "key",
+    "versions": "name",
+    "tombstones": "name",
+    "jobs": "id",
+}
+
+# secondary indexes of each table as the row fields they index, created by
+# api.db on RethinkDB and by SQLiteStorage on SQLite
+INDEXES = {
+    "schemata": {
+        "username": ("username", ),
+        "modified": ("modified", ),
+    },
+    "data": {
+        "username": ("username", ),
+        "username_schema": ("username", "schema"),
+        "username_schema_key": ("username", "schema", "key"),
+        "modified": ("modified", ),
+    },
+    "versions": {},
+    "tombstones": {},
+    "jobs": {},
+}
+
+# tables whose rows are indexed by their modified time
+MODIFIED_TABLES = tuple(
+    table for table, indexes in INDEXES.items() if "modified" in indexes)
+
+# durabilities of writes, which are acknowledged once they're flushed to disk
+# if hard and once they're in memory if soft
+DURABILITIES = ("hard", "soft")
+# SQLite synchronous settings implementing each durability
+SQLITE_SYNCHRONOUS = {"hard": "FULL", "soft": "NORMAL"}
+
+# number of rows read per batch when streaming
+STREAM_BATCH_SIZE = 500
+
+# aggregations of a datum field over a schema's data
+AGGREGATES = ("count", "sum", "min", "max", "ratio")
+# groupings of data by a period of their ISO-date keys, e.g. 2017-01-31
+GROUPINGS = ("day", "week", "month", "year")
+# length of the key prefix identifying the period of each grouping, except
+# weeks which are identified by the date of their Monday
+PERIOD_LENGTHS = {"day": 10, "week": 10, "month": 7, "year": 4}
+
+
+# pattern of keys starting with an ISO date for SQLite's GLOB operator
+ISO_DATE_GLOB = "[0-9][0-9][0-9][0-9]-[0-9][0-9]-[0-9][0-9]*"
+
+
+class Storage(object):
+    """
+    Interface to the tables of the trackit API
+    """
+
+    def get(self, table, key):
+        """
+        Return the row of a table with a primary key or None
+        """
+        raise NotImplementedError()
+
+    def get_all(self, table, index, *values, stream=False):
+        """
+        Iterate over the rows of a table whose secondary index value is one of
+        the given values
+
+        Values of compound indexes are lists of field values. With stream the
+        rows are read in bounded batches as they are iterated.
+        """
+        raise NotImplementedError()
+
+    def scan(self, table, ordered=False, stream=False):
+        """
+        Iterate over all rows of a table, ordered by primary key if ordered
+        """
+        raise NotImplementedError()
+
+    def scan_schema(self,
+                    username,
+                    schema,
+                    start=None,
+                    end=None,
+                    after=None,
+                    limit=None):
+        """
+        Return up to limit data rows of a schema ordered by key
+
+        Rows are restricted to datum keys in [start, end), or in (after, end)
+        when resuming after a previous page.
+        """
+        raise NotImplementedError()
+
+    def aggregate(self,
+                  username,
+                  schema,
+                  aggregate,
+                  field=None,
+                  grouping=None,
+                  start=None,
+                  end=None):
+        """
+        Aggregate a field of the data of a schema with keys in [start, end)
+
+        aggregate is one of AGGREGATES, where count counts data (having the
+        field if one is given) and ratio is the fraction of data whose bool
+        field is true. Data lacking the field are skipped. Returns a dict
+        mapping each period of a grouping to its aggregate value, or None to
+        the value over all data if there is no grouping. Only data with
+        ISO-date keys are grouped. Aggregates other than count and sum of no
+        data are None.
+        """
+        raise NotImplementedError()
+
+    def scan_modified(self, table, since, stream=False):
+        """
+        Iterate over the rows of one of MODIFIED_TABLES last written at or
+        after the time since
+        """
+        raise NotImplementedError()
+
+    def upsert(self, table, rows, durability="hard"):
+        """
+        Insert rows into a table replacing rows with the same primary key
+        with one of DURABILITIES
+
+        Returns a dict with the number of rows that failed to be written as
+        "errors" and, if any did, a description of one failure as
+        "first_error".
+        """
+        raise NotImplementedError()
+
+    def update_all(self, table, fields):
+        """
+        Set fields on every row of a table
+        """
+        raise NotImplementedError()
+
+    def delete_batch(self, table, index, value, limit):
+        """
+        Delete up to limit rows of a table whose value of a secondary index,
+        or of the primary key, is value and return their primary keys
+        """
+        raise NotImplementedError()
+
+    def delete_all(self, table):
+        """
+        Delete every row of a table
+        """
+        raise NotImplementedError()
+
+    def ready(self):
+        """
+        Return true iff all tables exist and can be queried
+        """
+        raise NotImplementedError()
+
+
+class AsyncStorage(object):
+    """
+    Interface to the tables of the trackit API whose operations are
+    coroutines, for servers running on an event loop
+
+    Each operation does what the operation of Storage of the same name does,
+    except that rows are returned as lists or, when streamed, as asynchronous
+    iterators reading them in bounded batches.
+    """
+
+    async def get(self, table, key):
+        """
+        Return the row of a table with a primary key or None
+        """
+        raise NotImplementedError()
+
+    async def get_all(self, table, index, *values, stream=False):
+        """
+        Return the rows of a table whose secondary index value is one of the
+        given values
+        """
+        raise NotImplementedError()
+
+    async def scan(self, table, ordered=False, stream=False):
+        """
+        Return all rows of a table, ordered by primary key if ordered
+        """
+        raise NotImplementedError()
+
+    async def scan_schema(self,
+                          username,
+                          schema,
+                          start=None,
+                          end=None,
+                          after=None,
+                          limit=None):
+        """
+        Return up to limit data rows of a schema ordered by key
+        """
+        raise NotImplementedError()
+
+    async def aggregate(self,
+                        username,
+                        schema,
+                        aggregate,
+                        field=None,
+                        grouping=None,
+                        start=None,
+                        end=None):
+        """
+        Aggregate a field of the data of a schema with keys in [start, end)
+        """
+        raise NotImplementedError()
+
+    async def scan_modified(self, table, since, stream=False):
+        """
+        Return the rows of one of MODIFIED_TABLES last written at or after
+        the time since
+        """
+        raise NotImplementedError()
+
+    async def upsert(self, table, rows, durability="hard"):
+        """
+        Insert rows into a table replacing rows with the same primary key
+        """
+        raise NotImplementedError()
+
+    async def update_all(self, table, fields):
+        """
+        Set fields on every row of a table
+        """
+        raise NotImplementedError()
+
+    async def delete_batch(self, table, index, value, limit):
+        """
+        Delete up to limit rows of a table whose value of a secondary index,
+        or of the primary key, is value and return their primary keys
+        """
+        raise NotImplementedError()
+
+    async def delete_all(self, table):
+        """
+        Delete every row of a table
+        """
+        raise NotImplementedError()
+
+    async def ready(self):
+        """
+        Return true iff all tables exist and can be queried
+        """
+        raise NotImplementedError()
+
+
+def _stream_options(stream):
+    """
+    Return the run options for a RethinkDB query that is optionally streamed
+    """
+    return {"max_batch_rows": STREAM_BATCH_SIZE} if stream else {}
+
+
+class _RethinkDBQueries(object):
+    """
+    The ReQL queries implementing the storage operations on a RethinkDB
+    database, which RethinkDBStorage and AsyncRethinkDBStorage run
+    """
+
+    def __init__(self, db_connection, db_name):
+        """
+        Initialize
+        """
+        self.r = db_connection
+        self.db = self.r.db(db_name)
+
+    def get(self, table, key):
+        """
+        Return the query reading the row of a table with a primary key
+        """
+        return self.db.table(table).get(key)
+
+    def get_all(self, table, index, *values):
+        """
+        Return the query reading the rows of a table by a secondary index
+        """
+        return self.db.table(table).get_all(*values, index=index)
+
+    def scan(self, table, ordered):
+        """
+        Return the query reading all rows of a table
+        """
+        query = self.db.table(table)
+        if ordered:
+            query = query.order_by(index=PRIMARY_KEYS[table])
+        return query
+
+    def scan_schema(self, username, schema, start, end, after, limit):
+        """
+        Return the query reading a page of data rows of a schema
+        """
+        prefix = "{}/{}/".format(username, schema)
+        lower = prefix + start if start is not None else self.r.minval
+        left_bound = "closed"
+        if after is not None:
+            lower = prefix + after
+            left_bound = "open"
+        upper = prefix + end if end is not None else self.r.maxval
+        query = self.db.table("data").between(
+            [username, schema, lower], [username, schema, upper],
+            index="username_schema_key",
+            left_bound=left_bound).order_by(index="username_schema_key")
+        if limit is not None:
+            query = query.limit(limit)
+        return query
+
+    def aggregate(self, username, schema, aggregate, field, grouping, start,
+                  end):
+        """
+        Return the query computing an aggregation as described by
+        Storage.aggregate, which is grouped data or a single value without a
+        grouping
+        """
+        prefix = "{}/{}/".format(username, schema)
+        query = self.db.table("data").between(
+            [username, schema, prefix + start
+             if start is not None else self.r.minval],
+            [username, schema, prefix + end
+             if end is not None else self.r.maxval],
+            index="username_schema_key")
+        if field is not None:
+            query = query.filter(lambda row: row["datum"].has_fields(field))
+        if grouping is not None:
+            query = query.filter(lambda row: row["key"].slice(len(prefix)).
+                                 match(r"^\d{4}-\d{2}-\d{2}")).group(
+                                     lambda row: self._period(
+                                         row["key"].slice(len(prefix)),
+                                         grouping))
+        if aggregate == "count":
+            query = query.count()
+        elif aggregate == "ratio":
+            query = query.map(
+                lambda row: self.r.branch(row["datum"][field], 1, 0)).avg()
+        else:
+            query = getattr(query.map(lambda row: row["datum"][field]),
+                            aggregate)()
+        if grouping is None:
+            query = query.default(None)
+        return query
+
+    def _period(self, key, grouping):
+        """
+        Return the ReQL expression for the period of an ISO-date key
+        """
+        if grouping != "week":
+            return key.slice(0, PERIOD_LENGTHS[grouping])
+        date = self.r.iso8601(key.slice(0, 10).add("T00:00:00Z"))
+        return date.sub(date.day_of_week().sub(1).mul(
+            24 * 60 * 60)).to_iso8601().slice(0, 10)
+
+    def scan_modified(self, table, since):
+        """
+        Return the query reading the rows of a table written since a time
+        """
+        return self.db.table(table).between(
+            since, self.r.maxval, index="modified")
+
+    def upsert(self, table, rows, durability):
+        """
+        Return the query upserting rows into a table
+        """
+        return self.db.table(table).insert(
+            rows, conflict='update', durability=durability)
+
+    def update_all(self, table, fields):
+        """
+        Return the query setting fields on every row of a table
+        """
+        return self.db.table(table).update(fields)
+
+    def batch(self, table, index, value, limit):
+        """
+        Return the query reading the primary keys of up to limit rows of a
+        table whose value of an index is value
+        """
+        return self.db.table(table).get_all(
+            value, index=index).limit(limit).pluck(PRIMARY_KEYS[table])
+
+    def delete(self, table, keys):
+        """
+        Return the query deleting the rows of a table with primary keys
+        """
+        return self.db.table(table).get_all(*keys).delete()
+
+    def delete_all(self, table):
+        """
+        Return the query deleting every row of a table
+        """
+        return self.db.table(table).delete()
+
+    def table_list(self):
+        """
+        Return the query listing the tables of the database
+        """
+        return self.db.table_list()
+
+
+class RethinkDBStorage(Storage):
+    """
+    Storage in a RethinkDB database
+
+    Queries are run with run(query, **kwargs), by default on the repl
+    connection.
+    """
+
+    def __init__(self, db_connection, db_name, run=None):
+        """
+        Initialize
+        """
+        self.queries = _RethinkDBQueries(db_connection, db_name)
+        self.run = run or (lambda query, **kwargs: query.run(**kwargs))
+
+    def get(self, table, key):
+        return self.run(self.queries.get(table, key))
+
+    def get_all(self, table, index, *values, stream=False):
+        return self.run(
+            self.queries.get_all(table, index, *values),
+            **_stream_options(stream))
+
+    def scan(self, table, ordered=False, stream=False):
+        return self.run(
+            self.queries.scan(table, ordered), **_stream_options(stream))
+
+    def scan_schema(self,
+                    username,
+                    schema,
+                    start=None,
+                    end=None,
+                    after=None,
+                    limit=None):
+        return list(
+            self.run(
+                self.queries.scan_schema(username, schema, start, end, after,
+                                         limit)))
+
+    def aggregate(self,
+                  username,
+                  schema,
+                  aggregate,
+                  field=None,
+                  grouping=None,
+                  start=None,
+                  end=None):
+        result = self.run(
+            self.queries.aggregate(username, schema, aggregate, field,
+                                   grouping, start, end))
+        if grouping is None:
+            return {None: result}
+        return dict(result)
+
+    def scan_modified(self, table, since, stream=False):
+        return self.run(
+            self.queries.scan_modified(table, since),
+            **_stream_options(stream))
+
+    def upsert(self, table, rows, durability="hard"):
+        return self.run(self.queries.upsert(table, rows, durability))
+
+    def update_all(self, table, fields):
+        self.run(self.queries.update_all(table, fields))
+
+    def delete_batch(self, table, index, value, limit):
+        keys = [
+            row[PRIMARY_KEYS[table]]
+            for row in self.run(self.queries.batch(table, index, value, limit))
+        ]
+        if keys:
+            self.run(self.queries.delete(table, keys))
+        return keys
+
+    def delete_all(self, table):
+        self.run(self.queries.delete_all(table))
+
+    def ready(self):
+        return set(PRIMARY_KEYS) <= set(self.run(self.queries.table_list()))
+
+
+async def _iterate(result):
+    """
+    Asynchronously iterate over a query result which is either a list or an
+    asyncio cursor
+    """
+    if hasattr(result, "__aiter__"):
+        async for item in result:
+            yield item
+    else:
+        for item in result:
+            yield item
+
+
+class AsyncRethinkDBStorage(AsyncStorage):
+    """
+    AsyncStorage in a RethinkDB database, for the rethinkdb driver's asyncio
+    connections
+
+    Queries are run with the coroutine function run(query, **kwargs).
+    """
+
+    def __init__(self, db_connection, db_name, run):
+        """
+        Initialize
+        """
+        self.queries = _RethinkDBQueries(db_connection, db_name)
+        self.run = run
+
+    async def _rows(self, query, stream=False):
+        """
+        Run a query returning rows, reading them all unless streamed
+        """
+        result = await self.run(query, **_stream_options(stream))
+        if stream:
+            return _iterate(result)
+        return [row async for row in _iterate(result)]
+
+    async def get(self, table, key):
+        return await self.run(self.queries.get(table, key))
+
+    async def get_all(self, table, index, *values, stream=False):
+        return await self._rows(
+            self.queries.get_all(table, index, *values), stream)
+
+    async def scan(self, table, ordered=False, stream=False):
+        return await self._rows(self.queries.scan(table, ordered), stream)
+
+    async def scan_schema(self,
+                          username,
+                          schema,
+                          start=None,
+                          end=None,
+                          after=None,
+                          limit=None):
+        return await self._rows(
+            self.queries.scan_schema(username, schema, start, end, after,
+                                     limit))
+
+    async def aggregate(self,
+                        username,
+                        schema,
+                        aggregate,
+                        field=None,
+                        grouping=None,
+                        start=None,
+                        end=None):
+        result = await self.run(
+            self.queries.aggregate(username, schema, aggregate, field,
+                                   grouping, start, end))
+        if grouping is None:
+            return {None: result}
+        return dict(result)
+
+    async def scan_modified(self, table, since, stream=False):
+        return await self._rows(
+            self.queries.scan_modified(table, since), stream)
+
+    async def upsert(self, table, rows, durability="hard"):
+        return await self.run(self.queries.upsert(table, rows, durability))
+
+    async def update_all(self, table, fields):
+        await self.run(self.queries.update_all(table, fields))
+
+    async def delete_batch(self, table, index, value, limit):
+        keys = [
+            row[PRIMARY_KEYS[table]] for row in await self._rows(
+                self.queries.batch(table, index, value, limit))
+        ]
+        if keys:
+            await self.run(self.queries.delete(table, keys))
+        return keys
+
+    async def delete_all(self, table):
+        await self.run(self.queries.delete_all(table))
+
+    async def ready(self):
+        return set(PRIMARY_KEYS) <= set(await self.run(
+            self.queries.table_list()))
+
+
+class SQLiteStorage(Storage):
+    """
+    Storage in an embedded SQLite database, in memory by default
+
+    Each table stores rows as JSON blobs alongside columns for their primary
+    key, indexed fields and, in MODIFIED_TABLES, their modified time, which
+    is added to databases created before it was recorded. A single connection
+    is shared by all threads and serialized with a lock.
+    """
+
+    def __init__(self, path=":memory:"):
+        """
+        Initialize, creating the tables and indexes if they don't exist
+        """
+        self._conn = sqlite3.connect(path, check_same_thread=False)
+        self._lock = threading.Lock()
+        with self._lock, self._conn:
+            if path != ":memory:":
+                self._conn.execute("PRAGMA journal_mode=WAL")
+            for table, primary_key in PRIMARY_KEYS.items():
+                fields = _indexed_fields(table)
+                self._conn.execute(
+                    "CREATE TABLE IF NOT EXISTS {} ({} TEXT PRIMARY KEY, {}"
+                    "row BLOB NOT NULL) WITHOUT ROWID".format(
+                        table, primary_key, "".join(
+                            "{} TEXT NOT NULL, ".format(field)
+                            for field in fields)))
+                if table in MODIFIED_TABLES:
+                    self._add_modified_column(table)
+                for index, columns in INDEXES[table].items():
+                    if primary_key not in columns:
+                        columns += (primary_key, )
+                    self._conn.execute(
+                        "CREATE INDEX IF NOT EXISTS {0}_{1} ON {0} ({2})".
+                        format(table, index, ", ".join(columns)))
+
+    def _add_modified_column(self, table):
+        """
+        Add the modified column to a table if it lacks one, leaving existing
+        rows as modified at time 0
+        """
+        columns = [
+            column[1] for column in self._conn.execute(
+                "PRAGMA table_info({})".format(table))
+        ]
+        if "modified" not in columns:
+            self._conn.execute(
+                "ALTER TABLE {} ADD COLUMN modified REAL NOT NULL DEFAULT 0".
+                format(table))
+
+    def _query(self, sql, params=()):
+        """
+        Return the decoded rows selected by a query
+        """
+        with self._lock:
+            rows = self._conn.execute(sql, params).fetchall()
+        return [encoding.JSONCodec.loads(row) for row, in rows]
+
+    def _stream(self, table, where, params):
+        """
+        Iterate over the rows of a table matching a condition in batches
+        ordered by primary key
+        """
+        primary_key = PRIMARY_KEYS[table]
+        sql = "SELECT {0}, row FROM {1} WHERE {2} AND {0} > ? " \
+              "ORDER BY {0} LIMIT ?".format(primary_key, table, where)
+        last = ""
+        while True:
+            with self._lock:
+                batch = self._conn.execute(
+                    sql, tuple(params) + (last, STREAM_BATCH_SIZE)).fetchall()
+            for _, row in batch:
+                yield encoding.JSONCodec.loads(row)
+            if len(batch) < STREAM_BATCH_SIZE:
+                return
+            last = batch[-1][0]
+
+    def get(self, table, key):
+        rows = self._query(
+            "SELECT row FROM {} WHERE {} = ?".format(table,
+                                                     PRIMARY_KEYS[table]),
+            (key, ))
+        return rows[0] if rows else None
+
+    def get_all(self, table, index, *values, stream=False):
+        columns = INDEXES[table][index]
+        if not values:
+            return iter([])
+        if len(columns) == 1:
+            values = [[value] for value in values]
+        where = "({})".format(" OR ".join(
+            "({})".format(" AND ".join("{} = ?".format(column)
+                                       for column in columns))
+            for _ in values))
+        params = [field for value in values for field in value]
+        if stream:
+            return self._stream(table, where, params)
+        return iter(
+            self._query("SELECT row FROM {} WHERE {}".format(table, where),
+                        params))
+
+    def scan(self, table, ordered=False, stream=False):
+        if stream:
+            return self._stream(table, "1", ())
+        return iter(
+            self._query("SELECT row FROM {}{}".format(
+                table, " ORDER BY {}".format(PRIMARY_KEYS[table])
+                if ordered else "")))
+
+    def scan_schema(self,
+                    username,
+                    schema,
+                    start=None,
+                    end=None,
+                    after=None,
+                    limit=None):
+        prefix = "{}/{}/".format(username, schema)
+        sql = "SELECT row FROM data WHERE username = ? AND schema = ?"
+        params = [username, schema]
+        if after is not None:
+            sql += " AND key > ?"
+            params.append(prefix + after)
+        elif start is not None:
+            sql += " AND key >= ?"
+            params.append(prefix + start)
+        if end is not None:
+            sql += " AND key < ?"
+            params.append(prefix + end)
+        sql += " ORDER BY key"
+        if limit is not None:
+            sql += " LIMIT ?"
+            params.append(limit)
+        return self._query(sql, params)
+
+    def aggregate(self,
+                  username,
+                  schema,
+                  aggregate,
+                  field=None,
+                  grouping=None,
+                  start=None,
+                  end=None):
+        prefix = "{}/{}/".format(username, schema)
+        path = '$.datum."{}"'.format(
+            field.replace("\\", "\\\\").replace('"', '\\"')
+            if field is not None else "")
+        value = "json_extract(CAST(row AS TEXT), ?)"
+        reduction = {
+            "count": "COUNT(*)",
+            "sum": "COALESCE(SUM({}), 0)".format(value),
+            "min": "MIN({})".format(value),
+            "max": "MAX({})".format(value),
+            "ratio": "AVG({})".format(value),
+        }[aggregate]
+        params = [path] if aggregate != "count" else []
+        period = "NULL"
+        if grouping == "week":
+            period = "date(substr(key, ?, 10), '-6 days', 'weekday 1')"
+            params.insert(0, len(prefix) + 1)
+        elif grouping is not None:
+            period = "substr(key, ?, {})".format(PERIOD_LENGTHS[grouping])
+            params.insert(0, len(prefix) + 1)
+        sql = "SELECT {}, {} FROM data " \
+              "WHERE username = ? AND schema = ?".format(period, reduction)
+        params.extend([username, schema])
+        if start is not None:
+            sql += " AND key >= ?"
+            params.append(prefix + start)
+        if end is not None:
+            sql += " AND key < ?"
+            params.append(prefix + end)
+        if field is not None:
+            sql += " AND json_type(CAST(row AS TEXT), ?) IS NOT NULL"
+            params.append(path)
+        if grouping is not None:
+            sql += " AND substr(key, ?) GLOB ?"
+            params.extend([len(prefix) + 1, ISO_DATE_GLOB])
+            sql += " GROUP BY 1"
+        with self._lock:
+            return dict(self._conn.execute(sql, params).fetchall())
+
+    def scan_modified(self, table, since, stream=False):
+        if stream:
+            return self._stream(table, "modified >= ?", (since, ))
+        return iter(
+            self._query("SELECT row FROM {} WHERE modified >= ?".format(table),
+                        (since, )))
+
+    def upsert(self, table, rows, durability="hard"):
+        primary_key = PRIMARY_KEYS[table]
+        fields = _indexed_fields(table)
+        modified = ("modified", ) if table in MODIFIED_TABLES else ()
+        columns = (primary_key, ) + fields + modified + ("row", )
+        sql = "INSERT OR REPLACE INTO {} ({}) VALUES ({})".format(
+            table, ", ".join(columns), ", ".join("?" for _ in columns))
+        try:
+            values = [
+                tuple(row[column] for column in (primary_key, ) + fields) +
+                tuple(row.get(column, 0) for column in modified) +
+                (encoding.JSONCodec.dumps(row), ) for row in rows
+            ]
+            with self._lock:
+                self._synchronous(durability)
+                try:
+                    with self._conn:
+                        self._conn.executemany(sql, values)
+                finally:
+                    self._synchronous("hard")
+        except (KeyError, TypeError, ValueError, sqlite3.Error) as error:
+            return {"errors": len(rows), "first_error": str(error)}
+        return {"errors": 0}
+
+    def _synchronous(self, durability):
+        """
+        Make commits wait for their writes to be flushed to disk according to
+        a durability, which is hard for all but upserts
+        """
+        self._conn.execute("PRAGMA synchronous = {}".format(
+            SQLITE_SYNCHRONOUS[durability]))
+
+    def update_all(self, table, fields):
+        with self._lock, self._conn:
+            rows = self._conn.execute("SELECT {}, row FROM {}".format(
+                PRIMARY_KEYS[table], table)).fetchall()
+            self._conn.executemany(
+                "UPDATE {} SET row = ? WHERE {} = ?".format(
+                    table, PRIMARY_KEYS[table]),
+                [(encoding.JSONCodec.dumps(
+                    dict(encoding.JSONCodec.loads(row), **fields)), key)
+                 for key, row in rows])
+
+    def delete_batch(self, table, index, value, limit):
+        primary_key = PRIMARY_KEYS[table]
+        if index == primary_key:
+            columns, values = (primary_key, ), [value]
+        else:
+            columns = INDEXES[table][index]
+            values = [value] if len(columns) == 1 else value
+        where = " AND ".join("{} = ?".format(column) for column in columns)
+        with self._lock, self._conn:
+            keys = [
+                key for key, in self._conn.execute(
+                    "SELECT {} FROM {} WHERE {} LIMIT ?".format(
+                        primary_key, table, where), tuple(values) + (limit, ))
+            ]
+            self._conn.executemany(
+                "DELETE FROM {} WHERE {} = ?".format(table, primary_key),
+                [(key, ) for key in keys])
+        return keys
+
+    def delete_all(self, table):
+        with self._lock, self._conn:
+            self._conn.execute("DELETE FROM {}".format(table))
+
+    def ready(self):
+        # tables are created when the storage is
+        with self._lock:
+            self._conn.execute("SELECT 1")
+        return True
+
+
+def _indexed_fields(table):
+    """
+    Return the row fields of a table other than its primary key and modified
+    time that are stored in their own columns
+    """
+    fields = []
+    for columns in INDEXES[table].values():
+        fields.extend(
+            column for column in columns
+            if column not in fields + [PRIMARY_KEYS[table], "modified"])
+    return tuple(fields)
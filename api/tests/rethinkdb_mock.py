@@ -0,0 +1,210 @@
+"""
+An in-memory stand-in for the subset of the RethinkDB driver used by the API
+"""
+
+import operator
+
+import mock
+
+MOCK_PRIMARY_KEYS = {
+    "schemata": "name",
+    "data": "key",
+    "versions": "name",
+    "tombstones": "name",
+    "jobs": "id",
+}
+
+MOCK_MINVAL = object()
+MOCK_MAXVAL = object()
+
+MOCK_INDEXES = {
+    "username": lambda row: row["username"],
+    "username_schema": lambda row: [row["username"], row["schema"]],
+    "username_schema_key":
+    lambda row: [row["username"], row["schema"], row["key"]],
+    # rows lacking the field are left out of the index, like in RethinkDB
+    "modified": lambda row: row.get("modified", MOCK_MINVAL),
+}
+
+
+def _mock_sort_key(value):
+    """
+    Return a sort key for an index value which may hold r.minval/r.maxval
+    """
+    if isinstance(value, list):
+        return [_mock_sort_key(item) for item in value]
+    if value is MOCK_MINVAL:
+        return (0, )
+    if value is MOCK_MAXVAL:
+        return (2, )
+    return (1, value)
+
+
+class MockTable(object):
+    """
+    A mock rethinkdb table
+    """
+
+    def __init__(self, rows, primary_key, parent=None):
+        """
+        Initialize, as a selection of the rows of parent if one is given
+        """
+        self.rows = rows
+        self.primary_key = primary_key
+        self.parent = parent
+        self.inserts = []
+
+    def run(self, *args, **kwargs):
+        """
+        Return all rows of the table
+        """
+        return list(self.rows)
+
+    def _select(self, rows):
+        """
+        Return a selection of the table containing the given rows
+        """
+        return MockTable(list(rows), self.primary_key, self.parent or self)
+
+    def _index(self, index):
+        """
+        Return the function computing a given index for a row
+        """
+        if index == self.primary_key:
+            return operator.itemgetter(index)
+        return MOCK_INDEXES[index]
+
+    def insert(self, rows, conflict="error", durability="hard"):
+        """
+        Insert rows replacing those with the same primary key on conflict
+        """
+        assert conflict == "update"
+        for row in rows:
+            self.rows[:] = [
+                existing for existing in self.rows
+                if existing[self.primary_key] != row[self.primary_key]
+            ]
+            self.rows.append(row)
+        self.inserts.append(len(rows))
+        toret = mock.Mock()
+        toret.run.return_value = {"inserted": len(rows), "errors": 0}
+        return toret
+
+    def update(self, fields):
+        """
+        Update all rows with the given fields
+        """
+        for row in self.rows:
+            row.update(fields)
+        return mock.Mock()
+
+    def delete(self):
+        """
+        Delete all rows of the table or selection
+        """
+        deleted = {id(row) for row in self.rows}
+        if self.parent is not None:
+            self.parent.rows[:] = [
+                row for row in self.parent.rows if id(row) not in deleted
+            ]
+        del self.rows[:]
+        toret = mock.Mock()
+        toret.run.return_value = {"deleted": len(deleted)}
+        return toret
+
+    def get(self, key):
+        """
+        Return the row with a given primary key or None
+        """
+        toret = mock.Mock()
+        toret.run.return_value = next(
+            (row for row in self.rows if row[self.primary_key] == key), None)
+        return toret
+
+    def order_by(self, index):
+        """
+        Return the rows ordered by an index
+        """
+        key = self._index(index)
+        return self._select(
+            sorted(self.rows, key=lambda row: _mock_sort_key(key(row))))
+
+    def get_all(self, *keys, **kwargs):
+        """
+        Return the rows whose secondary index value is one of the given keys
+        """
+        index = self._index(kwargs.get("index", self.primary_key))
+        return self._select(row for row in self.rows
+                            if index(row) in list(keys))
+
+    def between(self, lower, upper, index, left_bound="closed"):
+        """
+        Return the rows whose index value lies between two bounds
+        """
+        key = self._index(index)
+        lower, upper = _mock_sort_key(lower), _mock_sort_key(upper)
+
+        def matches(row):
+            """
+            return true iff the row lies within the bounds
+            """
+            value = _mock_sort_key(key(row))
+            if left_bound == "open" and value == lower:
+                return False
+            return lower <= value < upper
+
+        return self._select(filter(matches, self.rows))
+
+    def limit(self, count):
+        """
+        Return the first rows of a selection
+        """
+        return self._select(self.rows[:count])
+
+    def pluck(self, *fields):
+        """
+        Return the rows of a selection with only the given fields
+        """
+        return self._select({field: row[field]
+                             for field in fields} for row in self.rows)
+
+
+class MockDB(object):
+    """
+    A mock rethink database
+    """
+
+    def __init__(self, data):
+        """
+        Initialize
+        """
+        self.data = data
+        self.tables = {}
+
+    def table(self, name):
+        """
+        Get the table of a given name
+        """
+        if name not in self.tables:
+            self.tables[name] = MockTable(
+                self.data.setdefault(name, []), MOCK_PRIMARY_KEYS[name])
+        return self.tables[name]
+
+    def table_list(self):
+        """
+        List the names of the tables
+        """
+        toret = mock.Mock()
+        toret.run.return_value = list(self.data)
+        return toret
+
+
+def mock_connection(db):
+    """
+    Return a mock of the rethinkdb module whose databases are all db
+    """
+    connection = mock.Mock()
+    connection.minval = MOCK_MINVAL
+    connection.maxval = MOCK_MAXVAL
+    connection.db.return_value = db
+    return connection
@@ -0,0 +1,94 @@
+"""
+Unit tests for admission control of concurrent requests
+"""
+
+import asyncio
+import threading
+import unittest
+
+from api.admission import (GLOBAL, NAMESPACE, Admission, AsyncAdmission,
+                           Rejected)
+
+# normal requests are limited to 3 in flight and 2 per namespace
+LIMITS = {"normal": (3, 2), "expensive": (0, 0)}
+
+
+class AdmissionTests(unittest.TestCase):
+    """
+    Test admitting requests handled on concurrent threads
+    """
+
+    def test_namespace_budget(self):
+        """
+        test a namespace can't take more than its share of the global budget
+        """
+        admission = Admission(LIMITS, timeout=0, retry_after=5)
+        admission.acquire("normal", "rabrams")
+        admission.acquire("normal", "rabrams")
+        with self.assertRaises(Rejected) as context:
+            admission.acquire("normal", "rabrams")
+        self.assertEqual(NAMESPACE, context.exception.scope)
+        self.assertEqual(5, context.exception.retry_after)
+        admission.acquire("normal", "someone")
+        with self.assertRaises(Rejected) as context:
+            admission.acquire("normal", "another")
+        self.assertEqual(GLOBAL, context.exception.scope)
+        admission.acquire("expensive", "another")
+        self.assertEqual({
+            "admitted": 4,
+            "queued": 2,
+            "rejected_namespace": 1,
+            "rejected_global": 1
+        }, admission.stats()["counters"])
+
+    def test_waits_for_release(self):
+        """
+        test a request waiting for a full budget is admitted once a slot
+        frees up before its deadline
+        """
+        admission = Admission(LIMITS, timeout=5)
+        admission.acquire("normal", "rabrams")
+        admission.acquire("normal", "rabrams")
+        admitted = threading.Event()
+
+        def acquire():
+            """
+            Wait for a slot
+            """
+            admission.acquire("normal", "rabrams")
+            admitted.set()
+
+        thread = threading.Thread(target=acquire)
+        thread.start()
+        self.assertFalse(admitted.wait(0.05))
+        self.assertEqual(1, admission.stats()["waiting"])
+        admission.release("normal", "rabrams")
+        self.assertTrue(admitted.wait(5))
+        thread.join(5)
+        self.assertEqual({
+            "normal": 2,
+            "expensive": 0
+        }, admission.stats()["in_flight"])
+
+
+class AsyncAdmissionTests(unittest.IsolatedAsyncioTestCase):
+    """
+    Test admitting requests handled by tasks of one event loop
+    """
+
+    async def test_waits_until_deadline(self):
+        """
+        test a request is admitted if a slot frees up in time and rejected
+        otherwise
+        """
+        admission = AsyncAdmission(LIMITS, timeout=0.05)
+        await admission.acquire("normal", "rabrams")
+        await admission.acquire("normal", "rabrams")
+        with self.assertRaises(Rejected):
+            await admission.acquire("normal", "rabrams")
+        waiter = asyncio.ensure_future(admission.acquire("normal", "rabrams"))
+        await asyncio.sleep(0)
+        await admission.release("normal", "rabrams")
+        await waiter
+        self.assertEqual(1, admission.stats()["namespaces"])
+        self.assertEqual(0, admission.stats()["waiting"])
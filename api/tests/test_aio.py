@@ -0,0 +1,312 @@
+"""
+Unit tests for the asyncio trackit API
+"""
+
+import asyncio
+import json
+import unittest
+from unittest import mock
+
+from aiohttp.test_utils import TestClient, TestServer
+
+import api.aio
+import api.handlers
+from api.storage import PRIMARY_KEYS
+from api.tests.rethinkdb_mock import MockDB, mock_connection
+
+
+class MockAsyncAPI(api.aio.AsyncAPI):
+    """
+    An AsyncAPI running queries against the synchronous mock db
+    """
+
+    async def _run(self, query, **kwargs):
+        """
+        Run a query against the mock db
+        """
+        return query.run(**kwargs)
+
+
+class AsyncAPITestCase(unittest.IsolatedAsyncioTestCase):
+    """
+    Abstract base class for asyncio API test cases
+    """
+    # keyword arguments of the API
+    api_options = {}
+
+    async def asyncSetUp(self):
+        """
+        Serve the API over an empty mock database with a daily schema
+        """
+        self.db = MockDB({
+            "schemata": [{
+                "username": "rabrams",
+                "name": "rabrams/daily",
+                "body": {
+                    "slept_in": {
+                        "type": "bool"
+                    }
+                },
+            }],
+            "data": [],
+        })
+        self.api = MockAsyncAPI(
+            mock_connection(self.db), "trackit", None, **self.api_options)
+        self.client = TestClient(TestServer(self.api.app))
+        await self.client.start_server()
+
+    async def asyncTearDown(self):
+        """
+        Stop serving the API
+        """
+        await self.client.close()
+
+    async def put_json(self, path, obj):
+        """
+        PUT an object as JSON and return the response
+        """
+        return await self.client.put(
+            path,
+            data=json.dumps(obj),
+            headers={"Content-type": "application/json"})
+
+
+class AsyncAPITests(AsyncAPITestCase):
+    """
+    Test the asyncio API serves the same routes as the flask API
+    """
+
+    async def test_put_and_get_datum(self):
+        """
+        test PUTting and GETting a datum
+        """
+        response = await self.put_json("/data/rabrams/daily/latest/",
+                                       {"slept_in": True})
+        self.assertEqual(200, response.status)
+        self.assertEqual("rabrams/daily",
+                         response.headers[api.handlers.INVALIDATE_HEADER])
+        response = await self.client.get("/data/rabrams/daily/latest/")
+        self.assertEqual({"slept_in": True}, await response.json())
+        response = await self.client.get("/data/rabrams/daily/")
+        self.assertEqual({"latest": {"slept_in": True}}, await response.json())
+
+    async def test_conditional_get_data(self):
+        """
+        test a 304 is returned for data the client already has
+        """
+        await self.put_json("/data/rabrams/daily/latest/", {"slept_in": True})
+        response = await self.client.get("/data/rabrams/daily/")
+        response = await self.client.get(
+            "/data/rabrams/daily/",
+            headers={"If-None-Match": response.headers["ETag"]})
+        self.assertEqual(304, response.status)
+
+    async def test_invalid_datum(self):
+        """
+        test PUTting a datum that doesn't match its schema is a 400
+        """
+        response = await self.put_json("/data/rabrams/daily/latest/",
+                                       {"slept_in": "yes"})
+        self.assertEqual(400, response.status)
+
+    async def test_get_schemata(self):
+        """
+        test GETting the schemata of a namespace
+        """
+        response = await self.client.get("/schemata/rabrams/")
+        self.assertEqual({
+            "daily": {
+                "slept_in": {
+                    "type": "bool"
+                }
+            }
+        }, await response.json())
+
+    async def test_get_many_namespaces(self):
+        """
+        test GETting the schemata of several namespaces at once
+        """
+        response = await self.client.get(
+            "/schemata/?namespace=rabrams&namespace=nobody")
+        self.assertEqual({
+            "rabrams": {
+                "daily": {
+                    "slept_in": {
+                        "type": "bool"
+                    }
+                }
+            },
+            "nobody": {}
+        }, await response.json())
+
+    async def test_invalid_aggregate(self):
+        """
+        test aggregations that don't fit the schema are rejected
+        """
+        response = await self.client.get(
+            "/aggregate/rabrams/daily/?aggregate=sum&field=slept_in")
+        self.assertEqual(400, response.status)
+        response = await self.client.get("/aggregate/rabrams/missing/")
+        self.assertEqual(404, response.status)
+
+    async def test_export(self):
+        """
+        test exporting a schema's data as CSV
+        """
+        await self.put_json("/data/rabrams/daily/latest/", {"slept_in": True})
+        response = await self.client.get("/export/rabrams/daily/")
+        self.assertEqual("text/csv", response.content_type)
+        self.assertEqual("key,slept_in\nlatest,true\n", await response.text())
+
+    async def test_delta_archive(self):
+        """
+        test a delta archive holds only what was written since a watermark
+        """
+        self.api.delta_overlap = 0
+        response = await self.client.get("/archive/?format=ndjson")
+        watermark = response.headers["X-Watermark"]
+        await self.put_json("/data/rabrams/daily/latest/", {"slept_in": True})
+        response = await self.client.get(
+            "/archive/", params={"since": watermark})
+        records = [
+            json.loads(line) for line in (await response.text()).splitlines()
+        ]
+        self.assertEqual([{
+            "type": "datum",
+            "namespace": "rabrams",
+            "schema": "daily",
+            "key": "latest",
+            "datum": {
+                "slept_in": True
+            },
+        }], records)
+        await self.client.post("/purge/")
+        response = await self.client.get(
+            "/archive/", params={"since": watermark})
+        self.assertEqual('{"type":"purge"}\n', await response.text())
+
+    async def test_purge_schema(self):
+        """
+        test purging a schema in the background
+        """
+        await self.put_json("/data/rabrams/daily/latest/", {"slept_in": True})
+        response = await self.client.post("/purge/rabrams/daily/")
+        self.assertEqual(202, response.status)
+        location = response.headers["Location"]
+        for _ in range(200):
+            response = await self.client.get(location)
+            job = await response.json()
+            if job["status"] != "running":
+                break
+            await asyncio.sleep(0.01)
+        self.assertEqual({"schemata": 1, "data": 1}, job["deleted"])
+        self.assertEqual("rabrams/daily",
+                         response.headers[api.handlers.INVALIDATE_HEADER])
+        response = await self.client.get("/schemata/rabrams/")
+        self.assertEqual({}, await response.json())
+
+    async def test_health(self):
+        """
+        test the API is live and ready once all tables exist
+        """
+        response = await self.client.get("/health/live/")
+        self.assertEqual(200, response.status)
+        response = await self.client.get("/health/ready/")
+        self.assertEqual(503, response.status)
+        self.db.data.update({table: [] for table in PRIMARY_KEYS})
+        response = await self.client.get("/health/ready/")
+        self.assertEqual({"ready": True}, await response.json())
+
+    async def test_admission(self):
+        """
+        test requests beyond their namespace's budget are rejected
+        """
+        self.api.admission.limits["normal"] = (0, 1)
+        self.api.admission.timeout = 0
+        await self.api.admission.acquire("normal", "rabrams")
+        response = await self.client.get("/data/rabrams/daily/")
+        self.assertEqual(429, response.status)
+        self.assertEqual("1", response.headers["Retry-After"])
+        response = await self.client.get("/schemata/someone/")
+        self.assertEqual(200, response.status)
+
+    async def test_metrics(self):
+        """
+        test request metrics are exported in text format
+        """
+        await self.client.get("/schemata/rabrams/")
+        response = await self.client.get("/metrics")
+        self.assertIn(
+            'trackit_request_seconds_count{method="GET",route="get_schemata",'
+            'status="200"} 1.0', await response.text())
+
+    async def test_storage_metrics(self):
+        """
+        test storage operations are metered like the flask API's
+        """
+        await self.client.get("/data/rabrams/daily/")
+        response = await self.client.get("/metrics")
+        self.assertIn(
+            'trackit_storage_seconds_count{operation="get_all",table="data"} '
+            '1.0', await response.text())
+
+    async def test_schemata_view(self):
+        """
+        test schemata are read from the view once it's ready
+        """
+        self.api.schemata_view = mock.Mock(ready=True)
+        self.api.schemata_view.namespace.return_value = {"from-view": {}}
+        response = await self.client.get("/schemata/rabrams/")
+        self.assertEqual({"from-view": {}}, await response.json())
+
+    async def test_ndjson_archive_round_trip(self):
+        """
+        test restoring and streaming a line-delimited archive
+        """
+        lines = [
+            json.dumps({
+                "type": "datum",
+                "namespace": "rabrams",
+                "schema": "daily",
+                "key": "2017-01-0{}".format(day),
+                "datum": {
+                    "slept_in": True
+                },
+            }) for day in range(1, 4)
+        ]
+        response = await self.client.put(
+            "/archive/?batch_size=2",
+            data="\n".join(lines),
+            headers={"Content-type": "application/x-ndjson"})
+        summary = await response.json()
+        self.assertEqual(3, summary["data"])
+        self.assertEqual(2, summary["batches"])
+        response = await self.client.get("/archive/?format=ndjson")
+        records = [
+            json.loads(line) for line in (await response.text()).splitlines()
+        ]
+        self.assertEqual("schema", records[0]["type"])
+        self.assertEqual(lines, [json.dumps(record) for record in records[1:]])
+        response = await self.client.get("/archive/?stream=1")
+        self.assertEqual(3, len(
+            (await response.json())["rabrams"]["daily"]["data"]))
+
+
+class BatchedAsyncAPITests(AsyncAPITestCase):
+    """
+    Test the asyncio API coalescing concurrent datum writes
+    """
+    api_options = {"write_batch_size": 4, "write_batch_delay": 0.5}
+
+    async def test_concurrent_writes(self):
+        """
+        test concurrent datum writes are acknowledged and written in a batch
+        """
+        responses = await asyncio.gather(*[
+            self.put_json("/data/rabrams/daily/2017-01-0{}/?durability=soft".
+                          format(day), {"slept_in": True})
+            for day in range(1, 5)
+        ])
+        self.assertEqual([200] * 4,
+                         [response.status for response in responses])
+        self.assertEqual([4], self.db.table("data").inserts)
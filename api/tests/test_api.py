@@ -2,150 +2,1612 @@
 Unit tests for the trackit API
 """
 
+import collections
+import copy
 import json
-import operator
+import os
+import shutil
+import tempfile
+import threading
+import time
 import unittest
 
 import mock
+import msgpack
+import prometheus_client
+import werkzeug.exceptions
 
 import api.api
+import api.handlers
+import api.metrics
+import api.views
+from api import columnar, gunicorn_config, settings
+from api.storage import PRIMARY_KEYS, SQLiteStorage
+from api.tests.rethinkdb_mock import MockDB, mock_connection
 
 
-class MockRowConstraint(object):
+class APITestCase(unittest.TestCase):
     """
-    A Mock rethinkdb filter
+    Abstract base class for API test cases
     """
+    tables = {}
 
-    def __init__(self, attribute, op, expression):
+    def setUp(self):
         """
-        Initialize
+        Creates an API over a database holding a copy of the test case's rows
+        given as a class attribute and records the size of each batch of rows
+        it upserts
         """
-        self.attribute = attribute
-        self.op = op
-        self.expression = expression
+        self.api = self.create_api(copy.deepcopy(self.tables))
+        self.upserts = collections.defaultdict(list)
+        upsert = self.api.storage.upsert
+
+        def record_upsert(table, rows, durability="hard"):
+            self.upserts[table].append(len(rows))
+            return upsert(table, rows, durability)
+
+        self.api.storage.upsert = record_upsert
+
+    @staticmethod
+    def create_api(tables):
+        """
+        Create an API over an in-memory SQLite database holding tables
+        """
+        storage = SQLiteStorage()
+        for table, rows in tables.items():
+            storage.upsert(table, rows)
+        return api.api.API(None, "trackit", storage=storage)
+
+
+class RethinkDBTestMixin(object):
+    """
+    Runs an API test case on RethinkDB storage over a mock connection
+    """
 
-    def matches(self, row):
+    @staticmethod
+    def create_api(tables):
         """
-        return true iff the constraint matches a mock row (dict)
+        Create an API over a mock RethinkDB database holding tables
         """
-        return self.op(row[self.attribute], self.expression)
+        return api.api.API(mock_connection(MockDB(tables)), "trackit")
 
 
-class MockPartialRowConstraint(object):
+class GetSchemaTests(APITestCase):
     """
-    Mock of the expression part of a rethinkdb filter (can be combined with other
-    partials to make a MockRowConstraint)
+    Test getting schemata using the API
     """
+    tables = {
+        "schemata": [{
+            "username": "rabrams",
+            "name": "rabrams/schema-1",
+            "body": {},
+        }, ],
+    }
 
-    def __init__(self, attribute):
+    def test_one_schema(self):
         """
-        Initialize
+        test getting a single scema
         """
-        self.attribute = attribute
+        expected_response = {"schema-1": {}}
+        self.assertEqual(expected_response, self.api.get_schemata("rabrams"))
 
-    def __eq__(self, expression):
+    def test_compact_by_default(self):
         """
-        Construct an exp1 == exp2 type MockRowConstraint
+        test responses are compact JSON unless pretty output is requested
         """
-        return MockRowConstraint(self.attribute, operator.eq, expression)
+        client = self.api.app.test_client()
+        response = client.get("/schemata/rabrams/")
+        self.assertEqual("application/json", response.mimetype)
+        self.assertEqual(b'{"schema-1":{}}', response.get_data())
+        response = client.get("/schemata/rabrams/?pretty=1")
+        self.assertEqual(
+            json.dumps({"schema-1": {}}, indent=4).encode("utf-8"),
+            response.get_data())
+        for value in ("0", "false", "no"):
+            response = client.get(
+                "/schemata/rabrams/", query_string={"pretty": value})
+            self.assertEqual(b'{"schema-1":{}}', response.get_data())
 
+    def test_msgpack(self):
+        """
+        test responses are MessagePack when the client accepts it
+        """
+        client = self.api.app.test_client()
+        for mimetype in ("application/msgpack", "application/vnd.msgpack",
+                         "application/x-msgpack"):
+            response = client.get(
+                "/schemata/rabrams/", headers={"Accept": mimetype})
+            self.assertEqual(mimetype, response.mimetype)
+            self.assertEqual({
+                "schema-1": {}
+            }, msgpack.unpackb(response.get_data(), raw=False))
 
-class MockRowConstraintFactory(object):
+    def test_many_namespaces(self):
+        """
+        test getting the schemata of several namespaces in one request
+        """
+        client = self.api.app.test_client()
+        response = client.get("/schemata/?namespace=rabrams&namespace=nobody")
+        self.assertEqual({
+            "rabrams": {
+                "schema-1": {}
+            },
+            "nobody": {}
+        }, json.loads(response.get_data()))
+        self.assertEqual(400, client.get("/schemata/").status_code)
+
+
+class GetDataTests(APITestCase):
     """
-    MockPartialRowConstraint generator that behaves like r.row
+    Test getting data using the API
     """
+    tables = {
+        "data": [
+            {
+                "username": "rabrams",
+                "schema": "daily",
+                "key": "rabrams/daily/2017-01-01",
+                "datum": {
+                    "slept_in": True
+                },
+            },
+            {
+                "username": "rabrams",
+                "schema": "weekly",
+                "key": "rabrams/weekly/2017-01-01",
+                "datum": {
+                    "slept_in": False
+                },
+            },
+        ],
+    }
 
-    def __init__(self):
+    def test_only_schema_data(self):
         """
-        Initialize
+        test getting data only returns data of the requested schema
         """
-        pass
+        expected_response = {"2017-01-01": {"slept_in": True}}
+        with self.api.app.test_request_context():
+            self.assertEqual(expected_response,
+                             self.api.get_data("rabrams", "daily"))
+
 
-    def __getitem__(self, row_name):
+class GetDataPageTests(APITestCase):
+    """
+    Test getting ranges and pages of data using the API
+    """
+    tables = {
+        "data": [{
+            "username": "rabrams",
+            "schema": "daily",
+            "key": "rabrams/daily/2017-01-0{}".format(day),
+            "datum": {
+                "day": day
+            },
+        } for day in [5, 3, 1, 2, 4]],
+    }
+
+    def get_page(self, **params):
         """
-        Like r.row[item] creates a MockPartialRowConstraint
+        Return the keys and continuation token of a page of data
         """
-        return MockPartialRowConstraint(row_name)
+        client = self.api.app.test_client()
+        response = client.get(
+            "/data/rabrams/daily/", query_string=params)
+        self.assertEqual(200, response.status_code)
+        return (list(json.loads(response.get_data(as_text=True))),
+                response.headers.get("X-Continuation-Token"))
+
+    def test_key_range(self):
+        """
+        test getting data for a range of keys ordered by key
+        """
+        keys, token = self.get_page(start="2017-01-02", end="2017-01-04")
+        self.assertEqual(["2017-01-02", "2017-01-03"], keys)
+        self.assertIsNone(token)
+
+    def test_pagination(self):
+        """
+        test paging through data with continuation tokens
+        """
+        keys, token = self.get_page(start="2017-01-02", limit=2)
+        self.assertEqual(["2017-01-02", "2017-01-03"], keys)
+        keys, token = self.get_page(
+            start="2017-01-02", limit=2, continuation=token)
+        self.assertEqual(["2017-01-04", "2017-01-05"], keys)
+        self.assertIsNone(token)
+
+    def test_malformed_limit(self):
+        """
+        test a limit that isn't an integer is a 400 rather than ignored
+        """
+        client = self.api.app.test_client()
+        for limit in ("abc", "0"):
+            response = client.get(
+                "/data/rabrams/daily/", query_string={"limit": limit})
+            self.assertEqual(400, response.status_code)
 
 
-class MockTable(object):
+class GetDatumTests(APITestCase):
     """
-    A mock rethinkdb table
+    Test getting a single datum using the API
     """
+    tables = {
+        "data": [{
+            "username": "rabrams",
+            "schema": "daily",
+            "key": "rabrams/daily/latest",
+            "datum": {
+                "slept_in": True
+            },
+        }, ],
+    }
 
-    def __init__(self, rows):
+    def test_get_datum(self):
         """
-        Initialize
+        test getting a datum by its key
         """
-        self.rows = rows
+        expected_response = {"slept_in": True}
+        self.assertEqual(expected_response,
+                         self.api.get_datum("rabrams", "daily", "latest"))
 
-    def filter(self, constraint):
+    def test_missing_datum(self):
         """
-        Return the rows that match a MockRowConstraint
+        test getting a datum that does not exist is a 404
         """
-        toret = mock.Mock()
-        toret.run.return_value = list(filter(constraint.matches, self.rows))
-        return toret
+        with self.assertRaises(werkzeug.exceptions.NotFound):
+            self.api.get_datum("rabrams", "daily", "missing")
+
+    def test_cached_datum(self):
+        """
+        test a datum is served from cache once it has been read
+        """
+        self.api.get_datum("rabrams", "daily", "latest")
+        self.api.storage.upsert(
+            "data", [dict(self.tables["data"][0], datum={"slept_in": False})])
+        expected_response = {"slept_in": True}
+        self.assertEqual(expected_response,
+                         self.api.get_datum("rabrams", "daily", "latest"))
 
 
-class MockDB(object):
+class GetArchiveTests(APITestCase):
     """
-    A mock rethink database
+    Test getting an archive using the API
     """
+    tables = {
+        "schemata": [
+            {
+                "username": "user2",
+                "name": "user2/schema3",
+                "body": {},
+            },
+            {
+                "username": "user1",
+                "name": "user1/schema1",
+                "body": {},
+            },
+            {
+                "username": "user1",
+                "name": "user1/schema2",
+                "body": {},
+            },
+        ],
+        "data": [
+            {
+                "username": "user1",
+                "schema": "schema1",
+                "key": "user1/schema1/datum1",
+                "datum": {
+                    "field1": "foo"
+                },
+            },
+            {
+                "username": "user2",
+                "schema": "schema3",
+                "key": "user2/schema3/datum3",
+                "datum": {
+                    "field3": "baz"
+                },
+            },
+            {
+                "username": "user1",
+                "schema": "schema1",
+                "key": "user1/schema1/datum2",
+                "datum": {
+                    "field1": "bar"
+                },
+            },
+        ],
+    }
 
-    def __init__(self, data):
+    def test_streamed_archive_matches(self):
         """
-        Initialize
+        test the streamed JSON archive matches the buffered one
         """
-        self.data = data
+        client = self.api.app.test_client()
+        buffered = json.loads(client.get("/archive/").get_data(as_text=True))
+        streamed = client.get("/archive/?stream=1").get_json()
+        self.assertEqual(buffered, streamed)
+        self.assertEqual({"field1": "bar"},
+                         streamed["user1"]["schema1"]["data"]["datum2"])
+        self.assertEqual({}, streamed["user1"]["schema2"]["data"])
 
-    def table(self, name):
+    def test_ndjson_archive(self):
         """
-        Get the table of a given name
+        test the archive streamed as one record per line
         """
-        return MockTable(self.data[name])
+        client = self.api.app.test_client()
+        response = client.get("/archive/?format=ndjson")
+        records = [
+            json.loads(line)
+            for line in response.get_data(as_text=True).splitlines()
+        ]
+        self.assertEqual(6, len(records))
+        self.assertEqual({
+            "type": "schema",
+            "namespace": "user1",
+            "name": "schema1",
+            "schema": {},
+        }, records[0])
+        self.assertEqual("datum", records[1]["type"])
+        self.assertEqual("user2", records[-1]["namespace"])
 
 
-class APITestCase(unittest.TestCase):
+class RestoreArchiveTests(APITestCase):
     """
-    Abstract base class for API test cases
+    Test restoring an archive using the API
+    """
+
+    def test_ndjson_restore(self):
+        """
+        test restoring a line-delimited archive in bounded batches
+        """
+        records = [{
+            "type": "schema",
+            "namespace": "user1",
+            "name": "schema1",
+            "schema": {},
+        }] + [{
+            "type": "datum",
+            "namespace": "user1",
+            "schema": "schema1",
+            "key": "datum{}".format(i),
+            "datum": {
+                "field1": i
+            },
+        } for i in range(5)]
+        client = self.api.app.test_client()
+        response = client.put(
+            "/archive/?batch_size=2",
+            data="\n".join(json.dumps(record) for record in records),
+            content_type="application/x-ndjson")
+        summary = json.loads(response.get_data(as_text=True))
+        self.assertEqual(1, summary["schemata"])
+        self.assertEqual(5, summary["data"])
+        self.assertEqual(4, summary["batches"])
+        self.assertEqual([2, 2, 1], self.upserts["data"])
+        self.assertEqual(5, len(list(self.api.storage.scan("data"))))
+
+    def test_malformed_ndjson_restore(self):
+        """
+        test a malformed record is rejected with a 400
+        """
+        client = self.api.app.test_client()
+        response = client.put(
+            "/archive/", data="{}\n", content_type="application/x-ndjson")
+        self.assertEqual(400, response.status_code)
+
+
+class DeltaArchiveTests(APITestCase):
+    """
+    Test getting and applying delta archives using the API
+    """
+    tables = {
+        "schemata": [{
+            "username": "rabrams",
+            "name": "rabrams/daily",
+            "body": {
+                "slept_in": {
+                    "type": "bool"
+                }
+            },
+        }],
+        "data": [{
+            "username": "rabrams",
+            "schema": "daily",
+            "key": "rabrams/daily/2017-01-01",
+            "datum": {
+                "slept_in": False
+            },
+        }],
+    }
+
+    def get_delta(self, since):
+        """
+        Return the records of a delta archive and its next watermark
+        """
+        response = self.api.app.test_client().get(
+            "/archive/", query_string={"since": since})
+        self.assertEqual(200, response.status_code)
+        return [
+            json.loads(line)
+            for line in response.get_data(as_text=True).splitlines()
+        ], response.headers["X-Watermark"]
+
+    def test_delta(self):
+        """
+        test a delta holds only what was written or purged since a watermark
+        """
+        self.api.delta_overlap = 0
+        client = self.api.app.test_client()
+        response = client.get("/archive/?format=ndjson")
+        self.assertEqual(2, len(response.get_data(as_text=True).splitlines()))
+        watermark = response.headers["X-Watermark"]
+        client.put(
+            "/data/rabrams/daily/2017-01-02/",
+            data=json.dumps({"slept_in": True}),
+            content_type="application/json")
+        records, next_watermark = self.get_delta(watermark)
+        self.assertEqual([{
+            "type": "datum",
+            "namespace": "rabrams",
+            "schema": "daily",
+            "key": "2017-01-02",
+            "datum": {
+                "slept_in": True
+            },
+        }], records)
+        self.assertGreaterEqual(float(next_watermark), float(watermark))
+        client.post("/purge/")
+        self.assertEqual([{"type": "purge"}], self.get_delta(watermark)[0])
+
+    def test_apply_delta(self):
+        """
+        test a delta restored on a replica replays its writes and purges
+        """
+        replica = self.create_api(copy.deepcopy(self.tables)).app.test_client()
+        records = [{
+            "type": "datum",
+            "namespace": "rabrams",
+            "schema": "daily",
+            "key": "2017-01-01",
+            "datum": {
+                "slept_in": True
+            },
+        }]
+        response = replica.put(
+            "/archive/",
+            data="\n".join(json.dumps(record) for record in records),
+            content_type="application/x-ndjson")
+        self.assertEqual(0, json.loads(response.get_data())["purges"])
+        self.assertEqual({
+            "2017-01-01": {
+                "slept_in": True
+            }
+        }, json.loads(replica.get("/data/rabrams/daily/").get_data()))
+        response = replica.put(
+            "/archive/",
+            data=json.dumps({"type": "purge"}),
+            content_type="application/x-ndjson")
+        self.assertEqual(1, json.loads(response.get_data())["purges"])
+        self.assertEqual(
+            404, replica.get("/data/rabrams/daily/2017-01-01/").status_code)
+
+    def test_invalid_watermark(self):
+        """
+        test an invalid watermark is rejected with a 400
+        """
+        client = self.api.app.test_client()
+        self.assertEqual(400, client.get("/archive/?since=x").status_code)
+        self.assertEqual(400, client.get("/archive/?since=nan").status_code)
+
+
+class PurgeTests(APITestCase):
+    """
+    Test purging namespaces and schemata using the API
     """
-    dbs = {}
+    tables = {
+        "schemata": [{
+            "username": username,
+            "name": "{}/{}".format(username, schema),
+            "body": {
+                "slept_in": {
+                    "type": "bool"
+                }
+            },
+        } for username in ("rabrams", "someone")
+                     for schema in ("daily", "weekly")],
+        "data": [{
+            "username": username,
+            "schema": schema,
+            "key": "{}/{}/2017-01-0{}".format(username, schema, day),
+            "datum": {
+                "slept_in": True
+            },
+        } for username in ("rabrams", "someone")
+                 for schema in ("daily", "weekly") for day in range(1, 6)],
+    }
 
     def setUp(self):
         """
-        Creates a mock database given the test case's mock data as
-        a class attribute
+        Purge in small batches without waiting between them
         """
-        self.mock_db_connection = mock.Mock()
-        self.mock_db_connection.row = MockRowConstraintFactory()
-        self.mock_db_connection.db.side_effect = self._db
-        self.api = api.api.API(self.mock_db_connection, "trackit")
+        super().setUp()
+        self.api.purge_batch_size = 2
+        self.api.purge_interval = 0
+        self.client = self.api.app.test_client()
 
-    def _db(self, name):
-        return self.dbs[name]
+    def purge(self, path):
+        """
+        Start a purge, wait for its job to finish and return the job
+        """
+        response = self.client.post(path)
+        self.assertEqual(202, response.status_code)
+        location = response.headers["Location"]
+        for _ in range(200):
+            job = json.loads(self.client.get(location).get_data())
+            if job["status"] != "running":
+                return job
+            time.sleep(0.01)
+        self.fail("purge still running")
+        return None
 
+    def schemata(self, username):
+        """
+        Return the schema names of a namespace
+        """
+        return sorted(
+            json.loads(self.client.get(
+                "/schemata/{}/".format(username)).get_data()))
 
-class GetSchemaTests(APITestCase):
+    def test_purge_schema(self):
+        """
+        test purging a schema leaves other schemata and namespaces alone
+        """
+        job = self.purge("/purge/rabrams/daily/")
+        self.assertEqual("done", job["status"])
+        self.assertEqual({"schemata": 1, "data": 5}, job["deleted"])
+        self.assertEqual(["weekly"], self.schemata("rabrams"))
+        self.assertEqual(["daily", "weekly"], self.schemata("someone"))
+        self.assertEqual(
+            404,
+            self.client.get("/data/rabrams/daily/2017-01-01/").status_code)
+        self.assertEqual(15, len(list(self.api.storage.scan("data"))))
+
+    def test_purge_namespace(self):
+        """
+        test purging a namespace in batches and replicating it in a delta
+        """
+        self.api.delta_overlap = 0
+        watermark = self.client.get(
+            "/archive/?format=ndjson").headers["X-Watermark"]
+        job = self.purge("/purge/rabrams/")
+        self.assertEqual({"schemata": 2, "data": 10}, job["deleted"])
+        self.assertEqual([], self.schemata("rabrams"))
+        self.assertEqual(10, len(list(self.api.storage.scan("data"))))
+        delta = self.client.get(
+            "/archive/", query_string={
+                "since": watermark
+            }).get_data(as_text=True)
+        self.assertEqual([{
+            "type": "purge",
+            "namespace": "rabrams"
+        }], [json.loads(line) for line in delta.splitlines()])
+
+        replica = self.create_api(copy.deepcopy(self.tables))
+        response = replica.app.test_client().put(
+            "/archive/", data=delta, content_type="application/x-ndjson")
+        self.assertEqual(1, json.loads(response.get_data())["purges"])
+        self.assertEqual(
+            ["someone"],
+            sorted({row["username"]
+                    for row in replica.storage.scan("data")}))
+        self.assertEqual([], list(replica.storage.scan("jobs")))
+
+    def test_missing_job(self):
+        """
+        test getting an unknown job is a 404
+        """
+        self.assertEqual(404, self.client.get("/jobs/missing/").status_code)
+
+    def test_shared_job(self):
+        """
+        test jobs are reported by every worker over the storage until they
+        expire
+        """
+        job = self.purge("/purge/rabrams/daily/")
+        worker = api.api.API(None, "trackit", storage=self.api.storage.storage)
+        location = "/jobs/{}/".format(job["id"])
+        response = worker.app.test_client().get(location)
+        self.assertEqual(job, json.loads(response.get_data()))
+        self.assertEqual("rabrams/daily", response.headers[
+            api.api.INVALIDATE_HEADER])
+        self.api.storage.upsert(
+            "jobs", [dict(job, started=job["started"] - api.handlers.JOB_TTL)])
+        self.assertEqual(404, self.client.get(location).status_code)
+        self.purge("/purge/someone/daily/")
+        self.assertIsNone(self.api.storage.get("jobs", job["id"]))
+
+
+class SetDatumTests(APITestCase):
     """
-    Test getting schemata using the API
+    Test setting a datum using the API
     """
-    dbs = {
-        "trackit": MockDB({
-            "schemata": [{
-                "username": "rabrams",
-                "name": "rabrams/schema-1",
-                "body": {},
-            }, ],
+    tables = {
+        "schemata": [{
+            "username": "rabrams",
+            "name": "rabrams/daily",
+            "body": {
+                "slept_in": {
+                    "type": "bool"
+                }
+            },
+        }],
+        "data": [],
+    }
+
+    def test_msgpack_body(self):
+        """
+        test setting a datum from a MessagePack body
+        """
+        client = self.api.app.test_client()
+        response = client.put(
+            "/data/rabrams/daily/latest/",
+            data=msgpack.packb({"slept_in": True}),
+            content_type="application/msgpack")
+        self.assertEqual(200, response.status_code)
+        self.assertEqual({"slept_in": True},
+                         self.api.get_datum("rabrams", "daily", "latest"))
+
+    def test_conditional_get_data(self):
+        """
+        test data are tagged with their version and a 304 is returned until
+        they change
+        """
+        client = self.api.app.test_client()
+
+        def put(slept_in):
+            """
+            set the latest datum
+            """
+            client.put(
+                "/data/rabrams/daily/latest/",
+                data=json.dumps({
+                    "slept_in": slept_in
+                }),
+                content_type="application/json")
+
+        put(True)
+        response = client.get("/data/rabrams/daily/")
+        etag = response.headers["ETag"]
+        self.assertIn("Last-Modified", response.headers)
+        response = client.get(
+            "/data/rabrams/daily/", headers={"If-None-Match": etag})
+        self.assertEqual(304, response.status_code)
+        response = client.get(
+            "/data/rabrams/daily/?pretty=1", headers={"If-None-Match": etag})
+        self.assertEqual(200, response.status_code)
+        put(False)
+        response = client.get(
+            "/data/rabrams/daily/", headers={"If-None-Match": etag})
+        self.assertEqual(200, response.status_code)
+        self.assertNotEqual(etag, response.headers["ETag"])
+
+    def test_invalid_datum(self):
+        """
+        test setting a datum that doesn't match its schema is a 400
+        """
+        client = self.api.app.test_client()
+        response = client.put(
+            "/data/rabrams/daily/latest/",
+            data=json.dumps({
+                "slept_in": "yes"
+            }),
+            content_type="application/json")
+        self.assertEqual(400, response.status_code)
+
+    def test_missing_schema(self):
+        """
+        test setting a datum for a schema that doesn't exist is a 404
+        """
+        client = self.api.app.test_client()
+        response = client.put(
+            "/data/rabrams/weekly/latest/",
+            data=json.dumps({}),
+            content_type="application/json")
+        self.assertEqual(404, response.status_code)
+
+    def test_validator_cached(self):
+        """
+        test the schema is fetched once and then served from cache
+        """
+        client = self.api.app.test_client()
+        for key in ["1", "2"]:
+            client.put(
+                "/data/rabrams/daily/{}/".format(key),
+                data=json.dumps({
+                    "slept_in": True
+                }),
+                content_type="application/json")
+        self.assertEqual(1, self.api.validators.misses)
+        self.assertEqual(1, self.api.validators.hits)
+
+    def test_schema_changed_by_other_worker(self):
+        """
+        test a cached validator isn't used once the schemata view sees another
+        worker over the same storage change its schema
+        """
+        view = api.views.SchemataView(None)
+        old = self.tables["schemata"][0]
+        view._consume([{"new_val": old}, {"state": "ready"}])
+        self.api.schemata_view = view
+        client = self.api.app.test_client()
+        worker = api.api.API(None, "trackit", storage=self.api.storage.storage)
+        self.assertEqual(
+            200,
+            client.put(
+                "/data/rabrams/daily/1/",
+                data=json.dumps({
+                    "slept_in": True
+                }),
+                content_type="application/json").status_code)
+        worker.app.test_client().put(
+            "/schemata/rabrams/daily/",
+            data=json.dumps({
+                "hours": {
+                    "type": "number"
+                }
+            }),
+            content_type="application/json")
+        view._receive(view._schemata, {
+            "old_val": old,
+            "new_val": self.api.storage.get("schemata", "rabrams/daily")
         })
+        self.assertEqual(
+            400,
+            client.put(
+                "/data/rabrams/daily/2/",
+                data=json.dumps({
+                    "slept_in": True
+                }),
+                content_type="application/json").status_code)
+
+    def test_validator_without_db_read(self):
+        """
+        test a cached validator is used without reading anything back
+        """
+        client = self.api.app.test_client()
+        client.put(
+            "/data/rabrams/daily/1/",
+            data=json.dumps({
+                "slept_in": True
+            }),
+            content_type="application/json")
+        with mock.patch.object(self.api.storage, "get") as get:
+            client.put(
+                "/data/rabrams/daily/2/",
+                data=json.dumps({
+                    "slept_in": True
+                }),
+                content_type="application/json")
+        get.assert_not_called()
+
+
+class InvalidationTests(APITestCase):
+    """
+    Test responses tell caches in front of the API what requests changed
+    """
+    tables = SetDatumTests.tables
+
+    def setUp(self):
+        """
+        Create a test client
+        """
+        super().setUp()
+        self.client = self.api.app.test_client()
+
+    def invalidated(self, response):
+        """
+        Return the names a response invalidates or None
+        """
+        return response.headers.get(api.api.INVALIDATE_HEADER)
+
+    def test_writes(self):
+        """
+        test writes name the namespace or schema they changed
+        """
+        response = self.client.put(
+            "/data/rabrams/daily/2017-01-01/",
+            data=json.dumps({
+                "slept_in": True
+            }),
+            content_type="application/json")
+        self.assertEqual("rabrams/daily", self.invalidated(response))
+        response = self.client.put(
+            "/schemata/rabrams/weekly/",
+            data=json.dumps({}),
+            content_type="application/json")
+        self.assertEqual("rabrams", self.invalidated(response))
+        self.assertIsNone(
+            self.invalidated(self.client.get("/data/rabrams/daily/")))
+        self.assertEqual("*", self.invalidated(self.client.post("/purge/")))
+
+    def test_failed_write(self):
+        """
+        test rejected writes invalidate nothing
+        """
+        response = self.client.put(
+            "/data/rabrams/daily/2017-01-01/",
+            data=json.dumps({
+                "slept_in": "no"
+            }),
+            content_type="application/json")
+        self.assertEqual(400, response.status_code)
+        self.assertIsNone(self.invalidated(response))
+
+    def test_header(self):
+        """
+        test names are quoted and many names invalidate everything
+        """
+        # pylint: disable=protected-access
+        header = api.handlers.invalidation_header
+        self.assertEqual("a%20b a%20b/c", header({"a b/c", "a b"}))
+        self.assertEqual(
+            "*", header({str(i)
+                         for i in range(api.handlers.MAX_INVALIDATIONS + 1)}))
+
+
+class BatchedWriteTests(APITestCase):
+    """
+    Test coalescing concurrent datum writes using the API
+    """
+    tables = SetDatumTests.tables
+
+    @staticmethod
+    def create_api(tables):
+        """
+        Create an API coalescing datum writes into batches of up to 4
+        """
+        storage = SQLiteStorage()
+        for table, rows in tables.items():
+            storage.upsert(table, rows)
+        return api.api.API(
+            None,
+            "trackit",
+            storage=storage,
+            write_batch_size=4,
+            write_batch_delay=0.5)
+
+    def test_concurrent_writes(self):
+        """
+        test concurrent datum writes are acknowledged and written in batches
+        """
+        statuses = []
+
+        def put(day):
+            """
+            PUT a datum
+            """
+            statuses.append(self.api.app.test_client().put(
+                "/data/rabrams/daily/2017-01-0{}/".format(day),
+                data=json.dumps({"slept_in": day % 2 == 0}),
+                content_type="application/json").status_code)
+
+        threads = [
+            threading.Thread(target=put, args=(day, )) for day in range(1, 9)
+        ]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+        self.assertEqual([200] * 8, statuses)
+        self.assertEqual(8, sum(self.upserts["data"]))
+        self.assertLess(len(self.upserts["data"]), 8)
+        self.assertEqual(8, len(list(self.api.storage.scan("data"))))
+
+    def test_write_error(self):
+        """
+        test a datum that fails to be written is reported to its writer
+        """
+        with mock.patch.object(
+                self.api.storage,
+                "upsert",
+                return_value={
+                    "errors": 1,
+                    "first_error": "disk full"
+                }):
+            response = self.api.app.test_client().put(
+                "/data/rabrams/daily/latest/",
+                data=json.dumps({"slept_in": True}),
+                content_type="application/json")
+        self.assertEqual(500, response.status_code)
+        self.assertIn("disk full", response.get_data(as_text=True))
+
+    def test_durability(self):
+        """
+        test writes have the durability requested by the client
+        """
+        client = self.api.app.test_client()
+        with mock.patch.object(
+                self.api.storage, "upsert",
+                wraps=self.api.storage.upsert) as upsert:
+            response = client.put(
+                "/data/rabrams/daily/latest/?durability=soft",
+                data=json.dumps({"slept_in": True}),
+                content_type="application/json")
+        self.assertEqual(200, response.status_code)
+        self.assertEqual("soft", upsert.call_args_list[0][0][2])
+        response = client.put(
+            "/data/rabrams/daily/?durability=none",
+            data=json.dumps({"latest": {
+                "slept_in": True
+            }}),
+            content_type="application/json")
+        self.assertEqual(400, response.status_code)
+
+
+class SetDataTests(APITestCase):
+    """
+    Test setting many data at once using the API
+    """
+    tables = {
+        "schemata": [{
+            "username": "rabrams",
+            "name": "rabrams/daily",
+            "body": {
+                "slept_in": {
+                    "type": "bool"
+                }
+            },
+        }],
+        "data": [],
     }
 
-    def test_one_schema(self):
+    def test_bulk_map(self):
         """
-        test getting a single scema
+        test setting data from a map reports the outcome per key
         """
-        expected_response = json.dumps({"schema-1": {}}, indent=4)
-        self.assertEqual(expected_response, self.api.get_schemata("rabrams"))
+        client = self.api.app.test_client()
+        response = client.put(
+            "/data/rabrams/daily/",
+            data=json.dumps({
+                "2017-01-01": {
+                    "slept_in": True
+                },
+                "bad/key": {
+                    "slept_in": False
+                },
+                "2017-01-02": {
+                    "slept_in": "yes"
+                },
+            }),
+            content_type="application/json")
+        self.assertEqual({
+            "2017-01-01": {
+                "status": "ok"
+            },
+            "bad/key": {
+                "error": "invalid key"
+            },
+            "2017-01-02": {
+                "error": "field slept_in must be of type bool"
+            },
+        }, json.loads(response.get_data(as_text=True)))
+        self.assertEqual({"slept_in": True},
+                         self.api.get_datum("rabrams", "daily", "2017-01-01"))
+
+    def test_bulk_ndjson(self):
+        """
+        test setting line-delimited data in bounded batches
+        """
+        client = self.api.app.test_client()
+        response = client.put(
+            "/data/rabrams/daily/?batch_size=2",
+            data="\n".join(
+                json.dumps({
+                    "key": "2017-01-0{}".format(day),
+                    "datum": {
+                        "slept_in": day % 2 == 0
+                    }
+                }) for day in range(1, 6)),
+            content_type="application/x-ndjson")
+        self.assertEqual(5, len(json.loads(response.get_data(as_text=True))))
+        self.assertEqual([2, 2, 1], self.upserts["data"])
+
+
+class SchemataViewAPITests(APITestCase):
+    """
+    Test reading schemata from a materialized view
+    """
+    tables = GetSchemaTests.tables
+
+    def setUp(self):
+        """
+        Create an API with a ready view holding a different schema than the db
+        """
+        super(SchemataViewAPITests, self).setUp()
+        self.api.schemata_view = mock.Mock(ready=True)
+        self.api.schemata_view.namespace.return_value = {"from-view": {}}
+
+    def test_reads_from_view(self):
+        """
+        test schemata are read from the view when it is ready
+        """
+        self.assertEqual({"from-view": {}}, self.api.get_schemata("rabrams"))
+
+    def test_reads_own_writes(self):
+        """
+        test a namespace written by this process is read from the db
+        """
+        self.api.recent_schema_writes.set("rabrams", True)
+        with self.api.app.test_request_context():
+            self.assertEqual({
+                "schema-1": {}
+            }, self.api.get_schemata("rabrams"))
+
+
+class PooledAPITests(RethinkDBTestMixin, APITestCase):
+    """
+    Test the API runs queries on connections checked out of a pool
+    """
+    tables = GetSchemaTests.tables
+
+    def setUp(self):
+        """
+        Create an API with a mock connection pool
+        """
+        super(PooledAPITests, self).setUp()
+        self.pool = mock.Mock()
+        self.api.pool = self.pool
+
+    def test_connection_per_request(self):
+        """
+        test a request checks out one connection and returns it
+        """
+        client = self.api.app.test_client()
+        response = client.get("/schemata/rabrams/")
+        self.assertEqual({"schema-1": {}}, response.get_json())
+        self.pool.checkout.assert_called_once_with()
+        self.pool.checkin.assert_called_once_with(
+            self.pool.checkout.return_value, suspect=False)
+
+
+    def test_connection_per_purge_batch(self):
+        """
+        test a purge job checks out a connection per batch and holds none
+        while it waits between batches
+        """
+        self.api.purge_batch_size = 1
+
+        def sleep(secs):  # pylint: disable=unused-argument
+            """
+            check every connection checked out was returned
+            """
+            self.assertEqual(self.pool.checkout.call_count,
+                             self.pool.checkin.call_count)
+
+        with mock.patch("time.sleep", side_effect=sleep) as sleeps:
+            self.api._run_job(self.api._purge_job,
+                              api.handlers.purge_job("rabrams"))
+        self.assertEqual(1, sleeps.call_count)
+        self.assertEqual(self.pool.checkout.call_count,
+                         self.pool.checkin.call_count)
+        self.assertGreater(self.pool.checkout.call_count, 2)
+
+
+class AggregateTests(APITestCase):
+    """
+    Test aggregating data using the API
+    """
+    tables = {
+        "schemata": [{
+            "username": "rabrams",
+            "name": "rabrams/daily",
+            "body": {
+                "slept_in": {
+                    "type": "bool"
+                },
+                "hours": {
+                    "type": "number"
+                },
+            },
+        }],
+        "data": [{
+            "username": "rabrams",
+            "schema": "daily",
+            "key": "rabrams/daily/{}".format(key),
+            "datum": {
+                "slept_in": slept_in,
+                "hours": hours
+            },
+        } for key, slept_in, hours in [
+            ("2017-01-01", True, 9),
+            ("2017-01-02", False, 6),
+            ("2017-01-08", True, 10),
+            ("2017-01-09", True, 8),
+            ("2017-02-01", False, 7),
+            ("latest", False, 5),
+        ]],
+    }
+
+    def aggregate(self, status=200, **params):
+        """
+        Return the aggregation of data for given arguments
+        """
+        client = self.api.app.test_client()
+        response = client.get(
+            "/aggregate/rabrams/daily/", query_string=params)
+        self.assertEqual(status, response.status_code)
+        if status == 200:
+            return json.loads(response.get_data(as_text=True))
+        return None
+
+    def test_totals(self):
+        """
+        test aggregating all data of a schema to a single value
+        """
+        self.assertEqual({"value": 6}, self.aggregate())
+        self.assertEqual({
+            "value": 45
+        }, self.aggregate(aggregate="sum", field="hours"))
+        self.assertEqual({
+            "value": 5
+        }, self.aggregate(aggregate="min", field="hours"))
+        self.assertEqual({
+            "value": 0.5
+        }, self.aggregate(aggregate="ratio", field="slept_in"))
+
+    def test_range(self):
+        """
+        test aggregating data with keys in a range
+        """
+        self.assertEqual({
+            "value": 10
+        }, self.aggregate(
+            aggregate="max",
+            field="hours",
+            start="2017-01-02",
+            end="2017-01-09"))
+        self.assertEqual({
+            "value": None
+        }, self.aggregate(
+            aggregate="max", field="hours", end="2016-01-01"))
+
+    def test_grouped(self):
+        """
+        test aggregating data of ISO-date keys grouped by period
+        """
+        self.assertEqual({
+            "groups": {
+                "2017-01": 0.75,
+                "2017-02": 0.0
+            }
+        }, self.aggregate(aggregate="ratio", field="slept_in", group="month"))
+        self.assertEqual({
+            "groups": {
+                "2016-12-26": 1,
+                "2017-01-02": 2,
+                "2017-01-09": 1,
+                "2017-01-30": 1
+            }
+        }, self.aggregate(group="week"))
+
+    def test_invalid(self):
+        """
+        test aggregations that don't fit the schema are rejected
+        """
+        self.aggregate(400, aggregate="sum", field="slept_in")
+        self.aggregate(400, aggregate="ratio")
+        self.aggregate(400, aggregate="median", field="hours")
+        self.aggregate(400, field="hours", group="decade")
+        self.aggregate(400, field="missing")
+
+    def test_conditional_on_schema(self):
+        """
+        test aggregations are tagged with the versions of their data and of
+        their schema, so that changing the schema alone changes the tag
+        """
+        client = self.api.app.test_client()
+
+        def put_schema(body):
+            """
+            set the schema of the data
+            """
+            client.put(
+                "/schemata/rabrams/daily/",
+                data=json.dumps(body),
+                content_type="application/json")
+
+        put_schema(self.tables["schemata"][0]["body"])
+        client.put(
+            "/data/rabrams/daily/2017-03-01/",
+            data=json.dumps({
+                "slept_in": True,
+                "hours": 8
+            }),
+            content_type="application/json")
+        response = client.get("/aggregate/rabrams/daily/")
+        etag = response.headers["ETag"]
+        response = client.get(
+            "/aggregate/rabrams/daily/", headers={"If-None-Match": etag})
+        self.assertEqual(304, response.status_code)
+        put_schema({"hours": {"type": "number"}})
+        response = client.get(
+            "/aggregate/rabrams/daily/", headers={"If-None-Match": etag})
+        self.assertEqual(200, response.status_code)
+        self.assertNotEqual(etag, response.headers["ETag"])
+
+
+class ExportTests(APITestCase):
+    """
+    Test exporting data using the API
+    """
+    tables = AggregateTests.tables
+
+    def test_csv(self):
+        """
+        test data are exported as CSV by default
+        """
+        client = self.api.app.test_client()
+        response = client.get("/export/rabrams/daily/")
+        self.assertEqual("text/csv", response.mimetype)
+        lines = response.get_data(as_text=True).splitlines()
+        self.assertEqual("key,hours,slept_in", lines[0])
+        self.assertIn("2017-01-01,9,true", lines)
+        self.assertEqual(7, len(lines))
+
+    def test_columns(self):
+        """
+        test data are exported in typed columns across batches
+        """
+        client = self.api.app.test_client()
+        with mock.patch.object(api.api, "STREAM_BATCH_SIZE", 4):
+            response = client.get("/export/rabrams/daily/?format=columns")
+        self.assertEqual("application/x-trackit-columns", response.mimetype)
+        exported = columnar.read_binary(response.get_data())
+        self.assertEqual(
+            {"2017-01-01": (9.0, True), "latest": (5.0, False)}, {
+                key: (hours, slept_in)
+                for key, hours, slept_in in zip(
+                    exported["key"], exported["hours"], exported["slept_in"])
+                if key in ("2017-01-01", "latest")
+            })
+        self.assertEqual(6, len(exported["key"]))
+
+    def test_invalid(self):
+        """
+        test unknown formats and schemata are rejected
+        """
+        client = self.api.app.test_client()
+        self.assertEqual(
+            400,
+            client.get("/export/rabrams/daily/?format=xls").status_code)
+        self.assertEqual(404, client.get("/export/rabrams/none/").status_code)
+
+    def test_unexportable(self):
+        """
+        test schemata with a field named like the key column or an unknown
+        type are rejected before the export starts, while numbers too large
+        for the binary format are exported as missing
+        """
+        client = self.api.app.test_client()
+        self.api.storage.upsert("schemata", [{
+            "username": "rabrams",
+            "name": "rabrams/keyed",
+            "body": {
+                "key": {
+                    "type": "string"
+                }
+            },
+        }, {
+            "username": "rabrams",
+            "name": "rabrams/restored",
+            "body": {
+                "when": {
+                    "type": "date"
+                }
+            },
+        }, {
+            "username": "rabrams",
+            "name": "rabrams/steps",
+            "body": {
+                "steps": {
+                    "type": "int"
+                }
+            },
+        }])
+        for schema in ("keyed", "restored"):
+            self.assertEqual(
+                400,
+                client.get("/export/rabrams/{}/".format(schema)).status_code)
+        self.api.storage.upsert("data", [{
+            "username": "rabrams",
+            "schema": "steps",
+            "key": "rabrams/steps/latest",
+            "datum": {
+                "steps": 2**63
+            },
+        }])
+        response = client.get("/export/rabrams/steps/?format=columns")
+        self.assertEqual(200, response.status_code)
+        self.assertEqual({
+            "key": ["latest"],
+            "steps": [None]
+        }, columnar.read_binary(response.get_data()))
+
+
+class MetricsTests(APITestCase):
+    """
+    Test exporting metrics of the API
+    """
+    tables = GetDatumTests.tables
+
+    def test_multiprocess(self):
+        """
+        test metrics recorded by other workers are exported too
+        """
+        directory = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, directory)
+        with mock.patch.dict("os.environ",
+                             {"PROMETHEUS_MULTIPROC_DIR": directory}):
+            with mock.patch("prometheus_client.values.ValueClass",
+                            prometheus_client.values.MultiProcessValue(
+                                lambda: 42)):
+                worker = api.metrics.Metrics()
+                worker.request_seconds.labels("get_datum", "GET",
+                                              200).observe(0.1)
+            text = self.api.app.test_client().get("/metrics").get_data(
+                as_text=True)
+        for line in [
+                'trackit_request_seconds_count{method="GET",route="get_datum",'
+                'status="200"} 1.0',
+                'trackit_cache_lookups_total{cache="datum",result="miss"} 0.0',
+        ]:
+            self.assertIn(line, text)
+
+    def test_metrics(self):
+        """
+        test requests and storage operations are exported in text format
+        """
+        client = self.api.app.test_client()
+        client.get("/data/rabrams/daily/latest/")
+        client.get("/data/rabrams/daily/missing/")
+        response = client.get("/metrics")
+        self.assertTrue(response.content_type.startswith("text/plain"))
+        text = response.get_data(as_text=True)
+        for line in [
+                'trackit_request_seconds_count{method="GET",route="get_datum",'
+                'status="200"} 1.0',
+                'trackit_request_seconds_count{method="GET",route="get_datum",'
+                'status="404"} 1.0',
+                'trackit_storage_rows_total{operation="get",table="data"} 1.0',
+                'trackit_cache_lookups_total{cache="datum",result="miss"} 2.0',
+                'trackit_requests_in_flight{route="get_datum"} 0.0',
+        ]:
+            self.assertIn(line, text)
+
+
+class AdmissionTests(APITestCase):
+    """
+    Test requests are only handled within their budgets
+    """
+    tables = SetDatumTests.tables
+
+    def setUp(self):
+        """
+        Allow one expensive request at a time without waiting for a slot
+        """
+        super().setUp()
+        self.api.admission.limits["expensive"] = (2, 1)
+        self.api.admission.timeout = 0
+        self.client = self.api.app.test_client()
+
+    def test_rejected(self):
+        """
+        test requests beyond a namespace's or the global budget are rejected
+        with a hint to retry later while other routes still get through
+        """
+        self.api.admission.acquire("expensive", "rabrams")
+        response = self.client.get("/aggregate/rabrams/daily/")
+        self.assertEqual(429, response.status_code)
+        self.assertEqual("1", response.headers["Retry-After"])
+        self.assertEqual(200,
+                         self.client.get("/schemata/rabrams/").status_code)
+        self.api.admission.acquire("expensive", "someone")
+        response = self.client.get("/archive/")
+        self.assertEqual(503, response.status_code)
+        self.assertEqual(200, self.client.get("/health/ready/").status_code)
+        self.assertIn('trackit_admission_events_total{event="rejected_global"}'
+                      " 1.0",
+                      self.client.get("/metrics").get_data(as_text=True))
+
+    def test_streamed_until_closed(self):
+        """
+        test a streamed response holds its slot until it's closed
+        """
+        self.api.admission.limits["expensive"] = (1, 0)
+        response = self.client.get("/archive/?stream=1")
+        self.assertEqual(200, response.status_code)
+        self.assertEqual(503, self.client.get("/archive/").status_code)
+        response.close()
+        self.assertEqual(200, self.client.get("/archive/").status_code)
+
+    def test_deployed_sizes(self):
+        """
+        test each class's budgets fill while a worker of the deployed size
+        still has a thread free to reject requests on
+        """
+        options = dict(settings.api_options(), admission_timeout=0)
+        for kind, namespaced, other, budgets in (
+            ("normal", "/schemata/rabrams/", "/schemata/someone/",
+             (options["max_requests"], options["namespace_requests"])),
+            ("expensive", "/aggregate/rabrams/daily/", "/archive/",
+             (options["max_expensive_requests"],
+              options["namespace_expensive_requests"])),
+        ):
+            worker = api.api.API(None,
+                                 "trackit",
+                                 storage=self.api.storage.storage,
+                                 **options)
+            client = worker.app.test_client()
+            total, per_namespace = budgets
+            for _ in range(per_namespace):
+                worker.admission.acquire(kind, "rabrams")
+            self.assertEqual(429, client.get(namespaced).status_code)
+            for i in range(total - per_namespace):
+                worker.admission.acquire(kind, "namespace-{}".format(i))
+            self.assertEqual(503, client.get(other).status_code)
+            self.assertLess(total, gunicorn_config.threads)
+
+
+class GunicornConfigTests(unittest.TestCase):
+    """
+    Test the settings gunicorn's master hands down to its workers
+    """
+
+    def setUp(self):
+        """
+        Create a directory for the metrics of workers
+        """
+        self.metrics_dir = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, self.metrics_dir)
+
+    def on_starting(self, workers, environ):
+        """
+        Run the on_starting hook for a number of workers and return the size
+        of the datum cache it leaves configured
+        """
+        server = mock.Mock()
+        server.cfg.workers = workers
+        environ = dict(environ, PROMETHEUS_MULTIPROC_DIR=self.metrics_dir)
+        with mock.patch.dict("os.environ", environ, clear=True):
+            with mock.patch.multiple(settings,
+                                     MIGRATE=False,
+                                     DATUM_CACHE_SIZE=1024):
+                gunicorn_config.on_starting(server)
+                return settings.DATUM_CACHE_SIZE
+
+    def test_datum_cache_off_for_several_workers(self):
+        """
+        test the datum cache is off by default only if several workers run
+        """
+        self.assertEqual(0, self.on_starting(4, {}))
+        self.assertEqual(1024, self.on_starting(1, {}))
+
+    def test_stale_metrics_cleared(self):
+        """
+        test metrics files left behind by a previous master are removed
+        """
+        path = os.path.join(self.metrics_dir, "histogram_1.db")
+        open(path, "w").close()
+        self.on_starting(4, {})
+        self.assertFalse(os.path.exists(path))
+
+    def test_child_exit(self):
+        """
+        test a worker's requests in flight are dropped once it exits
+        """
+        path = os.path.join(self.metrics_dir, "gauge_livesum_42.db")
+        open(path, "w").close()
+        with mock.patch.dict("os.environ",
+                             {"PROMETHEUS_MULTIPROC_DIR": self.metrics_dir}):
+            gunicorn_config.child_exit(mock.Mock(), mock.Mock(pid=42))
+        self.assertFalse(os.path.exists(path))
+
+    def test_datum_cache_configured(self):
+        """
+        test a configured datum cache is kept for several workers
+        """
+        self.assertEqual(
+            1024, self.on_starting(4, {"DATUM_CACHE_SIZE": "1024"}))
+
+
+class HealthTests(APITestCase):
+    """
+    Test the liveness and readiness of the API
+    """
+
+    def test_live_and_ready(self):
+        """
+        test a working API is live and ready
+        """
+        client = self.api.app.test_client()
+        self.assertEqual(200, client.get("/health/live/").status_code)
+        response = client.get("/health/ready/")
+        self.assertEqual(200, response.status_code)
+        self.assertEqual({"ready": True}, json.loads(response.get_data()))
+
+    def test_not_ready(self):
+        """
+        test the API is live but not ready while its storage fails
+        """
+        client = self.api.app.test_client()
+        with mock.patch.object(
+                self.api.storage.storage,
+                "ready",
+                side_effect=RuntimeError("db down")):
+            self.assertEqual(200, client.get("/health/live/").status_code)
+            self.assertEqual(503, client.get("/health/ready/").status_code)
+
+
+class RethinkDBHealthTests(RethinkDBTestMixin, APITestCase):
+    """
+    Test the readiness of the API on RethinkDB
+    """
+
+    def test_ready_once_migrated(self):
+        """
+        test the API is only ready once all tables exist
+        """
+        client = self.api.app.test_client()
+        self.assertEqual(503, client.get("/health/ready/").status_code)
+        self.api.storage.storage.queries.db.data.update(
+            {table: []
+             for table in PRIMARY_KEYS})
+        self.assertEqual(200, client.get("/health/ready/").status_code)
+
+
+class RethinkDBGetDataPageTests(RethinkDBTestMixin, GetDataPageTests):
+    """
+    Test getting ranges and pages of data stored in RethinkDB
+    """
+    pass
+
+
+class RethinkDBGetArchiveTests(RethinkDBTestMixin, GetArchiveTests):
+    """
+    Test getting an archive of data stored in RethinkDB
+    """
+    pass
+
+
+class RethinkDBSetDataTests(RethinkDBTestMixin, SetDataTests):
+    """
+    Test setting many data at once in RethinkDB
+    """
+    pass
 
 
 # TODO(rabrams) full test suite
+
+
+class RethinkDBExportTests(RethinkDBTestMixin, ExportTests):
+    """
+    Test exporting data from RethinkDB using the API
+    """
+
+    pass
+
+
+class RethinkDBDeltaArchiveTests(RethinkDBTestMixin, DeltaArchiveTests):
+    """
+    Test getting and applying delta archives of data stored in RethinkDB
+    """
+    pass
+
+
+class RethinkDBPurgeTests(RethinkDBTestMixin, PurgeTests):
+    """
+    Test purging namespaces and schemata stored in RethinkDB
+    """
+    pass
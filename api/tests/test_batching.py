@@ -0,0 +1,110 @@
+"""
+Unit tests for write-behind micro-batching
+"""
+
+import asyncio
+import threading
+import unittest
+
+from api.batching import AsyncWriteBatcher, WriteBatcher
+
+
+class WriteBatcherTests(unittest.TestCase):
+    """
+    Test coalescing rows written from concurrent threads
+    """
+
+    def submit_all(self, batcher, rows):
+        """
+        Submit rows from a thread each and return their outcomes
+        """
+        outcomes = {}
+
+        def submit(row):
+            """
+            Submit a row recording its outcome or error
+            """
+            try:
+                outcomes[row] = batcher.submit(row)
+            except RuntimeError as error:
+                outcomes[row] = error
+
+        threads = [
+            threading.Thread(target=submit, args=(row, )) for row in rows
+        ]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join(5)
+        return outcomes
+
+    def test_coalesces_rows(self):
+        """
+        test concurrent rows are written in full batches, each getting its
+        own outcome
+        """
+        batches = []
+
+        def write(rows):
+            """
+            Record a batch and fail odd rows
+            """
+            batches.append(list(rows))
+            return ["odd" if row % 2 else None for row in rows]
+
+        # full batches are written long before the delay runs out
+        batcher = WriteBatcher(write, max_rows=4, max_delay=10)
+        outcomes = self.submit_all(batcher, range(8))
+        self.assertEqual({row: "odd" if row % 2 else None
+                          for row in range(8)}, outcomes)
+        self.assertEqual([4, 4], [len(batch) for batch in batches])
+
+    def test_writes_after_delay(self):
+        """
+        test a batch that doesn't fill is written after the delay
+        """
+        batcher = WriteBatcher(lambda rows: [len(rows)] * len(rows),
+                               max_rows=100,
+                               max_delay=0.01)
+        self.assertEqual(1, batcher.submit("row"))
+
+    def test_error_reaches_every_writer(self):
+        """
+        test every writer of a batch gets the error writing it
+        """
+
+        def write(rows):
+            """
+            Fail to write
+            """
+            raise RuntimeError("db down")
+
+        batcher = WriteBatcher(write, max_rows=3, max_delay=10)
+        outcomes = self.submit_all(batcher, range(3))
+        self.assertEqual(["db down"] * 3,
+                         [str(outcomes[row]) for row in range(3)])
+
+
+class AsyncWriteBatcherTests(unittest.IsolatedAsyncioTestCase):
+    """
+    Test coalescing rows written from concurrent tasks
+    """
+
+    async def test_coalesces_rows(self):
+        """
+        test concurrent rows are written in one batch
+        """
+        batches = []
+
+        async def write(rows):
+            """
+            Record a batch
+            """
+            batches.append(list(rows))
+            return [row * 2 for row in rows]
+
+        batcher = AsyncWriteBatcher(write, max_rows=100, max_delay=0.01)
+        self.assertEqual([0, 2, 4],
+                         await asyncio.gather(
+                             *[batcher.submit(row) for row in range(3)]))
+        self.assertEqual([[0, 1, 2]], batches)
@@ -0,0 +1,86 @@
+"""
+Unit tests for the trackit API caches
+"""
+
+import threading
+import unittest
+
+import mock
+
+import api.cache
+
+
+class LRUCacheTests(unittest.TestCase):
+    """
+    Test the LRU/TTL cache
+    """
+
+    def setUp(self):
+        """
+        Create a small cache with a controllable clock
+        """
+        self.now = 0
+        self.cache = api.cache.LRUCache(2, 10, clock=lambda: self.now)
+
+    def test_evicts_least_recently_used(self):
+        """
+        test the least recently used entry is evicted when full
+        """
+        self.cache.set("a", 1)
+        self.cache.set("b", 2)
+        self.cache.get("a")
+        self.cache.set("c", 3)
+        self.assertEqual(1, self.cache.get("a"))
+        self.assertIsNone(self.cache.get("b"))
+        self.assertEqual(3, self.cache.get("c"))
+
+    def test_expires_entries(self):
+        """
+        test entries are dropped once their TTL has passed
+        """
+        self.cache.set("a", 1)
+        self.now = 10
+        self.assertIsNone(self.cache.get("a"))
+
+
+class VersionedCacheTests(unittest.TestCase):
+    """
+    Test the cache of values tagged with versions
+    """
+
+    def test_other_version(self):
+        """
+        test values are only returned at the version they were cached at
+        """
+        cache = api.cache.VersionedCache(2, 10)
+        cache.set("rabrams/daily", "v1", 1)
+        self.assertEqual(1, cache.get("rabrams/daily", "v1"))
+        self.assertIsNone(cache.get("rabrams/daily", "v2"))
+        self.assertIsNone(cache.get("rabrams/daily", "v1"))
+        self.assertEqual((1, 2), (cache.hits, cache.misses))
+
+    def test_set_while_stale(self):
+        """
+        test an entry set at a new version by another thread isn't dropped by
+        a lookup that found the old one stale
+        """
+        cache = api.cache.VersionedCache(2, 10)
+        cache.set("rabrams/daily", "v1", 1)
+        setter = threading.Thread(
+            target=cache.set, args=("rabrams/daily", "v2", 2))
+        lookup = cache._cache.get
+
+        def get(key):
+            """
+            look up the entry while another thread sets the new version
+            """
+            entry = lookup(key)
+            setter.start()
+            setter.join(0.05)
+            self.assertTrue(setter.is_alive())
+            return entry
+
+        with mock.patch.object(cache._cache, "get", side_effect=get):
+            self.assertIsNone(cache.get("rabrams/daily", "v2"))
+        setter.join()
+        self.assertEqual(2, cache.get("rabrams/daily", "v2"))
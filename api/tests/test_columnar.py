@@ -0,0 +1,107 @@
+"""
+Unit tests for the columnar export encodings
+"""
+
+import struct
+import unittest
+
+from api import columnar
+
+COLUMNS = [("key", "string"), ("hours", "number"), ("note", "string"),
+           ("slept_in", "bool"), ("steps", "int")]
+
+ROWS = [
+    ("2017-01-01", {
+        "hours": 7.5,
+        "note": "café",
+        "slept_in": True,
+        "steps": 12000
+    }),
+    ("2017-01-02", {
+        "hours": 6,
+        "slept_in": False,
+        "steps": "many"
+    }),
+]
+
+
+class ColumnarTests(unittest.TestCase):
+    """
+    Test encoding rows as CSV and in the binary columnar format
+    """
+
+    def test_columns(self):
+        """
+        test columns are the key then the schema's fields in name order
+        """
+        self.assertEqual(
+            COLUMNS,
+            columnar.columns({
+                "steps": {
+                    "type": "int"
+                },
+                "slept_in": {
+                    "type": "bool"
+                },
+                "note": {
+                    "type": "string"
+                },
+                "hours": {
+                    "type": "number"
+                },
+            }))
+
+    def test_csv(self):
+        """
+        test missing and mistyped values are empty cells in CSV
+        """
+        self.assertEqual(
+            "key,hours,note,slept_in,steps\n"
+            "2017-01-01,7.5,café,true,12000\n"
+            "2017-01-02,6,,false,\n",
+            "".join(columnar.export("csv", COLUMNS, ROWS, 1)))
+
+    def test_binary_round_trip(self):
+        """
+        test batches of the binary format are read back as columns
+        """
+        data = b"".join(
+            piece for piece in columnar.export("columns", COLUMNS, ROWS, 1))
+        self.assertEqual({
+            "key": ["2017-01-01", "2017-01-02"],
+            "hours": [7.5, 6.0],
+            "note": ["café", None],
+            "slept_in": [True, False],
+            "steps": [12000, None],
+        }, columnar.read_binary(data))
+
+    def test_binary_layout(self):
+        """
+        test fixed width columns are packed little-endian after their flags
+        """
+        batch = columnar.binary_batch([("key", "string"), ("steps", "int")],
+                                      [("a", {
+                                          "steps": 1
+                                      }), ("b", {})])
+        self.assertEqual(
+            struct.pack("<IBBIII", 2, 1, 1, 0, 1, 2) + b"ab" +
+            struct.pack("<BBqq", 1, 0, 1, 0), batch)
+
+    def test_unexportable(self):
+        """
+        test fields clashing with the key column or of unknown types are
+        rejected and out of range values are missing from binary batches
+        """
+        with self.assertRaises(ValueError):
+            columnar.columns({"key": {"type": "string"}})
+        with self.assertRaises(ValueError):
+            columnar.columns({"when": {"type": "date"}})
+        data = b"".join(
+            columnar.export("columns", COLUMNS[:1] + COLUMNS[-1:],
+                            [("a", {
+                                "steps": 2**70
+                            })], 1))
+        self.assertEqual({
+            "key": ["a"],
+            "steps": [None]
+        }, columnar.read_binary(data))
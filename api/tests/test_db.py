@@ -0,0 +1,59 @@
+"""
+Unit tests for the trackit db migration
+"""
+
+import unittest
+
+import mock
+
+import api.db
+from api.storage import PRIMARY_KEYS
+
+
+class InitDBTests(unittest.TestCase):
+    """
+    Test bringing the db schema up to date
+    """
+
+    def setUp(self):
+        """
+        Mock the rethinkdb module over a db holding all tables and indexes
+        """
+        patcher = mock.patch.object(api.db, "r")
+        self.r = patcher.start()
+        self.addCleanup(patcher.stop)
+        self.r.db_list.return_value.contains.return_value.run.return_value = (
+            True)
+        self.database = self.r.db.return_value
+        self.database.table_list.return_value.run.return_value = list(
+            PRIMARY_KEYS)
+        self.indexes = {
+            table: list(indexes)
+            for table, indexes in api.db.INDEXES.items()
+        }
+        self.r.expr.return_value.run.return_value = self.indexes
+
+    def test_up_to_date(self):
+        """
+        test nothing is created in an up to date db
+        """
+        api.db.init_db(None)
+        self.r.db_create.assert_not_called()
+        self.database.table_create.assert_not_called()
+        self.database.table.return_value.index_create.assert_not_called()
+
+    def test_missing(self):
+        """
+        test missing tables and indexes are created and waited for
+        """
+        self.database.table_list.return_value.run.return_value = ["data"]
+        self.indexes["data"].remove("modified")
+        api.db.init_db(None)
+        self.assertEqual(
+            sorted(set(PRIMARY_KEYS) - {"data"}),
+            [call[0][0] for call in self.database.table_create.call_args_list])
+        table = self.database.table.return_value
+        self.assertEqual(
+            ["modified"],
+            [call[0][0] for call in table.index_create.call_args_list])
+        table.index_wait.assert_called_once_with("modified")
@@ -0,0 +1,98 @@
+"""
+Unit tests for the trackit db connection pool
+"""
+
+import threading
+import unittest
+
+import mock
+
+import api.pool
+
+
+class ConnectionPoolTests(unittest.TestCase):
+    """
+    Test checking connections in and out of the pool
+    """
+
+    def setUp(self):
+        """
+        Create a small pool of mock connections with a controllable clock
+        """
+        self.now = 0
+        self.alive = True
+        self.pool = api.pool.ConnectionPool(
+            mock.Mock,
+            lambda conn: self.alive,
+            size=2,
+            timeout=0,
+            check_interval=30,
+            sleep=lambda secs: None,
+            clock=lambda: self.now)
+
+    def test_reuses_connections(self):
+        """
+        test a checked in connection is handed out again
+        """
+        conn = self.pool.checkout()
+        self.pool.checkin(conn)
+        self.assertIs(conn, self.pool.checkout())
+        self.assertEqual(1, self.pool.stats()["connects"])
+
+    def test_bounded(self):
+        """
+        test checkouts beyond the pool size time out
+        """
+        self.pool.checkout()
+        self.pool.checkout()
+        with self.assertRaises(api.pool.PoolTimeout):
+            self.pool.checkout()
+        self.assertEqual(2, self.pool.stats()["in_use"])
+
+    def test_replaces_dead_connections(self):
+        """
+        test idle connections failing their liveness check are replaced
+        """
+        conn = self.pool.checkout()
+        self.pool.checkin(conn)
+        self.now = 60
+        self.alive = False
+        self.assertIsNot(conn, self.pool.checkout())
+        conn.close.assert_called_once_with()
+        self.assertEqual(1, self.pool.stats()["reconnects"])
+
+    def test_discards_suspect_connections(self):
+        """
+        test a dead connection checked in after a failure frees its slot
+        """
+        conn = self.pool.checkout()
+        self.alive = False
+        self.pool.checkin(conn, suspect=True)
+        self.assertEqual(0, self.pool.stats()["open"])
+
+    def test_waits_for_checkin(self):
+        """
+        test a checkout blocks until another thread checks a connection in
+        """
+        self.pool.timeout = 5
+        conns = [self.pool.checkout(), self.pool.checkout()]
+        timer = threading.Timer(0.01, self.pool.checkin, [conns[0]])
+        timer.start()
+        self.assertIs(conns[0], self.pool.checkout())
+        timer.join()
+
+
+class RetryTests(unittest.TestCase):
+    """
+    Test retrying with backoff
+    """
+
+    def test_retries_until_success(self):
+        """
+        test a failing function is retried with the schedule's sleeps
+        """
+        func = mock.Mock(side_effect=[Exception(), Exception(), "conn"])
+        sleeps = []
+        self.assertEqual("conn", api.pool.retry(func, (1, 2, 4),
+                                                sleeps.append))
+        self.assertEqual([1, 2], sleeps)
@@ -0,0 +1,186 @@
+"""
+Unit tests for the trackit API storage backends
+"""
+
+import os
+import sqlite3
+import tempfile
+import unittest
+
+import mock
+
+import api.storage
+
+
+def _datum(username, schema, key, value):
+    """
+    Return a data row
+    """
+    return {
+        "key": "{}/{}/{}".format(username, schema, key),
+        "username": username,
+        "schema": schema,
+        "datum": {
+            "value": value
+        },
+    }
+
+
+class SQLiteStorageTests(unittest.TestCase):
+    """
+    Test the embedded SQLite storage
+    """
+
+    def setUp(self):
+        """
+        Create an in-memory database with data in two schemata
+        """
+        self.storage = api.storage.SQLiteStorage()
+        self.storage.upsert("data", [
+            _datum("rabrams", "daily", "2017-01-0{}".format(day), day)
+            for day in [3, 1, 2, 5, 4]
+        ] + [_datum("rabrams", "weekly", "2017-01-01", 0)])
+
+    def test_upsert_replaces(self):
+        """
+        test upserting a row with an existing key replaces it
+        """
+        self.storage.upsert("data",
+                            [_datum("rabrams", "daily", "2017-01-01", 10)])
+        self.assertEqual({
+            "value": 10
+        }, self.storage.get("data", "rabrams/daily/2017-01-01")["datum"])
+        self.assertIsNone(self.storage.get("data", "rabrams/daily/missing"))
+
+    def test_upsert_reports_errors(self):
+        """
+        test rows that can't be written are reported rather than raised
+        """
+        written = self.storage.upsert("data", [{"key": "rabrams/daily/x"}])
+        self.assertEqual(1, written["errors"])
+        self.assertIn("username", written["first_error"])
+
+    def test_get_all(self):
+        """
+        test getting the rows of a schema by the compound index
+        """
+        rows = self.storage.get_all("data", "username_schema",
+                                    ["rabrams", "weekly"])
+        self.assertEqual(["rabrams/weekly/2017-01-01"],
+                         [row["key"] for row in rows])
+
+    def test_scan_schema(self):
+        """
+        test ranges of a schema's data are ordered by key
+        """
+        self.assertEqual(
+            [2, 3],
+            [
+                row["datum"]["value"] for row in self.storage.scan_schema(
+                    "rabrams", "daily", start="2017-01-02", end="2017-01-04")
+            ])
+        self.assertEqual([4, 5], [
+            row["datum"]["value"] for row in self.storage.scan_schema(
+                "rabrams", "daily", after="2017-01-03", limit=2)
+        ])
+
+    def test_stream_in_batches(self):
+        """
+        test streamed rows are all read in order across batches
+        """
+        with mock.patch.object(api.storage, "STREAM_BATCH_SIZE", 2):
+            rows = list(self.storage.scan("data", stream=True))
+        self.assertEqual(
+            sorted(row["key"] for row in rows), [row["key"] for row in rows])
+        self.assertEqual(6, len(rows))
+
+    def test_scan_modified(self):
+        """
+        test scanning the rows written since a time, with rows written before
+        it was recorded as modified at time 0
+        """
+        row = dict(_datum("rabrams", "daily", "2017-01-06", 6), modified=10)
+        self.storage.upsert("data", [row])
+        self.assertEqual([row], list(self.storage.scan_modified("data", 10)))
+        self.assertEqual([row],
+                         list(
+                             self.storage.scan_modified(
+                                 "data", 5, stream=True)))
+        self.assertEqual(7, len(list(self.storage.scan_modified("data", 0))))
+
+    def test_adds_modified_column(self):
+        """
+        test a database file created without modified times is migrated
+        """
+        with tempfile.TemporaryDirectory() as directory:
+            path = os.path.join(directory, "trackit.db")
+            api.storage.SQLiteStorage(path)
+            conn = sqlite3.connect(path)
+            conn.executescript(
+                "DROP INDEX data_modified; ALTER TABLE data DROP modified")
+            conn.close()
+            storage = api.storage.SQLiteStorage(path)
+            storage.upsert("data",
+                           [_datum("rabrams", "daily", "2017-01-01", 1)])
+            self.assertEqual(1, len(list(storage.scan_modified("data", 0))))
+
+    def test_delete_batch(self):
+        """
+        test deleting bounded batches of rows by index and by primary key
+        """
+        self.assertEqual(["rabrams/weekly/2017-01-01"],
+                         self.storage.delete_batch(
+                             "data", "username_schema", ["rabrams", "weekly"],
+                             10))
+        self.assertEqual(
+            3, len(self.storage.delete_batch("data", "username", "rabrams",
+                                             3)))
+        self.assertEqual(2, len(list(self.storage.scan("data"))))
+        self.assertEqual([],
+                         self.storage.delete_batch("data", "key", "missing",
+                                                   1))
+
+    def test_update_and_delete_all(self):
+        """
+        test setting fields on and deleting every row of a table
+        """
+        self.storage.upsert("versions", [{"name": "a", "version": "1"}])
+        self.storage.update_all("versions", {"version": "2"})
+        self.assertEqual({
+            "name": "a",
+            "version": "2"
+        }, self.storage.get("versions", "a"))
+        self.storage.delete_all("data")
+        self.assertEqual([], list(self.storage.scan("data")))
+
+    def test_soft_durability(self):
+        """
+        test soft upserts are written and leave other writes hard
+        """
+        self.storage.upsert(
+            "data", [_datum("rabrams", "daily", "2017-01-01", 10)],
+            durability="soft")
+        self.assertEqual({
+            "value": 10
+        }, self.storage.get("data", "rabrams/daily/2017-01-01")["datum"])
+        self.assertEqual(
+            2,
+            self.storage._conn.execute(  # pylint: disable=protected-access
+                "PRAGMA synchronous").fetchone()[0])
+
+    def test_persists_to_file(self):
+        """
+        test a database file is reopened with its rows
+        """
+        with tempfile.TemporaryDirectory() as directory:
+            path = os.path.join(directory, "trackit.db")
+            api.storage.SQLiteStorage(path).upsert(
+                "schemata", [{
+                    "name": "rabrams/daily",
+                    "username": "rabrams",
+                    "body": {}
+                }])
+            self.assertEqual(
+                {},
+                api.storage.SQLiteStorage(path).get("schemata",
+                                                    "rabrams/daily")["body"])
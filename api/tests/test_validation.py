@@ -0,0 +1,61 @@
+"""
+Unit tests for trackit schema validation
+"""
+
+import unittest
+
+from api.validation import ValidationError, compile_schema
+
+
+class CompileSchemaTests(unittest.TestCase):
+    """
+    Test compiling schemata into validators
+    """
+
+    def setUp(self):
+        """
+        Compile an example schema
+        """
+        self.validate = compile_schema({
+            "slept_in": {
+                "type": "bool",
+                "prompt": "Did you sleep in?"
+            },
+            "breakfast": {
+                "type": "string",
+                "prompt": "What did you have for breakfast?"
+            },
+        })
+
+    def test_valid_datum(self):
+        """
+        test a datum matching the schema validates
+        """
+        self.validate({"slept_in": True, "breakfast": "eggs"})
+
+    def test_wrong_type(self):
+        """
+        test a field of the wrong type is rejected
+        """
+        with self.assertRaises(ValidationError):
+            self.validate({"slept_in": "yes", "breakfast": "eggs"})
+
+    def test_missing_and_unknown_fields(self):
+        """
+        test data with missing or unknown fields are rejected
+        """
+        with self.assertRaises(ValidationError):
+            self.validate({"slept_in": True})
+        with self.assertRaises(ValidationError):
+            self.validate({
+                "slept_in": True,
+                "breakfast": "eggs",
+                "lunch": "soup"
+            })
+
+    def test_invalid_schema(self):
+        """
+        test a schema with an unknown type doesn't compile
+        """
+        with self.assertRaises(ValidationError):
+            compile_schema({"slept_in": {"type": "boolean"}})
@@ -0,0 +1,195 @@
+"""
+Unit tests for trackit materialized views
+"""
+
+import asyncio
+import unittest
+
+import api.views
+
+
+def _row(name, body):
+    """
+    Return a schemata row
+    """
+    return {"name": name, "username": name.split("/")[0], "body": body}
+
+
+class SchemataViewTests(unittest.TestCase):
+    """
+    Test maintaining a view of the schemata from a changefeed
+    """
+
+    def setUp(self):
+        """
+        Create a view over a scripted list of changefeeds
+        """
+        self.feeds = []
+        self.view = api.views.SchemataView(lambda: self.feeds.pop(0))
+
+    def test_ready_after_initial_values(self):
+        """
+        test the view is only swapped in once the initial values are loaded
+        """
+
+        def feed():
+            """
+            yield initial values and check the view isn't ready before them
+            """
+            yield {"state": "initializing"}
+            yield {"new_val": _row("rabrams/daily", {})}
+            self.assertFalse(self.view.ready)
+            yield {"state": "ready"}
+
+        self.view._consume(feed())
+        self.assertTrue(self.view.ready)
+        self.assertEqual({"daily": {}}, self.view.namespace("rabrams"))
+
+    def test_applies_changes(self):
+        """
+        test updates and deletes are applied to the view
+        """
+        self.view._consume([
+            {
+                "new_val": _row("rabrams/daily", {})
+            },
+            {
+                "new_val": _row("rabrams/weekly", {})
+            },
+            {
+                "state": "ready"
+            },
+            {
+                "old_val": _row("rabrams/daily", {}),
+                "new_val": _row("rabrams/daily", {
+                    "a": {
+                        "type": "bool"
+                    }
+                })
+            },
+            {
+                "old_val": _row("rabrams/weekly", {}),
+                "new_val": None
+            },
+        ])
+        self.assertEqual({
+            "daily": {
+                "a": {
+                    "type": "bool"
+                }
+            }
+        }, self.view.namespace("rabrams"))
+        self.assertIsNone(self.view.get("rabrams", "weekly"))
+
+    def test_revisions(self):
+        """
+        test a schema's revision changes with it and with every rebuild
+        """
+        self.view._consume([{
+            "new_val": _row("rabrams/daily", {})
+        }, {
+            "state": "ready"
+        }])
+        first = self.view.revision("rabrams", "daily")
+        self.view._receive(self.view._schemata, {
+            "new_val": _row("rabrams/weekly", {})
+        })
+        self.assertEqual(first, self.view.revision("rabrams", "daily"))
+        self.view._receive(self.view._schemata, {
+            "old_val": _row("rabrams/daily", {}),
+            "new_val": _row("rabrams/daily", {
+                "a": {
+                    "type": "bool"
+                }
+            })
+        })
+        second = self.view.revision("rabrams", "daily")
+        self.assertNotEqual(first, second)
+        self.view._consume([{"state": "ready"}])
+        self.assertNotIn(self.view.revision("rabrams", "daily"),
+                         [first, second])
+
+    def test_rebuilds_after_drop(self):
+        """
+        test a dropped feed is reopened and the view rebuilt
+        """
+
+        def dropped():
+            """
+            yield a schema and then fail
+            """
+            yield {"new_val": _row("rabrams/daily", {})}
+            yield {"state": "ready"}
+            raise IOError("connection lost")
+
+        sleeps = []
+
+        def sleep(secs):
+            """
+            record the backoff and stop following once the feed is rebuilt
+            """
+            sleeps.append(secs)
+            if len(sleeps) > 1:
+                raise KeyboardInterrupt()
+
+        self.view.sleep = sleep
+        self.feeds = [
+            dropped(), [{
+                "new_val": _row("other/daily", {})
+            }, {
+                "state": "ready"
+            }]
+        ]
+        with self.assertRaises(KeyboardInterrupt):
+            self.view._follow()
+        self.assertEqual(2, self.view.rebuilds)
+        self.assertEqual({}, self.view.namespace("rabrams"))
+        self.assertEqual({"daily": {}}, self.view.namespace("other"))
+
+
+class AsyncSchemataViewTests(unittest.TestCase):
+    """
+    Test maintaining a view of the schemata from an asyncio changefeed
+    """
+
+    def test_rebuilds_after_drop(self):
+        """
+        test a dropped feed is reopened and the view rebuilt
+        """
+
+        async def dropped():
+            """
+            yield a schema and then fail
+            """
+            yield {"new_val": _row("rabrams/daily", {})}
+            yield {"state": "ready"}
+            raise IOError("connection lost")
+
+        async def rebuilt():
+            """
+            yield another schema
+            """
+            yield {"new_val": _row("other/daily", {})}
+            yield {"state": "ready"}
+
+        feeds = [dropped(), rebuilt()]
+
+        async def open_feed():
+            """
+            open the next scripted feed
+            """
+            return feeds.pop(0)
+
+        async def sleep(secs):
+            """
+            stop following once the feed is rebuilt
+            """
+            if not feeds:
+                raise KeyboardInterrupt()
+
+        view = api.views.AsyncSchemataView(open_feed, sleep=sleep)
+        with self.assertRaises(KeyboardInterrupt):
+            asyncio.run(view._follow())
+        self.assertEqual(2, view.rebuilds)
+        self.assertEqual({}, view.namespace("rabrams"))
+        self.assertEqual({"daily": {}}, view.namespace("other"))
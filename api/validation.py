@@ -0,0 +1,92 @@
+"""
+Schema validation for the trackit API
+
+A schema body maps each field name to a spec with at least a "type". Schema
+bodies are compiled once into validator functions so that validating a datum
+doesn't have to re-interpret the schema.
+"""
+
+
+class ValidationError(Exception):
+    """
+    Raised when a schema or a datum is invalid
+    """
+    pass
+
+
+def _is_bool(value):
+    """
+    Return true iff a value is a bool
+    """
+    return isinstance(value, bool)
+
+
+def _is_string(value):
+    """
+    Return true iff a value is a string
+    """
+    return isinstance(value, str)
+
+
+def _is_int(value):
+    """
+    Return true iff a value is an integer
+    """
+    return isinstance(value, int) and not isinstance(value, bool)
+
+
+def _is_number(value):
+    """
+    Return true iff a value is an integer or float
+    """
+    return isinstance(value, (int, float)) and not isinstance(value, bool)
+
+
+TYPE_CHECKS = {
+    "bool": _is_bool,
+    "string": _is_string,
+    "int": _is_int,
+    "number": _is_number,
+}
+
+
+def compile_schema(body):
+    """
+    Compile a schema body into a function that validates a datum
+
+    Raises ValidationError if the schema body itself is invalid. The returned
+    function raises ValidationError if a datum does not have exactly the
+    fields of the schema with values of the declared types.
+    """
+    if not isinstance(body, dict):
+        raise ValidationError("schema must map field names to specs")
+    checks = []
+    for field, spec in body.items():
+        if not isinstance(spec, dict) or "type" not in spec:
+            raise ValidationError("field {} must declare a type".format(field))
+        if spec["type"] not in TYPE_CHECKS:
+            raise ValidationError("field {} has unknown type {}".format(
+                field, spec["type"]))
+        checks.append((field, spec["type"], TYPE_CHECKS[spec["type"]]))
+    checks = tuple(checks)
+    fields = frozenset(body)
+
+    def validate(datum):
+        """
+        Validate a datum against the compiled schema
+        """
+        if not isinstance(datum, dict):
+            raise ValidationError("datum must be an object")
+        if datum.keys() != fields:
+            missing = sorted(fields - datum.keys())
+            if missing:
+                raise ValidationError("missing fields: {}".format(
+                    ", ".join(missing)))
+            raise ValidationError("unknown fields: {}".format(", ".join(
+                sorted(datum.keys() - fields))))
+        for field, type_name, check in checks:
+            if not check(datum[field]):
+                raise ValidationError("field {} must be of type {}".format(
+                    field, type_name))
+
+    return validate
@@ -0,0 +1,183 @@
+"""
+In-process materialized views of trackit tables
+"""
+
+import asyncio
+import logging
+import threading
+import time
+
+from api.pool import BACKOFF_SCHEDULE
+
+LOGGER = logging.getLogger(__name__)
+
+
+class SchemataView(object):
+    """
+    An in-memory copy of all schemata keyed by namespace kept current from a
+    changefeed on the schemata table
+
+    open_feed must return an iterable of changes from
+    table("schemata").changes(include_initial=True, include_states=True). The
+    feed is consumed on a background thread and reopened with backoff if it
+    drops, in which case the view is rebuilt from the feed's initial values.
+    Each schema has a revision which changes whenever the view sees it change,
+    so that what's derived from a schema can be kept current without reading
+    it back from the db.
+    """
+
+    def __init__(self, open_feed, schedule=BACKOFF_SCHEDULE, sleep=time.sleep):
+        """
+        Initialize
+        """
+        self.open_feed = open_feed
+        self.schedule = schedule
+        self.sleep = sleep
+        self.ready = False
+        self.rebuilds = 0
+        self._schemata = {}
+        self._revisions = {}
+        self._lock = threading.Lock()
+        self._thread = None
+        self._attempt = 0
+
+    def start(self):
+        """
+        Start following the changefeed on a daemon thread
+        """
+        self._thread = threading.Thread(
+            target=self._follow, name="schemata-view", daemon=True)
+        self._thread.start()
+
+    def namespace(self, username):
+        """
+        Return the schemata of a namespace as a map of name to body
+        """
+        with self._lock:
+            return dict(self._schemata.get(username, {}))
+
+    def get(self, username, name):
+        """
+        Return the body of a schema or None if it doesn't exist
+        """
+        with self._lock:
+            return self._schemata.get(username, {}).get(name)
+
+    def revision(self, username, name):
+        """
+        Return the revision of a schema, which changes with its body
+        """
+        with self._lock:
+            return (self.rebuilds,
+                    self._revisions.get("{}/{}".format(username, name), 0))
+
+    def _follow(self):
+        """
+        Consume the changefeed forever reopening it when it drops
+        """
+        while True:
+            try:
+                self._consume(self.open_feed())
+                LOGGER.warning("Schemata changefeed ended")
+            except Exception:  # pylint: disable=broad-except
+                LOGGER.exception("Schemata changefeed dropped")
+            self.sleep(self._dropped())
+
+    def _dropped(self):
+        """
+        Mark the view stale once its changefeed dropped and return the seconds
+        to wait before reopening it
+        """
+        with self._lock:
+            self.ready = False
+        delay = self.schedule[min(self._attempt, len(self.schedule) - 1)]
+        self._attempt += 1
+        return delay
+
+    def _consume(self, feed):
+        """
+        Rebuild the view from a feed's initial values and then apply its
+        changes until it ends
+        """
+        pending = {}
+        for change in feed:
+            self._receive(pending, change)
+
+    def _receive(self, pending, change):
+        """
+        Apply a change of a feed to the schemata read from it, which replace
+        the view once the feed's initial values are all read
+        """
+        if change.get("state") == "ready":
+            with self._lock:
+                self._schemata = pending
+                self._revisions = {}
+                self.ready = True
+                self.rebuilds += 1
+                self._attempt = 0
+        elif "state" not in change:
+            with self._lock:
+                _apply(pending, change)
+                for row in (change.get("old_val"), change.get("new_val")):
+                    if row is not None:
+                        self._revisions[row["name"]] = self._revisions.get(
+                            row["name"], 0) + 1
+
+
+class AsyncSchemataView(SchemataView):
+    """
+    A SchemataView following its changefeed as a task of an event loop
+
+    open_feed must be a coroutine function returning an asynchronous iterable
+    of the changes, e.g. a changefeed on an asyncio connection.
+    """
+
+    def __init__(self, open_feed, schedule=BACKOFF_SCHEDULE,
+                 sleep=asyncio.sleep):
+        """
+        Initialize
+        """
+        super().__init__(open_feed, schedule, sleep)
+        self._task = None
+
+    def start(self):
+        """
+        Start following the changefeed as a task of the running event loop
+        """
+        self._task = asyncio.ensure_future(self._follow())
+
+    async def _follow(self):
+        """
+        Consume the changefeed forever reopening it when it drops
+        """
+        while True:
+            try:
+                await self._consume(await self.open_feed())
+                LOGGER.warning("Schemata changefeed ended")
+            except Exception:  # pylint: disable=broad-except
+                LOGGER.exception("Schemata changefeed dropped")
+            await self.sleep(self._dropped())
+
+    async def _consume(self, feed):
+        """
+        Rebuild the view from a feed's initial values and then apply its
+        changes until it ends
+        """
+        pending = {}
+        async for change in feed:
+            self._receive(pending, change)
+
+
+def _apply(schemata, change):
+    """
+    Apply a change of a schemata row to a map of namespace to schemata
+    """
+    old, new = change.get("old_val"), change.get("new_val")
+    if old is not None:
+        namespace = schemata.get(old["username"], {})
+        namespace.pop(old["name"].split("/", 1)[1], None)
+        if not namespace:
+            schemata.pop(old["username"], None)
+    if new is not None:
+        schemata.setdefault(new["username"], {})[new["name"].split(
+            "/", 1)[1]] = new["body"]
@@ -0,0 +1,50 @@
+"""
+WSGI application factory for the trackit API
+
+create_app() builds the flask app without touching the db, so that servers
+forking several workers, e.g. `gunicorn "api.wsgi:create_app()"`, call it in
+each worker after the fork and every worker opens its own connections on
+first use. The db schema is set up beforehand by api.db.migrate.
+"""
+
+import rethinkdb as r
+
+from api import db, settings
+from api.api import API
+from api.pool import ConnectionPool
+from api.storage import SQLiteStorage
+from api.views import SchemataView
+
+
+def _schemata_view():
+    """
+    Start a materialized view of the schemata if enabled
+    """
+    if not settings.SCHEMATA_VIEW:
+        return None
+    view = SchemataView(db.open_schemata_feed)
+    view.start()
+    return view
+
+
+def create_app():
+    """
+    Create the flask app on the configured storage
+    """
+    if settings.SQLITE_PATH:
+        return API(
+            None,
+            settings.DB_NAME,
+            storage=SQLiteStorage(settings.SQLITE_PATH),
+            **settings.api_options()).app
+    return API(
+        r,
+        settings.DB_NAME,
+        pool=ConnectionPool(
+            db.connect,
+            db.is_alive,
+            size=settings.DB_POOL_SIZE,
+            timeout=settings.DB_POOL_TIMEOUT,
+            check_interval=settings.DB_POOL_CHECK_INTERVAL),
+        schemata_view=_schemata_view(),
+        **settings.api_options()).app
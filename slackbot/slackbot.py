@@ -2,9 +2,17 @@
 Requests data from users over slack and posts to trackit
 """
 
+import concurrent.futures
 import datetime
 import json
+import logging
+import math
 import os
+import queue
+import threading
+import time
+
+import prometheus_client
 import requests
 
 from slackclient import SlackClient
@@ -15,6 +23,40 @@ USERS = os.environ["USERS"]
 CHANNEL = os.environ["CHANNEL"]
 PUBLIC_ENDPOINT = os.environ["PUBLIC_ENDPOINT"]
 PRIVATE_ENDPOINT = os.environ.get("PRIVATE_ENDPOINT", "api:5000")
+# seconds to wait for a user to answer a prompt before giving up on them
+RESPONSE_TIMEOUT = float(os.environ.get("RESPONSE_TIMEOUT", 12 * 60 * 60))
+# seconds to wait before reconnecting a dropped RTM connection, doubled
+# after each failed attempt up to the maximum
+RECONNECT_INTERVAL = 5
+MAX_RECONNECT_INTERVAL = 300
+# seconds for which the slack user directory is reused between triggers
+USERS_TTL = float(os.environ.get("USERS_TTL", 60 * 60))
+# port on which metrics are served in the Prometheus text format
+METRICS_PORT = int(os.environ.get("METRICS_PORT", 9100))
+
+# keep-alive connections to the API shared by all conversations
+SESSION = requests.Session()
+SESSION.mount("http://", requests.adapters.HTTPAdapter(pool_maxsize=64))
+
+LOGGER = logging.getLogger(__name__)
+
+RTM_EVENTS = prometheus_client.Counter(
+    "slackbot_rtm_events", "Events read from the RTM connection", ["type"])
+API_CALL_SECONDS = prometheus_client.Histogram(
+    "slackbot_api_call_seconds", "Time of calls to the slack and trackit APIs",
+    ["api", "call"])
+PROMPT_SECONDS = prometheus_client.Histogram(
+    "slackbot_prompt_seconds",
+    "Time for users to answer prompts",
+    buckets=(1, 10, 30, 60, 300, 900, 3600, 4 * 3600, 12 * 3600))
+PROMPT_TIMEOUTS = prometheus_client.Counter(
+    "slackbot_prompt_timeouts", "Prompts users did not answer in time")
+CONVERSATIONS = prometheus_client.Gauge(
+    "slackbot_conversations_in_progress", "Users data is being collected from")
+CONVERSATION_SECONDS = prometheus_client.Histogram(
+    "slackbot_conversation_seconds",
+    "Time to collect data from a user by outcome", ["outcome"],
+    buckets=(10, 60, 300, 900, 3600, 4 * 3600, 12 * 3600, 24 * 3600))
 
 
 class PrompterID(object):
@@ -27,135 +69,357 @@ class PrompterID(object):
         self.username = username
 
 
+class PromptTimeout(Exception):
+    """
+    Raised when a user doesn't answer a prompt in time
+    """
+    pass
+
+
+class Dispatcher(object):
+    """
+    Reads events from a single RTM connection and routes messages to the
+    conversations waiting on their sender
+    """
+
+    def __init__(self, client, poll_interval=0.5):
+        """
+        Initialize
+        """
+        self.client = client
+        self.poll_interval = poll_interval
+        self._queues = {}
+        self._lock = threading.Lock()
+
+    def start(self):
+        """
+        Connect and start reading events on a daemon thread
+        """
+        self.client.rtm_connect()
+        thread = threading.Thread(
+            target=self._read_forever, name="rtm-dispatcher", daemon=True)
+        thread.start()
+
+    def subscribe(self, user):
+        """
+        Return a queue receiving all messages sent by a user
+        """
+        replies = queue.Queue()
+        with self._lock:
+            self._queues[user] = replies
+        return replies
+
+    def unsubscribe(self, user):
+        """
+        Stop routing messages sent by a user
+        """
+        with self._lock:
+            self._queues.pop(user, None)
+
+    def dispatch(self, event):
+        """
+        Route an event to the conversation waiting on its sender if any
+        """
+        RTM_EVENTS.labels(event.get('type', 'unknown')).inc()
+        if event.get('type') != 'message' or 'user' not in event:
+            return
+        with self._lock:
+            replies = self._queues.get(event['user'])
+        if replies is not None:
+            replies.put(event)
+
+    def _read_forever(self):
+        """
+        Read and dispatch events sleeping whenever none are pending
+        """
+        while True:
+            try:
+                events = self.client.rtm_read()
+            except Exception:  # pylint: disable=broad-except
+                LOGGER.exception("Lost RTM connection; reconnecting")
+                self._reconnect()
+                continue
+            if not events:
+                time.sleep(self.poll_interval)
+            for event in events:
+                self.dispatch(event)
+
+    def _reconnect(self):
+        """
+        Reconnect to RTM retrying with exponential backoff until it succeeds
+        """
+        interval = RECONNECT_INTERVAL
+        while True:
+            time.sleep(interval)
+            try:
+                if self.client.rtm_connect():
+                    return
+                LOGGER.error("Could not reconnect to RTM; retrying")
+            except Exception:  # pylint: disable=broad-except
+                LOGGER.exception("Could not reconnect to RTM; retrying")
+            interval = min(interval * 2, MAX_RECONNECT_INTERVAL)
+
+
 class SlackPrompter(object):
     """
     Interacts with users to ask questions and collect responses
     """
 
-    def __init__(self, token, channel, target, prompter_id):
+    def __init__(self, client, dispatcher, channel, target, prompter_id):
         """
         Initialize
         """
-        self.client = SlackClient(token)
+        self.client = client
+        self.dispatcher = dispatcher
         self.channel = channel
         self.icon_emoji = prompter_id.icon_emoji
         self.username = prompter_id.username
         self.target = target
-        self.client.rtm_connect()
+        self.replies = dispatcher.subscribe(target)
+
+    def close(self):
+        """
+        Stop receiving the target's messages
+        """
+        self.dispatcher.unsubscribe(self.target)
 
     def send_message(self, message):
         """
         Send a signle message
         """
-        return self.client.api_call(
-            "chat.postMessage",
-            channel=self.channel,
-            text=message,
-            username=self.username,
-            icon_emoji=self.icon_emoji)
+        with API_CALL_SECONDS.labels("slack", "chat.postMessage").time():
+            return self.client.api_call(
+                "chat.postMessage",
+                channel=self.channel,
+                text=message,
+                username=self.username,
+                icon_emoji=self.icon_emoji)
 
-    # TODO(rabrams) refactor common message detection
-    def prompt(self, question):
+    def _reply(self, message, matches, timeout):
         """
-        Ask the user a question and return the response
+        Block until the target replies to a message with text that matches
         """
-        message = self.send_message("<@{}> {}".format(self.target, question))
         channelid = message['channel']
         timestamp = float(message['ts'])
+        started = time.monotonic()
+        deadline = None if timeout is None else started + timeout
         while True:
-            events = self.client.rtm_read()
-            for event in events:
-                if event['type'] == 'message' and \
-                   event['channel'] == channelid and \
-                   float(event['ts']) > timestamp and \
-                   'user' in event and \
-                   event['user'] == self.target:
-                    return event['text']
+            remaining = None
+            if deadline is not None:
+                remaining = max(deadline - time.monotonic(), 0)
+            try:
+                event = self.replies.get(timeout=remaining)
+            except queue.Empty:
+                PROMPT_TIMEOUTS.inc()
+                raise PromptTimeout("<@{}> did not reply".format(self.target))
+            if event.get('channel') == channelid and \
+               float(event['ts']) > timestamp and \
+               matches(event.get('text', '')):
+                PROMPT_SECONDS.observe(time.monotonic() - started)
+                return event['text']
+
+    def prompt(self, question, timeout=None):
+        """
+        Ask the user a question and return the response
+        """
+        message = self.send_message("<@{}> {}".format(self.target, question))
+        return self._reply(message, lambda text: True, timeout)
 
-    def waitfor(self, init_message, prefix):
+    def waitfor(self, init_message, prefix, timeout=None):
         """
         Wait for a message with a given prefix
         """
         message = self.send_message("<@{}> {}".format(self.target,
                                                       init_message))
-        channelid = message['channel']
-        timestamp = float(message['ts'])
-        while True:
-            events = self.client.rtm_read()
-            for event in events:
-                if event['type'] == 'message' and \
-                   event['channel'] == channelid and \
-                   float(event['ts']) > timestamp and \
-                   event.get('user') == self.target and \
-                   event.get('text', '').startswith(prefix):
-                    return event['text'][len(prefix):]
+        text = self._reply(message, lambda text: text.startswith(prefix),
+                           timeout)
+        return text[len(prefix):]
+
+
+def _parse_bool(text):
+    """
+    Parse a yes or no answer
+    """
+    answer = text.strip().lower()
+    if answer in ('yes', 'y'):
+        return True
+    if answer in ('no', 'n'):
+        return False
+    raise ValueError("not yes or no: {}".format(text))
+
+
+def _parse_number(text):
+    """
+    Parse a finite number
+    """
+    value = float(text)
+    if not math.isfinite(value):
+        raise ValueError("not a finite number: {}".format(text))
+    return value
+
+
+# parser of the answers to questions for each field type and the prompt
+# asking again for answers that don't parse
+ANSWER_PARSERS = {
+    "bool": (_parse_bool, "Please answer *yes* or *no*"),
+    "int": (int, "Please answer with a whole number"),
+    "number": (_parse_number, "Please answer with a number"),
+    "string": (str, None),
+}
+
+
+def _ask(prompter, param_schema):
+    """
+    Ask the question of a field and return the answer as the field's type,
+    asking again until the answer parses
+    """
+    parse, retry_prompt = ANSWER_PARSERS.get(param_schema['type'],
+                                             ANSWER_PARSERS['string'])
+    response = prompter.prompt(
+        param_schema['prompt'].replace("?", " yesterday?"), RESPONSE_TIMEOUT)
+    while True:
+        try:
+            return parse(response)
+        except ValueError:
+            response = prompter.prompt(retry_prompt, RESPONSE_TIMEOUT)
 
 
-def collect_data(schema, slack_user, namespace):
+def collect_data(schema, slack_user, namespace, client, dispatcher):
     """
     Collect and post data for a user
     """
     prompter_id = PrompterID(':date:', 'trackbot')
-    prompter = SlackPrompter(TOKEN, CHANNEL, slack_user, prompter_id)
-    attrs = {}
-
-    for param, param_schema in schema.items():
-        response = prompter.prompt(param_schema['prompt'].replace(
-            "?", " yesterday?"))
-        # TODO(rabrams) comprehensive schema validation
-        if param_schema['type'] == "bool":
-            while response.lower() not in ['yes', 'no', 'y', 'n']:
-                response = prompter.prompt("Please answer *yes* or *no*")
-            response = response.lower().startswith('y')
-        attrs[param] = response
-
-    yesterday = datetime.datetime.today() - datetime.timedelta(days=1)
-    key = yesterday.date().isoformat()
-    url = "http://{}/data/{}/daily/{}/".format(PRIVATE_ENDPOINT, namespace,
-                                               key)
-    display_url = "{}/data/{}/daily/{}/".format(PUBLIC_ENDPOINT, namespace,
-                                                key)
-    data = json.dumps(attrs, indent=4)
-    requests.put(url, headers={'Content-type': 'application/json'}, data=data)
-    prompter.send_message(
-        "Ok, <@{}>. I collected the following JSON:\n```\n{}\n```\nand stored at {}".
-        format(slack_user, data, display_url))
-
-
-def run():
+    prompter = SlackPrompter(client, dispatcher, CHANNEL, slack_user,
+                             prompter_id)
+    started = time.monotonic()
+    outcome = "error"
+    CONVERSATIONS.inc()
+    try:
+        attrs = {
+            param: _ask(prompter, param_schema)
+            for param, param_schema in schema.items()
+        }
+
+        yesterday = datetime.datetime.today() - datetime.timedelta(days=1)
+        key = yesterday.date().isoformat()
+        url = "http://{}/data/{}/daily/{}/".format(PRIVATE_ENDPOINT,
+                                                   namespace, key)
+        display_url = "{}/data/{}/daily/{}/".format(PUBLIC_ENDPOINT,
+                                                    namespace, key)
+        data = json.dumps(attrs, indent=4)
+        with API_CALL_SECONDS.labels("trackit", "set_datum").time():
+            response = SESSION.put(
+                url, headers={'Content-type': 'application/json'}, data=data)
+        response.raise_for_status()
+        prompter.send_message(
+            "Ok, <@{}>. I collected the following JSON:\n```\n{}\n```\nand stored at {}".
+            format(slack_user, data, display_url))
+        outcome = "collected"
+    except PromptTimeout:
+        outcome = "timeout"
+        prompter.send_message("<@{}> I'll ask again next time".format(
+            slack_user))
+    except requests.RequestException as error:
+        LOGGER.exception("Failed to store data for %s", namespace)
+        prompter.send_message(
+            "<@{}> Sorry, I couldn't store your data: {}".format(
+                slack_user, error))
+    finally:
+        prompter.close()
+        CONVERSATIONS.dec()
+        CONVERSATION_SECONDS.labels(outcome).observe(time.monotonic() -
+                                                     started)
+
+
+def _fetch_schemata(namespaces):
+    """
+    Fetch the schemata of several namespaces in a single request
+    """
+    params = [("namespace", namespace) for namespace in namespaces]
+    with API_CALL_SECONDS.labels("trackit", "get_schemata").time():
+        response = SESSION.get(
+            "http://{}/schemata/".format(PRIVATE_ENDPOINT), params=params)
+    response.raise_for_status()
+    return response.json()
+
+
+class UserDirectory(object):
+    """
+    The members of the slack team, refetched at most once every ttl seconds
+    """
+
+    def __init__(self, client, ttl=USERS_TTL, clock=time.monotonic):
+        """
+        Initialize
+        """
+        self.client = client
+        self.ttl = ttl
+        self.clock = clock
+        self._members = None
+        self._fetched = None
+
+    def members(self):
+        """
+        Return the members of the team
+        """
+        if self._members is None or self.clock() - self._fetched >= self.ttl:
+            with API_CALL_SECONDS.labels("slack", "users.list").time():
+                self._members = self.client.api_call("users.list")['members']
+            self._fetched = self.clock()
+        return self._members
+
+
+def run(client, dispatcher, directory):
     """
     Collect and post data from users interactively via slack
+
+    Conversations with all users run concurrently over the dispatcher's
+    single RTM connection.
     """
-    client = SlackClient(TOKEN)
-    all_users = client.api_call("users.list")['members']
     desired_users = USERS.strip().split(",")
     users = {
         user['id']: user['name']
-        for user in all_users if user['name'] in desired_users
+        for user in directory.members() if user['name'] in desired_users
     }
     users_by_name = {name: userid for userid, name in users.items()}
     # TODO(rabrams) notify botmaster if any users are missing
     master_channel = "@{}".format(BOTMASTER)
     prompter_id = PrompterID(':date:', 'trackbot')
-    prompter = SlackPrompter(TOKEN, master_channel, users_by_name[BOTMASTER],
-                             prompter_id)
-    prompter.waitfor("Trackbot initialized", "@trackbot trigger")
-    for slack_user, namespace in users.items():
-        user_schemata = requests.get("http://{}/schemata/{}/".format(
-            PRIVATE_ENDPOINT, namespace)).json()
-        if 'daily' in user_schemata:
-            collect_data(user_schemata['daily'], slack_user, namespace)
-        else:
-            prompter.send_message("Skipping {}: no schema found".format(
-                namespace))
+    prompter = SlackPrompter(client, dispatcher, master_channel,
+                             users_by_name[BOTMASTER], prompter_id)
+    try:
+        prompter.waitfor("Trackbot initialized", "@trackbot trigger")
+    finally:
+        prompter.close()
+    schemata = _fetch_schemata(sorted(users.values()))
+    with concurrent.futures.ThreadPoolExecutor(
+            max_workers=max(len(users), 1)) as executor:
+        futures = {}
+        for slack_user, namespace in users.items():
+            if 'daily' not in schemata.get(namespace, {}):
+                prompter.send_message("Skipping {}: no schema found".format(
+                    namespace))
+                continue
+            futures[executor.submit(collect_data, schemata[namespace]['daily'],
+                                    slack_user, namespace, client,
+                                    dispatcher)] = namespace
+        for future in concurrent.futures.as_completed(futures):
+            if future.exception() is not None:
+                LOGGER.error("Failed to collect data for %s: %s",
+                             futures[future], future.exception())
 
 
 def main():
     """
     Main entrypoint proc for slackbot
     """
+    client = SlackClient(TOKEN)
+    dispatcher = Dispatcher(client)
+    prometheus_client.start_http_server(METRICS_PORT)
+    dispatcher.start()
+    directory = UserDirectory(client)
     while True:
-        run()
+        run(client, dispatcher, directory)
 
 
 if __name__ == "__main__":
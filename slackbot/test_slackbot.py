@@ -2,14 +2,236 @@
 Unit tests for the slackbot
 """
 
+import json
+import os
+import threading
 import unittest
 
+import mock
+import prometheus_client
+import requests
+
+for _var in ["SLACK_TOKEN", "BOTMASTER", "USERS", "CHANNEL",
+             "PUBLIC_ENDPOINT"]:
+    os.environ.setdefault(_var, "test")
+
+from slackbot import slackbot  # pylint: disable=wrong-import-position
+
 
 class SlackbotTestCase(unittest.TestCase):
     """
     Abstract base class for slackbot test cases
     """
-    pass
 
+    def setUp(self):
+        """
+        Create a dispatcher over a mock slack client
+        """
+        self.client = mock.Mock()
+        self.client.api_call.return_value = {'channel': 'C1', 'ts': '1.0'}
+        self.dispatcher = slackbot.Dispatcher(self.client)
+
+    def prompter(self, target):
+        """
+        Create a prompter for a target user
+        """
+        return slackbot.SlackPrompter(self.client, self.dispatcher, 'C1',
+                                      target,
+                                      slackbot.PrompterID(':date:', 'bot'))
+
+    def message(self, user, text, ts='2.0', channel='C1'):
+        """
+        Dispatch a message as if it was read from the RTM connection
+        """
+        self.dispatcher.dispatch({
+            'type': 'message',
+            'user': user,
+            'channel': channel,
+            'ts': ts,
+            'text': text
+        })
+
+
+class DispatcherTests(SlackbotTestCase):
+    """
+    Tests routing of RTM events to conversations
+    """
+
+    def test_routes_by_user(self):
+        """
+        Test each prompter only sees replies from its target
+        """
+        alice, bob = self.prompter('U1'), self.prompter('U2')
+        self.message('U2', 'bob says')
+        self.message('U1', 'alice says')
+        self.assertEqual(alice.prompt("?", timeout=1), 'alice says')
+        self.assertEqual(bob.prompt("?", timeout=1), 'bob says')
+
+    def test_ignores_stale_and_other_channels(self):
+        """
+        Test replies older than the prompt or elsewhere are skipped
+        """
+        prompter = self.prompter('U1')
+        self.message('U1', 'old', ts='0.5')
+        self.message('U1', 'elsewhere', channel='C2')
+        self.message('U1', 'fresh')
+        self.assertEqual(prompter.prompt("?", timeout=1), 'fresh')
+
+    def test_waitfor_prefix(self):
+        """
+        Test waitfor skips messages without the prefix
+        """
+        prompter = self.prompter('U1')
+        self.message('U1', 'hello')
+        self.message('U1', '@trackbot trigger now')
+        self.assertEqual(
+            prompter.waitfor("init", "@trackbot trigger", timeout=1), ' now')
+
+    def test_timeout(self):
+        """
+        Test an unanswered prompt times out
+        """
+        timeouts = prometheus_client.REGISTRY.get_sample_value(
+            "slackbot_prompt_timeouts_total")
+        prompter = self.prompter('U1')
+        with self.assertRaises(slackbot.PromptTimeout):
+            prompter.prompt("?", timeout=0.01)
+        self.assertEqual(
+            timeouts + 1,
+            prometheus_client.REGISTRY.get_sample_value(
+                "slackbot_prompt_timeouts_total"))
+
+    def test_unsubscribe(self):
+        """
+        Test closed prompters stop receiving messages
+        """
+        prompter = self.prompter('U1')
+        prompter.close()
+        self.message('U1', 'dropped')
+        self.assertTrue(prompter.replies.empty())
+
+    def test_read_loop_sleeps_when_idle(self):
+        """
+        Test the read loop sleeps instead of spinning when idle
+        """
+        self.client.rtm_read.side_effect = [[], [{'type': 'hello'}],
+                                            KeyboardInterrupt]
+        with mock.patch.object(slackbot.time, 'sleep') as sleep:
+            with self.assertRaises(KeyboardInterrupt):
+                self.dispatcher._read_forever()  # pylint: disable=protected-access
+        sleep.assert_called_once_with(self.dispatcher.poll_interval)
+
+    def test_reconnect_retries(self):
+        """
+        Test failed reconnects are retried with backoff instead of killing
+        the read loop
+        """
+        self.client.rtm_read.side_effect = [
+            Exception("connection lost"), [{'type': 'hello'}],
+            KeyboardInterrupt
+        ]
+        self.client.rtm_connect.side_effect = [
+            Exception("slack down"), False, True
+        ]
+        with mock.patch.object(slackbot.time, 'sleep') as sleep:
+            with self.assertRaises(KeyboardInterrupt):
+                self.dispatcher._read_forever()  # pylint: disable=protected-access
+        self.assertEqual(3, self.client.rtm_connect.call_count)
+        self.assertEqual([mock.call(5), mock.call(10), mock.call(20)],
+                         sleep.call_args_list)
+
+
+class CollectTests(SlackbotTestCase):
+    """
+    Tests concurrent data collection
+    """
+
+    def test_users_collected_concurrently(self):
+        """
+        Test a slow user doesn't block collection from other users
+        """
+        started = threading.Barrier(2, timeout=5)
+
+        def collect(*_):
+            started.wait()
+
+        directory = mock.Mock()
+        directory.members.return_value = [{'id': 'U1', 'name': 'a'},
+                                          {'id': 'U2', 'name': 'b'},
+                                          {'id': 'U3', 'name': 'c'},
+                                          {'id': 'U0', 'name': 'test'}]
+        schemata = {'a': {'daily': {}}, 'b': {'daily': {}}, 'c': {}}
+        with mock.patch.object(slackbot, 'USERS', 'a,b,c,test'), \
+                mock.patch.object(slackbot, '_fetch_schemata',
+                                  return_value=schemata) as fetch, \
+                mock.patch.object(slackbot, 'collect_data',
+                                  side_effect=collect) as collect_data, \
+                mock.patch.object(slackbot.SlackPrompter, 'waitfor'):
+            slackbot.run(self.client, self.dispatcher, directory)
+        fetch.assert_called_once_with(['a', 'b', 'c', 'test'])
+        self.assertEqual(collect_data.call_count, 2)
+        self.assertFalse(started.broken)
+
+    def collect(self, answers, status=200):
+        """
+        Collect data for a schema from scripted answers and return the datum
+        put to the API and the messages sent
+        """
+        schema = {
+            'slept_in': {'type': 'bool', 'prompt': 'Slept in?'},
+            'hours': {'type': 'number', 'prompt': 'Hours?'},
+            'coffees': {'type': 'int', 'prompt': 'Coffees?'},
+        }
+        response = requests.Response()
+        response.status_code = status
+        with mock.patch.object(slackbot.SlackPrompter, 'prompt',
+                               side_effect=answers), \
+                mock.patch.object(slackbot.SlackPrompter,
+                                  'send_message') as send_message, \
+                mock.patch.object(slackbot.SESSION, 'put',
+                                  return_value=response) as put:
+            slackbot.collect_data(schema, 'U1', 'a', self.client,
+                                  self.dispatcher)
+        datum = json.loads(put.call_args[1]['data'])
+        return datum, [call[0][0] for call in send_message.call_args_list]
+
+    def test_answers_typed(self):
+        """
+        Test answers are sent as their field's type, asking again for those
+        that don't parse
+        """
+        datum, messages = self.collect(
+            ['maybe', 'Y', 'lots', '7.5', '2.5', '2'])
+        self.assertEqual({'slept_in': True, 'hours': 7.5, 'coffees': 2},
+                         datum)
+        self.assertTrue(messages[-1].startswith("Ok"))
+
+    def test_store_failure_reported(self):
+        """
+        Test the user is told when the API rejects their data
+        """
+        _, messages = self.collect(['n', '8', '0'], status=400)
+        self.assertIn("couldn't store", messages[-1])
+
+
+class UserDirectoryTests(unittest.TestCase):
+    """
+    Tests caching of the slack user directory
+    """
 
-# TODO(rabrams) full test suite
+    def test_refetched_after_ttl(self):
+        """
+        Test users.list is only called again once the ttl expires
+        """
+        now = [0]
+        client = mock.Mock()
+        client.api_call.return_value = {'members': []}
+        directory = slackbot.UserDirectory(client, ttl=10,
+                                           clock=lambda: now[0])
+        directory.members()
+        now[0] = 9
+        directory.members()
+        self.assertEqual(client.api_call.call_count, 1)
+        now[0] = 10
+        directory.members()
+        self.assertEqual(client.api_call.call_count, 2)
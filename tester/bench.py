@@ -0,0 +1,378 @@
+"""
+Load-generation benchmarks for the trackit API
+
+A workload of namespaces with a daily schema and a datum per ISO-date key is
+seeded into the target, after which a seeded mix of requests is replayed by a
+number of concurrent workers. Throughput and latency percentiles per route are
+reported as JSON so that runs can be compared.
+"""
+
+import argparse
+import collections
+import datetime
+import json
+import queue
+import random
+import sys
+import threading
+import time
+
+import requests
+
+# relative weights of each route in the default request mix
+DEFAULT_MIX = collections.OrderedDict([
+    ("get_datum", 50),
+    ("get_data", 25),
+    ("set_datum", 20),
+    ("get_archive", 1),
+    ("restore_archive", 4),
+])
+
+SCHEMA = {
+    "slept_in": {
+        "prompt": "Did you sleep in?",
+        "type": "bool"
+    },
+    "breakfast": {
+        "prompt": "What did you have for breakfast?",
+        "type": "string"
+    },
+    "hours": {
+        "prompt": "How many hours did you sleep?",
+        "type": "number"
+    },
+}
+
+
+class HTTPTarget(object):
+    """
+    Sends requests to a running API, e.g. through the proxy
+    """
+
+    def __init__(self, root_url):
+        """
+        Initialize
+        """
+        self.root_url = root_url.rstrip("/")
+        self.name = self.root_url
+        self._local = threading.local()
+
+    def request(self, method, path, body=None, mimetype="application/json"):
+        """
+        Send a request, read its whole response and return its status code
+        """
+        if not hasattr(self._local, "session"):
+            self._local.session = requests.Session()
+        response = self._local.session.request(
+            method,
+            self.root_url + path,
+            data=body,
+            headers={"Content-type": mimetype})
+        return response.status_code
+
+
+class AppTarget(object):
+    """
+    Sends requests straight to a flask app through its test client
+    """
+
+    def __init__(self, app, name):
+        """
+        Initialize
+        """
+        self.app = app
+        self.name = name
+        self._local = threading.local()
+
+    def request(self, method, path, body=None, mimetype="application/json"):
+        """
+        Send a request, read its whole response and return its status code
+        """
+        if not hasattr(self._local, "client"):
+            self._local.client = self.app.test_client()
+        response = self._local.client.open(
+            path, method=method, data=body, content_type=mimetype)
+        response.get_data()
+        response.close()
+        return response.status_code
+
+
+def sqlite_target(path=":memory:"):
+    """
+    Return a target running the API on an embedded SQLite database, in
+    memory by default
+    """
+    # pylint: disable=import-outside-toplevel
+    from api.api import API
+    from api.storage import SQLiteStorage
+
+    return AppTarget(
+        API(None, "trackit", storage=SQLiteStorage(path)).app,
+        "sqlite:{}".format(path))
+
+
+def rethinkdb_target(concurrency):
+    """
+    Return a target running the API on the RethinkDB configured by the api
+    settings, e.g. a local container
+    """
+    # pylint: disable=import-outside-toplevel
+    import rethinkdb as r
+
+    from api import db, settings
+    from api.api import API
+    from api.pool import ConnectionPool
+
+    db.migrate()
+    pool = ConnectionPool(db.connect, db.is_alive, size=concurrency)
+    return AppTarget(
+        API(r, settings.DB_NAME, pool=pool, **settings.api_options()).app,
+        "rethinkdb")
+
+
+class Workload(object):
+    """
+    A reproducible set of namespaces, keys and requests against them
+    """
+
+    def __init__(self, namespaces=20, days=365, seed=0):
+        """
+        Initialize
+        """
+        self.namespaces = ["bench-{:04d}".format(i) for i in range(namespaces)]
+        start = datetime.date(2017, 1, 1)
+        self.keys = [(start + datetime.timedelta(days=i)).isoformat()
+                     for i in range(days)]
+        self.random = random.Random(seed)
+
+    def datum(self):
+        """
+        Return a random datum of the schema
+        """
+        return {
+            "slept_in": self.random.random() < 0.5,
+            "breakfast": self.random.choice(["eggs", "toast", "nothing"]),
+            "hours": round(self.random.uniform(4, 10), 1),
+        }
+
+    def seed(self, target):
+        """
+        Create the schema and all data of every namespace
+        """
+        for namespace in self.namespaces:
+            _expect(target.request("PUT", "/schemata/{}/daily/".format(
+                namespace), json.dumps(SCHEMA)))
+            body = "".join(
+                json.dumps({
+                    "key": key,
+                    "datum": self.datum()
+                }) + "\n" for key in self.keys)
+            _expect(target.request("PUT", "/data/{}/daily/".format(namespace),
+                                   body, "application/x-ndjson"))
+
+    def archive(self, namespace):
+        """
+        Return a line-delimited archive of a namespace with fresh data
+        """
+        records = [{
+            "type": "schema",
+            "namespace": namespace,
+            "name": "daily",
+            "schema": SCHEMA
+        }]
+        records.extend({
+            "type": "datum",
+            "namespace": namespace,
+            "schema": "daily",
+            "key": key,
+            "datum": self.datum()
+        } for key in self.keys)
+        return "".join(json.dumps(record) + "\n" for record in records)
+
+    def operation(self, route):
+        """
+        Return a (route, method, path, body, mimetype) request for a route
+        """
+        namespace = self.random.choice(self.namespaces)
+        key = self.random.choice(self.keys)
+        if route == "get_datum":
+            return (route, "GET", "/data/{}/daily/{}/".format(namespace, key),
+                    None, None)
+        if route == "set_datum":
+            return (route, "PUT", "/data/{}/daily/{}/".format(namespace, key),
+                    json.dumps(self.datum()), "application/json")
+        if route == "get_data":
+            start = self.random.randrange(len(self.keys))
+            return (route, "GET",
+                    "/data/{}/daily/?start={}&limit=31".format(
+                        namespace, self.keys[start]), None, None)
+        if route == "get_archive":
+            return (route, "GET", "/archive/?format=ndjson", None, None)
+        if route == "restore_archive":
+            return (route, "PUT", "/archive/", self.archive(namespace),
+                    "application/x-ndjson")
+        raise ValueError("unknown route {}".format(route))
+
+    def operations(self, count, mix=DEFAULT_MIX):
+        """
+        Return count requests drawn from a weighted mix of routes
+        """
+        routes = [route for route, weight in mix.items() if weight > 0]
+        weights = [mix[route] for route in routes]
+        return [
+            self.operation(route)
+            for route in self.random.choices(routes, weights, k=count)
+        ]
+
+
+def _expect(status):
+    """
+    Fail unless a status code is a success
+    """
+    if status >= 400:
+        raise RuntimeError("seeding failed with status {}".format(status))
+
+
+def _percentile(samples, fraction):
+    """
+    Return the nearest-rank percentile of sorted samples
+    """
+    return samples[min(len(samples) - 1, int(fraction * len(samples)))]
+
+
+def summarize(samples, errors, seconds):
+    """
+    Summarize the latencies in seconds of one route's requests
+    """
+    samples = sorted(samples)
+    summary = {
+        "requests": len(samples),
+        "errors": errors,
+        "throughput": round(len(samples) / seconds, 2) if seconds else 0,
+    }
+    if samples:
+        summary.update({
+            "p50_ms": round(_percentile(samples, 0.50) * 1000, 3),
+            "p95_ms": round(_percentile(samples, 0.95) * 1000, 3),
+            "p99_ms": round(_percentile(samples, 0.99) * 1000, 3),
+            "max_ms": round(samples[-1] * 1000, 3),
+        })
+    return summary
+
+
+def run(target, operations, concurrency=8, clock=time.perf_counter):
+    """
+    Replay operations against a target from concurrent workers and return a
+    report of throughput and latency per route
+    """
+    pending = queue.Queue()
+    for operation in operations:
+        pending.put(operation)
+    latencies = collections.defaultdict(list)
+    errors = collections.Counter()
+    lock = threading.Lock()
+
+    def work():
+        """
+        Send requests until none are pending
+        """
+        while True:
+            try:
+                route, method, path, body, mimetype = pending.get_nowait()
+            except queue.Empty:
+                return
+            started = clock()
+            try:
+                failed = target.request(method, path, body,
+                                        mimetype or "application/json") >= 400
+            except Exception:  # pylint: disable=broad-except
+                failed = True
+            elapsed = clock() - started
+            with lock:
+                latencies[route].append(elapsed)
+                errors[route] += failed
+
+    started = clock()
+    workers = [threading.Thread(target=work) for _ in range(concurrency)]
+    for worker in workers:
+        worker.start()
+    for worker in workers:
+        worker.join()
+    seconds = clock() - started
+    return {
+        "target": target.name,
+        "concurrency": concurrency,
+        "requests": len(operations),
+        "errors": sum(errors.values()),
+        "seconds": round(seconds, 3),
+        "throughput": round(len(operations) / seconds, 2) if seconds else 0,
+        "routes": {
+            route: summarize(samples, errors[route], seconds)
+            for route, samples in sorted(latencies.items())
+        },
+    }
+
+
+def _parse_mix(spec):
+    """
+    Parse a mix given as route=weight pairs separated by commas
+    """
+    mix = collections.OrderedDict((route, 0) for route in DEFAULT_MIX)
+    for pair in spec.split(","):
+        route, _, weight = pair.partition("=")
+        if route not in mix:
+            raise argparse.ArgumentTypeError("unknown route {}".format(route))
+        mix[route] = int(weight)
+    return mix
+
+
+def main(*args):
+    """
+    Run a benchmark given command line arguments and print its report
+    """
+    parser = argparse.ArgumentParser(prog="bench", description=__doc__)
+    parser.add_argument(
+        "--target",
+        default="memory",
+        help="memory, sqlite:<path>, rethinkdb, or the root url of a running"
+        " API")
+    parser.add_argument("--concurrency", type=int, default=8)
+    parser.add_argument("--requests", type=int, default=2000)
+    parser.add_argument("--namespaces", type=int, default=20)
+    parser.add_argument("--days", type=int, default=365)
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument(
+        "--mix",
+        type=_parse_mix,
+        default=DEFAULT_MIX,
+        help="route weights, e.g. get_datum=50,set_datum=50")
+    parser.add_argument("--output", help="write the report to this file")
+    options = parser.parse_args(args)
+
+    if options.target == "memory":
+        target = sqlite_target()
+    elif options.target.startswith("sqlite:"):
+        target = sqlite_target(options.target[len("sqlite:"):])
+    elif options.target == "rethinkdb":
+        target = rethinkdb_target(options.concurrency)
+    else:
+        target = HTTPTarget(options.target)
+    workload = Workload(options.namespaces, options.days, options.seed)
+    workload.seed(target)
+    report = run(target,
+                 workload.operations(options.requests, options.mix),
+                 options.concurrency)
+    report.update({
+        "namespaces": options.namespaces,
+        "days": options.days,
+        "mix": options.mix,
+    })
+    output = json.dumps(report, indent=4, sort_keys=True)
+    if options.output:
+        with open(options.output, "w") as report_file:
+            report_file.write(output + "\n")
+    print(output)
+
+
+if __name__ == "__main__":
+    main(*sys.argv[1:])
@@ -5,6 +5,7 @@ Test trackit API e2e
 import json
 import random
 import string
+import time
 import unittest
 
 import requests
@@ -56,6 +57,27 @@ class APITestCase(unittest.TestCase):
         self.assertEqual(result.status_code, 200)
         return result.json()
 
+    def put_data(self, username, schema, data, ndjson=False):
+        """
+        Set many data for a name and namespace given a map of key to datum
+        """
+        if ndjson:
+            headers = {'Content-type': 'application/x-ndjson'}
+            body = "\n".join(
+                json.dumps({
+                    "key": key,
+                    "datum": datum
+                }) for key, datum in data.items())
+        else:
+            headers = {'Content-type': 'application/json'}
+            body = json.dumps(data)
+        result = requests.put("{}/data/{}/{}/".format(self.root_url, username,
+                                                      schema),
+                              headers=headers,
+                              data=body)
+        self.assertEqual(result.status_code, 200)
+        return result.json()
+
     def get_datum(self, username, schema, key):
         """
         Return a datum for a named schema in a namespace given a key
@@ -65,6 +87,25 @@ class APITestCase(unittest.TestCase):
         self.assertEqual(result.status_code, 200)
         return result.json()
 
+    def get_aggregate(self, username, schema, **params):
+        """
+        Return an aggregation of the data of a named schema in a namespace
+        """
+        result = requests.get(
+            "{}/aggregate/{}/{}/".format(self.root_url, username, schema),
+            params=params)
+        self.assertEqual(result.status_code, 200)
+        return result.json()
+
+    def get_export(self, username, schema):
+        """
+        Return the CSV export of the data of a named schema in a namespace
+        """
+        result = requests.get("{}/export/{}/{}/".format(
+            self.root_url, username, schema))
+        self.assertEqual(result.status_code, 200)
+        return result.text
+
     def purge(self):
         """
         Delete all schemata and data
@@ -75,6 +116,22 @@ class APITestCase(unittest.TestCase):
         self.assertEqual(result.status_code, 200)
         return result.json()
 
+    def purge_schema(self, username, schema):
+        """
+        Purge a schema in the background and return its finished job
+        """
+        result = requests.post("{}/purge/{}/{}/".format(
+            self.root_url, username, schema))
+        self.assertEqual(result.status_code, 202)
+        for _ in range(100):
+            job = requests.get(self.root_url +
+                               result.headers["Location"]).json()
+            if job["status"] != "running":
+                return job
+            time.sleep(0.1)
+        self.fail("purge still running")
+        return None
+
     def put_archive(self, archive):
         """
         Restore an archive
@@ -85,11 +142,12 @@ class APITestCase(unittest.TestCase):
         self.assertEqual(result.status_code, 200)
         return result.json()
 
-    def get_archive(self):
+    def get_archive(self, **params):
         """
         Return an archive of all schemata and data
         """
         result = requests.get("{}/archive/".format(self.root_url),
+                              params=params,
                               headers={'Content-type': 'application/json'})
         self.assertEqual(result.status_code, 200)
         return result.json()
@@ -138,6 +196,120 @@ class APITests(APITestCase):
         datum = self.get_datum(username, schema, "Hello")
         self.assertEqual(datum, {"message": "Hello World!"})
 
+    def test_put_and_get_data(self):
+        """
+        Test PUTting many data at once and GETting them
+        """
+        username = self.make_username()
+        schema = "test"
+        self.put_schema(username, schema, {"message": {"type": "string"}})
+        data = {
+            "2017-01-0{}".format(day): {
+                "message": "day {}".format(day)
+            }
+            for day in range(1, 4)
+        }
+        results = self.put_data(username, schema, data)
+        self.assertEqual(results, {key: {"status": "ok"} for key in data})
+        more_data = {"2017-01-04": {"message": "day 4"}}
+        self.put_data(username, schema, more_data, ndjson=True)
+        data.update(more_data)
+        self.assertEqual(data, self.get_data(username, schema))
+
+    def test_aggregate_data(self):
+        """
+        Test aggregating data in and grouped by months
+        """
+        username = self.make_username()
+        schema = "test"
+        self.put_schema(username, schema, {
+            "slept_in": {
+                "type": "bool"
+            },
+            "hours": {
+                "type": "number"
+            }
+        })
+        self.put_data(username, schema, {
+            "2017-01-30": {
+                "slept_in": True,
+                "hours": 9
+            },
+            "2017-01-31": {
+                "slept_in": False,
+                "hours": 7.5
+            },
+            "2017-02-01": {
+                "slept_in": True,
+                "hours": 8
+            },
+        })
+        self.assertEqual({
+            "value": 24.5
+        }, self.get_aggregate(username, schema, aggregate="sum", field="hours"))
+        self.assertEqual({
+            "value": 2
+        }, self.get_aggregate(username, schema, end="2017-02-01"))
+        self.assertEqual({
+            "groups": {
+                "2017-01": 0.5,
+                "2017-02": 1
+            }
+        },
+                         self.get_aggregate(
+                             username,
+                             schema,
+                             aggregate="ratio",
+                             field="slept_in",
+                             group="month"))
+        self.assertEqual({
+            "groups": {
+                "2017-01-30": 3
+            }
+        }, self.get_aggregate(username, schema, group="week"))
+
+    def test_export_data(self):
+        """
+        Test exporting data as CSV
+        """
+        username = self.make_username()
+        schema = "test"
+        self.put_schema(username, schema, {
+            "slept_in": {
+                "type": "bool"
+            },
+            "hours": {
+                "type": "number"
+            }
+        })
+        self.put_data(username, schema, {
+            "2017-01-30": {
+                "slept_in": True,
+                "hours": 9
+            },
+            "2017-01-31": {
+                "slept_in": False,
+                "hours": 7.5
+            },
+        })
+        lines = self.get_export(username, schema).splitlines()
+        self.assertEqual("key,hours,slept_in", lines[0])
+        self.assertEqual(
+            ["2017-01-30,9,true", "2017-01-31,7.5,false"], sorted(lines[1:]))
+
+    def test_purge_schema(self):
+        """
+        Test purging one schema leaves the others alone
+        """
+        username = self.make_username()
+        for schema in ("test", "other"):
+            self.put_schema(username, schema, {"field1": {"type": "int"}})
+            self.put_data(username, schema, {"datum1": {"field1": 1}})
+        job = self.purge_schema(username, "test")
+        self.assertEqual("done", job["status"])
+        self.assertEqual({"schemata": 1, "data": 1}, job["deleted"])
+        self.assertEqual(["other"], list(self.get_schemata(username)))
+
     def test_purge_put_and_get_archive(self):
         """
         Test purging, restoring, and GETting an archive
@@ -199,3 +371,11 @@ class APITests(APITestCase):
         self.purge()
         self.put_archive(archive)
         self.assertEqual(archive, self.get_archive())
+        self.assertEqual(archive, self.get_archive(stream=1))
+
+
+class AsyncAPITests(APITests):
+    """
+    The basic e2e tests run against the asyncio server mode of the API
+    """
+    root_url = "http://api-aio:5000"
@@ -6,6 +6,8 @@ import os
 import sys
 import time
 
+from tester import bench
+
 NOSEPATH = "/usr/local/bin/nosetests"
 
 
@@ -34,6 +36,13 @@ def test_all():
     os.execv(NOSEPATH, [NOSEPATH, "api", "slackbot", "tester"])
 
 
+def benchmark(*args):
+    """
+    Run load-generation benchmarks against the API
+    """
+    bench.main(*args)
+
+
 def main():
     """
     Module main entry proc
@@ -44,7 +53,12 @@ def main():
         while True:
             time.sleep(10000)
     else:
-        classes = {"unit": unit, "e2e": e2e, 'all': test_all}
+        classes = {
+            "unit": unit,
+            "e2e": e2e,
+            'all': test_all,
+            "bench": benchmark
+        }
         if args[0] in classes:
             classes[args[0]](*args[1:])
 